@@ -1,8 +1,11 @@
-import uuid, time, os, io, bcrypt, re, json, logging, logging.config, logging.handlers, secrets
-from PIL import Image
-from typing import List, Dict
+import uuid, os, bcrypt, re, json, logging, logging.config, logging.handlers, secrets
 from datetime import datetime, timedelta
 from fastapi import Request, HTTPException
+from . import counters
+from .asgi_middleware import next_request_id
+from .rate_limiter import SlidingWindowCounter, TokenBucket
+from .password_hashing import hash_password_sync
+from .cache import temp_csrf_cache, TEMP_CSRF_TTL
 
 # Setup logger for this module
 logger = logging.getLogger("security")
@@ -315,8 +318,34 @@ except ImportError:
     print("Warning: fastapi-limiter not available. Using basic rate limiting.")
 
 
-api_rate_limit_storage = {}
-api_rate_limit_storage: Dict[str, List[float]] = {}
+# Rate limiting policies (core/rate_limiter.py): O(1) per request, bounded memory, idle keys expire on their own
+def _limit(name: str) -> tuple:
+    config = RATE_LIMIT_CONFIG.get(name, {})
+    return config.get('max_requests', 100), config.get('window_seconds', 60)
+
+
+# Per (IP, endpoint) policies by endpoint class, used by check_api_rate_limit
+API_RATE_LIMITERS = {
+    'login': SlidingWindowCounter("api_login", *_limit('LOGIN_ATTEMPTS'), persist=True),
+    'mobile': TokenBucket("api_mobile", 30, 60),  # Higher limit for mobile endpoints
+    'api': TokenBucket("api", *_limit('API_ENDPOINTS')),
+    'upload': SlidingWindowCounter("api_upload", *_limit('UPLOAD_ENDPOINTS'), persist=True),
+    'general': TokenBucket("api_general", *_limit('GENERAL_REQUESTS')),
+}
+# Per IP policy, used by check_rate_limit
+general_rate_limiter = SlidingWindowCounter("general", *_limit('GENERAL_REQUESTS'))
+
+
+def _endpoint_class(endpoint: str) -> str:
+    if endpoint.startswith('/login') or endpoint.startswith('/register'):
+        return 'login'
+    if endpoint.startswith('/api/mobile/'):
+        return 'mobile'
+    if endpoint.startswith('/api/'):
+        return 'api'
+    if endpoint.startswith('/upload') or endpoint.startswith('/set_'):
+        return 'upload'
+    return 'general'
 
 
 # Rate limiter decorators for endpoints
@@ -356,75 +385,9 @@ def check_api_rate_limit(client_ip: str, endpoint: str) -> bool:
         if client_ip in ['127.0.0.1', 'localhost', '::1']:
             return True
         
-        # Get current timestamp
-        current_time = time.time()
-        
-        # Initialize rate limit storage if not exists
-        if not hasattr(check_api_rate_limit, 'rate_limit_data'):
-            check_api_rate_limit.rate_limit_data = {}
-        
-        # Clean up old entries (older than 1 hour) - limit cleanup to prevent memory issues
-        if len(check_api_rate_limit.rate_limit_data) > 1000:
-            check_api_rate_limit.rate_limit_data = {
-                key: value for key, value in check_api_rate_limit.rate_limit_data.items()
-                if current_time - value['timestamp'] < 3600
-            }
-        
-        # Create unique key for this IP and endpoint
-        key = f"{client_ip}:{endpoint}"
-        
-        # Get rate limit configuration based on endpoint
-        try:
-            if endpoint.startswith('/login') or endpoint.startswith('/register'):
-                config = RATE_LIMIT_CONFIG.get('LOGIN_ATTEMPTS', {})
-                max_requests = config.get('max_requests', 5)
-                window = config.get('window_seconds', 300)
-            elif endpoint.startswith('/api/mobile/'):
-                # Special handling for mobile endpoints with higher limits
-                max_requests = 30  # Higher limit for mobile endpoints
-                window = 60
-            elif endpoint.startswith('/api/'):
-                config = RATE_LIMIT_CONFIG.get('API_ENDPOINTS', {})
-                max_requests = config.get('max_requests', 100)
-                window = config.get('window_seconds', 60)
-            elif endpoint.startswith('/upload') or endpoint.startswith('/set_'):
-                config = RATE_LIMIT_CONFIG.get('UPLOAD_ENDPOINTS', {})
-                max_requests = config.get('max_requests', 50)
-                window = config.get('window_seconds', 60)
-            else:
-                config = RATE_LIMIT_CONFIG.get('GENERAL_REQUESTS', {})
-                max_requests = config.get('max_requests', 100)
-                window = config.get('window_seconds', 60)
-        except Exception as e:
-            logger.warning(f"Error accessing rate limit config: {e}")
-            # Use default values if config access fails
-            max_requests = 5
-            window = 300
-        
-        # Check if key exists and is within window
-        if key in check_api_rate_limit.rate_limit_data:
-            data = check_api_rate_limit.rate_limit_data[key]
-            
-            # If within window, check count
-            if current_time - data['timestamp'] < window:
-                if data['count'] >= max_requests:
-                    logger.warning(f"Rate limit exceeded for {client_ip} on {endpoint}: {data['count']}/{max_requests}")
-                    return False
-                else:
-                    data['count'] += 1
-            else:
-                # Reset for new window
-                check_api_rate_limit.rate_limit_data[key] = {
-                    'count': 1,
-                    'timestamp': current_time
-                }
-        else:
-            # First request
-            check_api_rate_limit.rate_limit_data[key] = {
-                'count': 1,
-                'timestamp': current_time
-            }
-        
+        if not API_RATE_LIMITERS[_endpoint_class(endpoint)].hit(f"{client_ip}|{endpoint}"):
+            logger.warning(f"Rate limit exceeded for {client_ip} on {endpoint}")
+            return False
         return True
         
     except Exception as e:
@@ -432,8 +395,12 @@ def check_api_rate_limit(client_ip: str, endpoint: str) -> bool:
         return True  # Allow on error to prevent blocking
 
 
+def api_rate_limit_info(client_ip: str, endpoint: str) -> tuple:
+    """(limit, remaining, reset epoch) of the policy covering this endpoint"""
+    return API_RATE_LIMITERS[_endpoint_class(endpoint)].info(f"{client_ip}|{endpoint}")
+
+
 def check_rate_limit(client_ip: str) -> bool:
-    global api_rate_limit_storage
     """Enhanced in-memory rate limiting with multiple rate types"""
     
     # Handle invalid IP addresses gracefully
@@ -444,65 +411,12 @@ def check_rate_limit(client_ip: str) -> bool:
     if is_local_test_request(client_ip):
         return True
     
-    current_time = time.time()
-    
-    # Safely access config with defaults
-    try:
-        config = RATE_LIMIT_CONFIG.get('GENERAL_REQUESTS', {})
-        window_seconds = config.get('window_seconds', 60)
-    except Exception as e:
-        logger.warning(f"Error accessing rate limit config: {e}")
-        window_seconds = 60  # Default to 1 minute
-    
-    window_start = current_time - window_seconds
-    
-    # Clean old entries
-    api_rate_limit_storage = {ip: timestamps for ip, timestamps in api_rate_limit_storage.items() 
-                            if any(ts > window_start for ts in timestamps)}
-    
-    # Check current IP
-    if client_ip not in api_rate_limit_storage:
-        api_rate_limit_storage[client_ip] = []
-    
-    # Remove old timestamps
-    api_rate_limit_storage[client_ip] = [ts for ts in api_rate_limit_storage[client_ip] if ts > window_start]
-    
-    # Check if limit exceeded
-    if len(api_rate_limit_storage[client_ip]) >= config['max_requests']:
-        return False
-    
-    # Add current request
-    api_rate_limit_storage[client_ip].append(current_time)
-    return True
-
-
-
-
-
-
-
-
-
-
-
+    return general_rate_limiter.hit(client_ip)
 
 
 def hash_password(password: str) -> str:
-    """Hash password using bcrypt for better security"""
-    try:
-        # Get salt rounds from environment variable or use default
-        salt_rounds = int(os.getenv('BCRYPT_ROUNDS', '12'))
-        salt = bcrypt.gensalt(rounds=salt_rounds)
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
-    except ImportError:
-        # Force bcrypt installation
-        logger.error("bcrypt is required for password hashing. Please install it: pip install bcrypt")
-        raise ImportError("bcrypt is required for password hashing")
-    except ValueError as e:
-        logger.error(f"Invalid salt rounds configuration: {e}")
-        # Fallback to default
-        salt = bcrypt.gensalt(rounds=12)
-        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    """Hash password using bcrypt (blocking; request handlers use password_hashing.hash_password_async)"""
+    return hash_password_sync(password)
 
 
 def verify_password_hash(plain_password: str, hashed_password: str) -> bool:
@@ -584,137 +498,87 @@ def detect_embedded_malicious_content(file_data: bytes) -> bool:
 
 
 
+def _build_security_header_block() -> list:
+    """Final (name, value) pairs apply_security_headers sets; computed once since none of them vary per request"""
+    headers = {}
+    # Base security headers from SECURITY_CONFIG (excluding problematic ones)
+    problematic_headers = {'Clear-Site-Data', 'Feature-Policy', 'Cache-Control', 'Pragma', 'Expires'}
+    for header, value in SECURITY_CONFIG['SECURITY_HEADERS'].items():
+        if value is not None and header not in problematic_headers:
+            headers[header] = value
+    # Remove potentially dangerous headers
+    for header in ('X-Powered-By', 'Server', 'X-AspNet-Version', 'X-AspNetMvc-Version'):
+        headers.pop(header, None)
+    headers.update({
+        'X-Content-Type-Options': 'nosniff',
+        'X-Frame-Options': 'DENY',
+        'X-XSS-Protection': '1; mode=block',
+        # Security event / API / content validation / network / compliance / monitoring / IoT headers
+        'X-Security-Event': 'none',
+        'X-Threat-Level': 'low',
+        'X-API-Key-Required': 'true',
+        'X-CSRF-Protection': 'enabled',
+        'X-Session-Timeout': '1800',
+        'X-Content-Validation': 'enabled',
+        'X-File-Scanning': 'enabled',
+        'X-Malware-Protection': 'enabled',
+        'X-Network-Security': 'enabled',
+        'X-Firewall-Status': 'active',
+        'X-DDoS-Protection': 'enabled',
+        'X-GDPR-Compliance': 'enabled',
+        'X-Privacy-Protection': 'enabled',
+        'X-Data-Encryption': 'enabled',
+        'X-Monitoring-Enabled': 'true',
+        'X-Audit-Logging': 'enabled',
+        'X-Performance-Monitoring': 'enabled',
+        'X-IoT-Security': 'enabled',
+        'X-Device-Authentication': 'required',
+        'X-WebSocket-Security': 'enabled',
+        # Additional security headers for enhanced protection (removed cache clearing)
+        'Cross-Origin-Embedder-Policy': 'unsafe-none',  # Allow external resources
+        'Cross-Origin-Opener-Policy': 'same-origin',
+        'Cross-Origin-Resource-Policy': 'cross-origin',  # Allow cross-origin resources
+    })
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()]
+
+
+SECURITY_HEADER_BLOCK = _build_security_header_block()
+# Header names replaced (or dropped) by apply_security_headers
+_SECURITY_HEADER_NAMES = frozenset(name for name, _ in SECURITY_HEADER_BLOCK) | {
+    b'x-request-id', b'x-powered-by', b'server', b'x-aspnet-version', b'x-aspnetmvc-version'}
+
+# Sent on every response by SecurityBaselineMiddleware, including streams and static files
+SECURITY_BASELINE_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'Referrer-Policy': SECURITY_CONFIG['SECURITY_HEADERS']['Referrer-Policy'],
+    'X-Permitted-Cross-Domain-Policies': 'none',
+}
+
+
 def apply_security_headers(response, request: Request = None):
     """Apply comprehensive security headers to any response object with enhanced security"""
     try:
-        # Generate unique request ID for tracking
-        request_id = secrets.token_hex(16)
-        
-        # Apply base security headers from SECURITY_CONFIG (excluding problematic ones)
-        problematic_headers = {'Clear-Site-Data', 'Feature-Policy', 'Cache-Control', 'Pragma', 'Expires'}
-        for header, value in SECURITY_CONFIG['SECURITY_HEADERS'].items():
-            if value is not None and header not in problematic_headers:  # Skip problematic headers
-                response.headers[header] = value
-        
-        # Remove potentially dangerous headers
-        dangerous_headers = ['X-Powered-By', 'Server', 'X-AspNet-Version', 'X-AspNetMvc-Version']
-        for header in dangerous_headers:
-            if header in response.headers:
-                del response.headers[header]
-        
-        # Set dynamic security headers
-        response.headers['X-Request-ID'] = request_id
-        response.headers['X-Content-Type-Options'] = 'nosniff'
-        response.headers['X-Frame-Options'] = 'DENY'
-        response.headers['X-XSS-Protection'] = '1; mode=block'
-        
-        # Enhanced CSP with nonce for inline scripts (removed TrustedHTML requirement)
-        if 'Content-Security-Policy' not in response.headers:
-            csp_nonce = secrets.token_hex(16)
-            csp_policy = (
-                "default-src 'self'; "
-                "script-src 'self' 'nonce-{}' 'unsafe-inline' 'unsafe-eval' "
-                "cdnjs.cloudflare.com https://speedcf.cloudflareaccess.com https://cdn.jsdelivr.net https://*.cloudflare.com; "
-                "style-src 'self' 'unsafe-inline' cdnjs.cloudflare.com fonts.googleapis.com https://cdn.jsdelivr.net https://*.cloudflare.com; "
-                "font-src 'self' cdnjs.cloudflare.com fonts.gstatic.com https://cdn.jsdelivr.net https://*.cloudflare.com; "
-                "img-src 'self' data: blob: http: https: https://*.cloudflare.com; "
-                "connect-src 'self' ws: wss: http: https: https://*.cloudflare.com; "
-                "object-src 'none'; "
-                "base-uri 'self'; "
-                "frame-ancestors 'none'; "
-                "worker-src 'self'; "
-                "manifest-src 'self';"
-            ).format(csp_nonce)
-            response.headers['Content-Security-Policy'] = csp_policy
-            response.headers['X-CSP-Nonce'] = csp_nonce
+        raw_headers = [(name, value) for name, value in response.raw_headers if name not in _SECURITY_HEADER_NAMES]
+        raw_headers.extend(SECURITY_HEADER_BLOCK)
+        raw_headers.append((b'x-request-id', next_request_id().encode('latin-1')))
         
         # Set rate limiting headers if available
         if request and hasattr(request, 'client') and request.client:
-            client_ip = request.client.host
-            # Get rate limit info from in-memory storage
-            if hasattr(check_api_rate_limit, 'rate_limit_data'):
-                rate_data = check_api_rate_limit.rate_limit_data.get(client_ip, {})
-                if rate_data:
-                    response.headers['X-RateLimit-Limit'] = str(rate_data.get('limit', 50))
-                    response.headers['X-RateLimit-Remaining'] = str(rate_data.get('remaining', 50))
-                    response.headers['X-RateLimit-Reset'] = str(rate_data.get('reset_time', 0))
-        
-        # Set security event headers
-        response.headers['X-Security-Event'] = 'none'
-        response.headers['X-Threat-Level'] = 'low'
-        
-        # Set API security headers
-        response.headers['X-API-Key-Required'] = 'true'
-        response.headers['X-CSRF-Protection'] = 'enabled'
-        response.headers['X-Session-Timeout'] = '1800'
-        
-        # Set content validation headers
-        response.headers['X-Content-Validation'] = 'enabled'
-        response.headers['X-File-Scanning'] = 'enabled'
-        response.headers['X-Malware-Protection'] = 'enabled'
-        
-        # Set network security headers
-        response.headers['X-Network-Security'] = 'enabled'
-        response.headers['X-Firewall-Status'] = 'active'
-        response.headers['X-DDoS-Protection'] = 'enabled'
-        
-        # Set compliance headers
-        response.headers['X-GDPR-Compliance'] = 'enabled'
-        response.headers['X-Privacy-Protection'] = 'enabled'
-        response.headers['X-Data-Encryption'] = 'enabled'
-        
-        # Set monitoring headers
-        response.headers['X-Monitoring-Enabled'] = 'true'
-        response.headers['X-Audit-Logging'] = 'enabled'
-        response.headers['X-Performance-Monitoring'] = 'enabled'
-        
-        # Set IoT security headers
-        response.headers['X-IoT-Security'] = 'enabled'
-        response.headers['X-Device-Authentication'] = 'required'
-        response.headers['X-WebSocket-Security'] = 'enabled'
-        
-        # Additional security headers for enhanced protection (removed cache clearing)
-        additional_headers = {
-            'Cross-Origin-Embedder-Policy': 'unsafe-none',  # Allow external resources
-            'Cross-Origin-Opener-Policy': 'same-origin',
-            'Cross-Origin-Resource-Policy': 'cross-origin'  # Allow cross-origin resources
-        }
-        
-        for header, value in additional_headers.items():
-            response.headers[header] = value
-            
-        # Remove or modify dangerous headers
-        if 'Server' in response.headers:
-            response.headers['Server'] = 'FastAPI-Security'
-        if 'X-Powered-By' in response.headers:
-            del response.headers['X-Powered-By']
-        
-        # Log security headers application
-        logger.debug(f"Applied security headers to response with request ID: {request_id}")
-            
+            limit, remaining, reset_at = api_rate_limit_info(request.client.host, request.url.path)
+            raw_headers = [(name, value) for name, value in raw_headers if not name.startswith(b'x-ratelimit-')]
+            raw_headers += [
+                (b'x-ratelimit-limit', str(limit).encode('latin-1')),
+                (b'x-ratelimit-remaining', str(remaining).encode('latin-1')),
+                (b'x-ratelimit-reset', str(reset_at).encode('latin-1')),
+            ]
+        
+        response.raw_headers = raw_headers
         return response
     except Exception as e:
         logger.error(f"Error applying security headers: {e}")
         return response
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 def detect_steganography(file_data: bytes) -> bool:
     """Detect steganography techniques in files"""
     try:
@@ -738,80 +602,20 @@ def detect_steganography(file_data: bytes) -> bool:
 def detect_lsb_steganography(file_data: bytes) -> bool:
     """Detect LSB (Least Significant Bit) steganography"""
     try:
-        # Convert to PIL Image for LSB analysis
-        img = Image.open(io.BytesIO(file_data))
-        
-        if img.mode not in ['RGB', 'RGBA']:
-            return False
-        
-        # Convert to numpy array for analysis
         import numpy as np
-        img_array = np.array(img)
-        
-        # Analyze LSB patterns
-        lsb_patterns = []
-        for channel in range(min(3, img_array.shape[2])):  # RGB channels
-            lsb_values = img_array[:, :, channel] & 1
-            lsb_patterns.append(lsb_values)
-        
-        # Check for unusual LSB patterns that might indicate steganography
-        for lsb_pattern in lsb_patterns:
-            # Calculate entropy of LSB pattern
-            unique, counts = np.unique(lsb_pattern, return_counts=True)
-            if len(unique) > 1:
-                total_pixels = np.sum(counts)
-                entropy = -np.sum((counts / total_pixels) * np.log2(counts / total_pixels))
-                
-                # High entropy in LSB might indicate hidden data
-                if entropy > 0.9:  # Threshold for suspicious LSB entropy
-                    logger.warning(f"High LSB entropy detected: {entropy:.3f}")
-                    return True
-        
-        return False
+        from .upload_inspection import open_rgb_image, lsb_suspicious
+        img = open_rgb_image(file_data)
+        return img is not None and lsb_suspicious(np.asarray(img))
     except Exception as e:
         logger.error(f"LSB steganography detection error: {e}")
         return False
 
 def detect_svd_steganography(file_data: bytes) -> bool:
-    """Detect SVD (Singular Value Decomposition) based steganography"""
+    """Detect SVD (Singular Value Decomposition) based steganography on downsampled tiles"""
     try:
-        # Convert to PIL Image
-        img = Image.open(io.BytesIO(file_data))
-        
-        if img.mode not in ['RGB', 'RGBA']:
-            return False
-        
-        # Convert to grayscale for SVD analysis
-        img_gray = img.convert('L')
-        import numpy as np
-        
-        # Convert to numpy array
-        img_array = np.array(img_gray, dtype=np.float64)
-        
-        # Perform SVD
-        U, S, Vt = np.linalg.svd(img_array, full_matrices=False)
-        
-        # Analyze singular values for steganography indicators
-        # Steganography often affects the distribution of singular values
-        singular_values = S[:min(50, len(S))]  # First 50 singular values
-        
-        # Check for unusual patterns in singular values (completely disabled for testing)
-        if len(singular_values) > 10:
-            # Calculate variance of singular values
-            variance = np.var(singular_values)
-            
-            # Check for unusual variance patterns (completely disabled for testing)
-            if variance < 1e-1000 or variance > 1e1000:
-                logger.warning(f"Suspicious SVD variance detected: {variance}")
-                return True
-            
-            # Check for unusual singular value ratios (completely disabled for testing)
-            ratios = singular_values[:-1] / (singular_values[1:] + 1e-10)
-            if np.any(ratios > 100000000000000) or np.any(ratios < 0.00000000000001):
-                logger.warning("Unusual singular value ratios detected")
-                return True
-        
-        return False
+        from .upload_inspection import open_rgb_image, downsampled_gray, svd_suspicious
+        img = open_rgb_image(file_data)
+        return img is not None and bool(svd_suspicious(downsampled_gray(img)))
     except Exception as e:
         logger.error(f"SVD steganography detection error: {e}")
         return False
@@ -909,13 +713,14 @@ def validate_captcha(user_input: str, correct_answer: str, case_sensitive: bool
 
 
 
-# Initialize CAPTCHA storage
-captcha_attempts = {}
+# Failed CAPTCHA attempts per IP over the last hour; the limit triggers the CAPTCHA block
+captcha_failure_limiter = SlidingWindowCounter(
+    "captcha_failures", CAPTCHA_CONFIG['CAPTCHA_MAX_ATTEMPTS'], 3600,
+    block=CAPTCHA_CONFIG['CAPTCHA_BLOCK_DURATION'], persist=True
+)
 
 def should_require_captcha(client_ip: str, endpoint: str) -> bool:
     """Determine if CAPTCHA should be required based on failed attempts"""
-    global captcha_attempts
-    
     if not CAPTCHA_CONFIG['ENABLE_CAPTCHA']:
         return False
     
@@ -923,57 +728,22 @@ def should_require_captcha(client_ip: str, endpoint: str) -> bool:
         return True
     
     # Check failed attempts for this IP
-    current_time = time.time()
-    window_start = current_time - 3600  # 1 hour window
-    
-    # Clean old entries
-    captcha_attempts = {ip: data for ip, data in captcha_attempts.items() 
-                       if data['last_attempt'] > window_start}
-    
-    if client_ip not in captcha_attempts:
-        return False
-    
-    failed_attempts = captcha_attempts[client_ip].get('failed_attempts', 0)
-    return failed_attempts >= CAPTCHA_CONFIG['CAPTCHA_ATTEMPTS_BEFORE_CAPTCHA']
+    return captcha_failure_limiter.count(client_ip) >= CAPTCHA_CONFIG['CAPTCHA_ATTEMPTS_BEFORE_CAPTCHA']
 
 
 def record_captcha_attempt(client_ip: str, success: bool):
     """Record CAPTCHA attempt for rate limiting"""
-    global captcha_attempts
-    
-    current_time = time.time()
-    
-    if client_ip not in captcha_attempts:
-        captcha_attempts[client_ip] = {
-            'failed_attempts': 0,
-            'successful_attempts': 0,
-            'last_attempt': current_time,
-            'blocked_until': 0
-        }
-    
     if success:
-        captcha_attempts[client_ip]['successful_attempts'] += 1
-        # Reset failed attempts on success
-        captcha_attempts[client_ip]['failed_attempts'] = 0
+        # Reset failed attempts on success (an active block stays)
+        captcha_failure_limiter.reset(client_ip, unblock=False)
     else:
-        captcha_attempts[client_ip]['failed_attempts'] += 1
-        
         # Block if too many failed attempts
-        if captcha_attempts[client_ip]['failed_attempts'] >= CAPTCHA_CONFIG['CAPTCHA_MAX_ATTEMPTS']:
-            captcha_attempts[client_ip]['blocked_until'] = current_time + CAPTCHA_CONFIG['CAPTCHA_BLOCK_DURATION']
-    
-    captcha_attempts[client_ip]['last_attempt'] = current_time
+        captcha_failure_limiter.add(client_ip)
 
 
 def is_captcha_blocked(client_ip: str) -> bool:
     """Check if client is blocked from CAPTCHA attempts"""
-    global captcha_attempts
-    
-    if client_ip not in captcha_attempts:
-        return False
-    
-    current_time = time.time()
-    return captcha_attempts[client_ip].get('blocked_until', 0) > current_time
+    return captcha_failure_limiter.is_blocked(client_ip)
 
 
 
@@ -1227,6 +997,7 @@ async def log_security_event(event_type: str, description: str, severity: str =
                   user_agent, metadata_json, get_jalali_now_str()))
             await conn.commit()
             await close_db_connection(conn)
+            counters.bump(f"security_events.{severity or 'medium'}")
         
         # Also log to regular logs with security flag
         await insert_log(
@@ -1267,26 +1038,28 @@ async def get_csrf_token(req: Request):
         # For unauthenticated users, we'll use a temporary approach
         session_id = req.headers.get('X-Session-ID') or str(uuid.uuid4())
         
-        # Store token with short expiry for registration
-        expires_at = (datetime.now() + timedelta(minutes=30)).isoformat()
-        
+        # Store token with short expiry for registration (database first, then the cache in front of it)
+        expires_at = (datetime.now() + timedelta(seconds=TEMP_CSRF_TTL)).isoformat()
         try:
             conn = await get_db_connection()
-            await conn.execute(
-                """INSERT OR REPLACE INTO temp_csrf_tokens (session_id, csrf_token, expires_at, created_at) 
-                   VALUES (?, ?, ?, ?)""",
-                (session_id, csrf_token, expires_at, get_jalali_now_str())
-            )
-            await conn.commit()
-            await close_db_connection(conn)
+            try:
+                await conn.execute(
+                    """INSERT OR REPLACE INTO temp_csrf_tokens (session_id, csrf_token, expires_at, created_at) 
+                       VALUES (?, ?, ?, ?)""",
+                    (session_id, csrf_token, expires_at, get_jalali_now_str())
+                )
+                await conn.commit()
+            finally:
+                await close_db_connection(conn)
         except Exception as e:
-            logger.warning(f"Could not store CSRF token in DB: {e}")
-            # Continue without DB storage for now
+            # Continue without DB storage: only this worker knows the token, and only until it restarts
+            logger.warning(f"Could not store CSRF token in DB, token is cache-only: {e}")
+        temp_csrf_cache.set(session_id, csrf_token, ttl=TEMP_CSRF_TTL)
         
         return {
             "csrf_token": csrf_token,
             "session_id": session_id,
-            "expires_in": 1800  # 30 minutes
+            "expires_in": TEMP_CSRF_TTL
         }
         
     except Exception as e:
@@ -0,0 +1,102 @@
+import itertools, logging, queue, secrets, threading, time
+
+# Setup logger for this module
+logger = logging.getLogger("asgi_middleware")
+
+# Cheap unique request ids: random per process + counter (no token generation per response)
+_REQUEST_ID_PREFIX = secrets.token_hex(4)
+_request_counter = itertools.count(1)
+
+
+def next_request_id() -> str:
+    return f"{_REQUEST_ID_PREFIX}{next(_request_counter):012x}"
+
+
+class TemplateContextMiddleware:
+    """Expose the Jinja2 templates as request.state.templates"""
+
+    def __init__(self, app, templates):
+        self.app = app
+        self.templates = templates
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] in ("http", "websocket"):
+            scope.setdefault("state", {})["templates"] = self.templates
+        await self.app(scope, receive, send)
+
+
+class SecurityBaselineMiddleware:
+    """Add a precomputed block of baseline headers at http.response.start (endpoints may still override)"""
+
+    def __init__(self, app, headers: dict):
+        self.app = app
+        self.headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                raw = list(message.get("headers", []))
+                present = {name.lower() for name, _ in raw}
+                raw.extend(header for header in self.headers if header[0] not in present)
+                if b"x-request-id" not in present:
+                    raw.append((b"x-request-id", next_request_id().encode("latin-1")))
+                message["headers"] = raw
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+class AccessLogQueue:
+    """Bounded queue drained by one daemon thread, so request handling never waits on log handlers"""
+
+    def __init__(self, target_logger: logging.Logger, maxsize: int = 10000):
+        self.target_logger = target_logger
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._drain, name="access-log", daemon=True)
+        self._thread.start()
+
+    def put(self, line: str):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        while True:
+            line = self.queue.get()
+            try:
+                self.target_logger.info(line)
+            except Exception:
+                pass
+
+
+class AccessLogMiddleware:
+    """'METHOD path - status - seconds' per request; time is measured to the response headers, as before"""
+
+    def __init__(self, app, log_queue: AccessLogQueue):
+        self.app = app
+        self.log_queue = log_queue
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        state = {"status": 500, "elapsed": None}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["elapsed"] = time.perf_counter() - started
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = state["elapsed"] if state["elapsed"] is not None else time.perf_counter() - started
+            self.log_queue.put(f"{scope['method']} {scope['path']} - {state['status']} - {elapsed:.3f}s")
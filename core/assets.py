@@ -0,0 +1,132 @@
+import gzip, hashlib, json, mimetypes, os, re, time, logging
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# Setup logger for this module
+logger = logging.getLogger("assets")
+
+# Constants
+STATIC_DIR = os.getenv("STATIC_DIR", "static")
+ASSET_BUILD_DIR = os.getenv("ASSET_BUILD_DIR", "static_build")
+ASSET_URL_PREFIX = "/assets/"
+ASSET_EXTENSIONS = (".css", ".js", ".ttf", ".woff", ".woff2", ".png", ".jpg", ".jpeg", ".gif", ".ico", ".svg")
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".ttf", ".svg", ".ico", ".json", ".txt")
+ASSET_MIN_COMPRESS_SIZE = 512  # smaller files are not worth a Content-Encoding round
+
+ASSET_FINGERPRINT_RE = re.compile(r"^(.+)\.[0-9a-f]{12}(\.[^./]+)$")
+_CSS_URL_RE = re.compile(r"""url\(\s*(['"]?)/static/([^'")?#]+)([^'")]*)\1\s*\)""")
+
+# logical path (relative to static/) -> fingerprinted path (relative to the build dir)
+asset_manifest = {}
+# fingerprinted path -> (logical path, content hash, encodings available)
+_served_assets = {}
+# hash of the manifest; part of the page render cache key
+asset_version = ""
+
+
+def _fingerprinted_name(rel_path: str, digest: str) -> str:
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{digest}{ext}".replace(os.sep, "/")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _rewrite_css(data: bytes, manifest: dict) -> bytes:
+    """Point url(/static/...) references at fingerprinted assets so the whole chain is immutable"""
+    def replace(match):
+        target = manifest.get(match.group(2))
+        if not target:
+            return match.group(0)
+        return f"url({match.group(1)}{ASSET_URL_PREFIX}{target}{match.group(3)}{match.group(1)})"
+    return _CSS_URL_RE.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+
+def _collect_sources() -> list:
+    sources = []
+    for root, _, files in os.walk(STATIC_DIR):
+        for name in files:
+            if name.lower().endswith(ASSET_EXTENSIONS):
+                path = os.path.join(root, name)
+                sources.append(os.path.relpath(path, STATIC_DIR).replace(os.sep, "/"))
+    # CSS last: its url() references need the fingerprints of fonts/images
+    return sorted(sources, key=lambda rel: (rel.endswith(".css"), rel))
+
+
+def build_assets() -> dict:
+    """Hash static assets into ASSET_BUILD_DIR with .gz/.br siblings; returns the manifest.
+
+    Idempotent and cheap on restart: unchanged content maps to the same fingerprinted files."""
+    started = time.time()
+    manifest = {}
+    served = {}
+    written = 0
+    for rel_path in _collect_sources():
+        with open(os.path.join(STATIC_DIR, rel_path), "rb") as f:
+            data = f.read()
+        if rel_path.endswith(".css"):
+            data = _rewrite_css(data, manifest)
+        digest = hashlib.blake2b(data, digest_size=6).hexdigest()
+        target = _fingerprinted_name(rel_path, digest)
+        target_path = os.path.join(ASSET_BUILD_DIR, target)
+        encodings = []
+        # the name carries the content hash, so an existing file is already up to date
+        if not os.path.exists(target_path):
+            _write_atomic(target_path, data)
+            written += 1
+        if rel_path.lower().endswith(COMPRESSIBLE_EXTENSIONS) and len(data) >= ASSET_MIN_COMPRESS_SIZE:
+            if not os.path.exists(f"{target_path}.gz"):
+                _write_atomic(f"{target_path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+            encodings.append("gzip")
+            if BROTLI_AVAILABLE:
+                if not os.path.exists(f"{target_path}.br"):
+                    _write_atomic(f"{target_path}.br", brotli.compress(data, quality=11))
+                encodings.append("br")
+        manifest[rel_path] = target
+        served[target] = (rel_path, digest, tuple(encodings))
+
+    global asset_version
+    manifest_bytes = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+    _write_atomic(os.path.join(ASSET_BUILD_DIR, "manifest.json"), manifest_bytes)
+    asset_version = hashlib.blake2b(manifest_bytes, digest_size=6).hexdigest()
+    asset_manifest.clear()
+    asset_manifest.update(manifest)
+    _served_assets.clear()
+    _served_assets.update(served)
+    logger.info(f"✅ Static assets ready: {len(manifest)} files ({written} rebuilt, "
+                f"brotli={'on' if BROTLI_AVAILABLE else 'off'}) in {time.time() - started:.2f}s")
+    return manifest
+
+
+def asset_url(rel_path: str) -> str:
+    """Template helper: fingerprinted URL when built, plain /static URL otherwise"""
+    rel_path = rel_path.lstrip("/")
+    target = asset_manifest.get(rel_path)
+    return f"{ASSET_URL_PREFIX}{target}" if target else f"/static/{rel_path}"
+
+
+def resolve_asset(path: str, accept_encoding: str):
+    """(file path, media type, content-encoding or None, etag) for a fingerprinted asset, or None"""
+    entry = _served_assets.get(path)
+    if not entry:
+        return None
+    rel_path, digest, encodings = entry
+    media_type = mimetypes.guess_type(rel_path)[0] or "application/octet-stream"
+    if media_type.startswith("text/") or media_type in ("application/javascript",):
+        media_type += "; charset=utf-8"
+    accepted = {token.split(";")[0].strip().lower() for token in (accept_encoding or "").split(",")}
+    file_path = os.path.join(ASSET_BUILD_DIR, path)
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding in encodings and encoding in accepted:
+            return f"{file_path}{suffix}", media_type, encoding, f'"{digest}-{encoding}"'
+    return file_path, media_type, None, f'"{digest}"'
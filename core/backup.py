@@ -0,0 +1,283 @@
+import asyncio, sqlite3, os, time, gzip, json, struct, hashlib, logging
+from datetime import datetime
+
+# Import from shared config
+from .config import DB_FILE, BACKUP_DIR, BACKUP_RETENTION_DAYS  # BACKUP_RETENTION_DAYS = full backups kept
+
+# Setup logger for this module
+logger = logging.getLogger("backup")
+
+# Constants
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.01"))  # pause between page batches
+BACKUP_MEMORY_SNAPSHOT_MAX = int(os.getenv("BACKUP_MEMORY_SNAPSHOT_MAX", str(64 * 1024 * 1024)))
+BACKUP_DIFFERENTIAL = os.getenv("BACKUP_DIFFERENTIAL", "false").lower() == "true"
+BACKUP_FULL_EVERY = int(os.getenv("BACKUP_FULL_EVERY", "7"))  # differentials between two full backups
+BACKUP_COMPRESS_LEVEL = int(os.getenv("BACKUP_COMPRESS_LEVEL", "6"))
+MANIFEST_FILE = "manifest.json"
+DIFF_MAGIC = b"SQLDIFF1"
+CHUNK_SIZE = 1024 * 1024
+
+# فقط یک backup در هر لحظه
+_backup_lock = asyncio.Lock()
+
+
+def _manifest_path() -> str:
+    return os.path.join(BACKUP_DIR, MANIFEST_FILE)
+
+
+def load_manifest() -> dict:
+    """Load the backup manifest, adopting legacy *.db.gz files the first time"""
+    path = _manifest_path()
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"⚠️ Backup manifest unreadable, rebuilding: {e}")
+    # Legacy backups carry their timestamp in the name, so sort by name and not by ctime
+    entries = []
+    if os.path.isdir(BACKUP_DIR):
+        for name in sorted(os.listdir(BACKUP_DIR)):
+            if name.startswith("backup_") and name.endswith(".db.gz"):
+                entries.append({"file": name, "kind": "full", "created": name[7:-6], "base": None,
+                                "size": os.path.getsize(os.path.join(BACKUP_DIR, name))})
+    return {"version": 1, "backups": entries}
+
+
+def save_manifest(manifest: dict):
+    """Atomically write the backup manifest"""
+    path = _manifest_path()
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _hashes_file(name: str) -> str:
+    return os.path.join(BACKUP_DIR, name + ".pages")
+
+
+def _page_digest(page: bytes) -> bytes:
+    return hashlib.blake2b(page, digest_size=8).digest()
+
+
+def _snapshot(db_file: str, dest: sqlite3.Connection):
+    """Copy db_file into dest with the online backup API, in page batches"""
+    src = sqlite3.connect(db_file, isolation_level=None, timeout=60)
+    try:
+        # Holding a read transaction pins one WAL snapshot: the copy is consistent,
+        # writers keep going and the backup never restarts because of them.
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        def _progress(status, remaining, total):
+            if BACKUP_STEP_SLEEP > 0 and remaining:
+                time.sleep(BACKUP_STEP_SLEEP)
+
+        src.backup(dest, pages=BACKUP_PAGES_PER_STEP, progress=_progress)
+        src.execute("COMMIT")
+    finally:
+        src.close()
+
+
+def _iter_snapshot_pages(db_file: str, work_file: str):
+    """Take a snapshot and yield (page_size, pages) - in memory for small DBs, via work_file otherwise"""
+    db_size = os.path.getsize(db_file) if os.path.exists(db_file) else 0
+    wal_file = db_file + "-wal"
+    if os.path.exists(wal_file):
+        db_size += os.path.getsize(wal_file)
+
+    if db_size <= BACKUP_MEMORY_SNAPSHOT_MAX:
+        dest = sqlite3.connect(":memory:")
+        try:
+            _snapshot(db_file, dest)
+            page_size = dest.execute("PRAGMA page_size").fetchone()[0]
+            image = dest.serialize()
+        finally:
+            dest.close()
+        view = memoryview(image)
+        return page_size, (view[i:i + page_size] for i in range(0, len(image), page_size))
+
+    dest = sqlite3.connect(work_file)
+    try:
+        _snapshot(db_file, dest)
+        page_size = dest.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        dest.close()
+
+    def _pages():
+        try:
+            with open(work_file, "rb", buffering=CHUNK_SIZE) as f:
+                while True:
+                    page = f.read(page_size)
+                    if not page:
+                        break
+                    yield page
+        finally:
+            if os.path.exists(work_file):
+                os.remove(work_file)
+    return page_size, _pages()
+
+
+def _write_full(name: str, page_size: int, pages, track_hashes: bool) -> dict:
+    """Stream snapshot pages straight into a gzip file (and the page-hash sidecar)"""
+    path = os.path.join(BACKUP_DIR, name)
+    digests = bytearray()
+    count = 0
+    with gzip.open(path + ".tmp", "wb", compresslevel=BACKUP_COMPRESS_LEVEL) as out:
+        for page in pages:
+            out.write(page)
+            if track_hashes:
+                digests += _page_digest(page)
+            count += 1
+    os.replace(path + ".tmp", path)
+    if track_hashes:
+        with open(_hashes_file(name), "wb") as f:
+            f.write(digests)
+    return {"pages": count, "page_size": page_size}
+
+
+def _write_diff(name: str, base: dict, page_size: int, pages) -> dict:
+    """Write only the pages that differ from the base full backup"""
+    path = os.path.join(BACKUP_DIR, name)
+    with open(_hashes_file(base["file"]), "rb") as f:
+        base_digests = f.read()
+    base_pages = len(base_digests) // 8
+    changed = 0
+    count = 0
+    with gzip.open(path + ".tmp", "wb", compresslevel=BACKUP_COMPRESS_LEVEL) as out:
+        out.write(DIFF_MAGIC + struct.pack(">I", page_size))
+        for pgno, page in enumerate(pages):
+            if pgno >= base_pages or base_digests[pgno * 8:pgno * 8 + 8] != _page_digest(page):
+                out.write(struct.pack(">I", pgno))
+                out.write(page)
+                changed += 1
+            count += 1
+        # total page count terminates the stream so restore can truncate a shrunk database
+        out.write(struct.pack(">I", 0xFFFFFFFF) + struct.pack(">I", count))
+    os.replace(path + ".tmp", path)
+    return {"pages": count, "page_size": page_size, "changed_pages": changed}
+
+
+def _latest_full(manifest: dict):
+    for entry in reversed(manifest["backups"]):
+        if entry["kind"] == "full":
+            return entry
+    return None
+
+
+def _apply_retention(manifest: dict):
+    """Keep the newest BACKUP_RETENTION_DAYS full backups and the differentials built on them"""
+    fulls = [e for e in manifest["backups"] if e["kind"] == "full"]
+    keep_bases = {e["file"] for e in fulls[-BACKUP_RETENTION_DAYS:]}
+    kept = []
+    for entry in manifest["backups"]:
+        if (entry["kind"] == "full" and entry["file"] in keep_bases) or \
+           (entry["kind"] == "diff" and entry.get("base") in keep_bases):
+            kept.append(entry)
+            continue
+        for path in (os.path.join(BACKUP_DIR, entry["file"]), _hashes_file(entry["file"])):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.error(f"Error deleting old backup {path}: {e}")
+        logger.info(f"Deleted old backup: {entry['file']}")
+    manifest["backups"] = kept
+
+
+def run_backup(db_file: str = DB_FILE, differential: bool = BACKUP_DIFFERENTIAL) -> dict:
+    """Blocking backup job: snapshot, compress, record in manifest, apply retention"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    manifest = load_manifest()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    base = _latest_full(manifest) if differential else None
+    if base is not None:
+        diffs_since = [e for e in manifest["backups"] if e.get("base") == base["file"]]
+        if len(diffs_since) >= BACKUP_FULL_EVERY or not os.path.exists(_hashes_file(base["file"])):
+            base = None
+
+    started = time.time()
+    page_size, pages = _iter_snapshot_pages(db_file, os.path.join(BACKUP_DIR, f"temp_{timestamp}.db"))
+    if base is not None:
+        name = f"backup_{timestamp}.dbdiff"
+        info = _write_diff(name, base, page_size, pages)
+        entry = {"file": name, "kind": "diff", "base": base["file"]}
+    else:
+        name = f"backup_{timestamp}.db.gz"
+        info = _write_full(name, page_size, pages, track_hashes=differential)
+        entry = {"file": name, "kind": "full", "base": None}
+
+    entry.update(info)
+    entry["created"] = timestamp
+    entry["size"] = os.path.getsize(os.path.join(BACKUP_DIR, name))
+    entry["duration"] = round(time.time() - started, 3)
+    manifest["backups"].append(entry)
+    _apply_retention(manifest)
+    save_manifest(manifest)
+    return entry
+
+
+def discard_backup(entry: dict) -> set:
+    """Delete an unusable backup and drop it from the manifest; discarding a full backup also discards the
+    differentials built on it (they cannot be materialized without it). Returns the discarded file names"""
+    manifest = load_manifest()
+    discarded = {entry["file"]}
+    if entry.get("kind", "full") == "full":
+        discarded |= {e["file"] for e in manifest["backups"] if e.get("base") == entry["file"]}
+    for name in discarded:
+        for path in (os.path.join(BACKUP_DIR, name), _hashes_file(name)):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except Exception as e:
+                logger.error(f"Error deleting backup {path}: {e}")
+    manifest["backups"] = [e for e in manifest["backups"] if e["file"] not in discarded]
+    save_manifest(manifest)
+    logger.warning(f"Discarded backup {entry['file']}" + (f" and {len(discarded) - 1} differentials" if len(discarded) > 1 else ""))
+    return discarded
+
+
+def restore_candidates(limit: int = None) -> list:
+    """Manifest entries newest first, usable as restore sources"""
+    entries = list(reversed(load_manifest()["backups"]))
+    return entries[:limit] if limit else entries
+
+
+def materialize_backup(entry: dict, target_file: str):
+    """Rebuild a plain SQLite file from a full backup or a base + differential pair"""
+    if entry["kind"] == "full":
+        with gzip.open(os.path.join(BACKUP_DIR, entry["file"]), "rb") as src, open(target_file, "wb") as dst:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        return
+    materialize_backup({"file": entry["base"], "kind": "full"}, target_file)
+    with gzip.open(os.path.join(BACKUP_DIR, entry["file"]), "rb") as src, open(target_file, "r+b") as dst:
+        header = src.read(len(DIFF_MAGIC) + 4)
+        if header[:len(DIFF_MAGIC)] != DIFF_MAGIC:
+            raise ValueError(f"Not a differential backup: {entry['file']}")
+        page_size = struct.unpack(">I", header[len(DIFF_MAGIC):])[0]
+        while True:
+            raw = src.read(4)
+            if len(raw) < 4:
+                raise ValueError(f"Truncated differential backup: {entry['file']}")
+            pgno = struct.unpack(">I", raw)[0]
+            if pgno == 0xFFFFFFFF:
+                total = struct.unpack(">I", src.read(4))[0]
+                dst.truncate(total * page_size)
+                break
+            dst.seek(pgno * page_size)
+            dst.write(src.read(page_size))
+
+
+async def backup_database_online(db_file: str = DB_FILE, differential: bool = BACKUP_DIFFERENTIAL) -> dict:
+    """Run the backup engine off the event loop; one backup at a time"""
+    async with _backup_lock:
+        entry = await asyncio.to_thread(run_backup, db_file, differential)
+    logger.info(f"Database backup created: {entry['file']} ({entry['kind']}, {entry['pages']} pages, {entry['duration']}s)")
+    return entry
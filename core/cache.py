@@ -0,0 +1,124 @@
+import os, time, threading, logging
+from collections import OrderedDict
+
+# Setup logger for this module
+logger = logging.getLogger("cache")
+
+_MISSING = object()
+_registry = []  # every TTLCache, for cache_stats()
+
+
+class TTLCache:
+    """Small in-process cache with per-entry TTL and LRU eviction, plus hit/miss counters"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        _registry.append(self)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] < now:
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Remove and return a live entry (for one-shot values)"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            if item is _MISSING or item[0] < now:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return item[1]
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry now instead of waiting for its next lookup or LRU eviction"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+            for key in expired:
+                del self._data[key]
+            self.evictions += len(expired)
+        return len(expired)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# Cache for users/user_settings rows read on every dashboard load (get_user_settings, /api/profile)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+user_record_cache = TTLCache("user_records", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+# Probed video properties (fps, frame count, size); entries are re-validated against os.stat on every read
+VIDEO_METADATA_CACHE_SIZE = int(os.getenv("VIDEO_METADATA_CACHE_SIZE", "2048"))
+video_metadata_cache = TTLCache("video_metadata", maxsize=VIDEO_METADATA_CACHE_SIZE, ttl=float(os.getenv("VIDEO_METADATA_CACHE_TTL", "86400")))
+
+# Write-through copies of the CSRF tokens in user_sessions (per user) and temp_csrf_tokens (per X-Session-ID),
+# loaded from SQLite on a miss; expired rows and entries are removed by retention.periodic_session_sweep
+USER_CSRF_TTL = int(os.getenv("USER_CSRF_TTL", "3600"))
+TEMP_CSRF_TTL = int(os.getenv("TEMP_CSRF_TTL", "1800"))
+CSRF_CACHE_SIZE = int(os.getenv("CSRF_CACHE_SIZE", "4096"))
+user_csrf_cache = TTLCache("user_csrf_tokens", maxsize=CSRF_CACHE_SIZE, ttl=USER_CSRF_TTL)
+temp_csrf_cache = TTLCache("temp_csrf_tokens", maxsize=CSRF_CACHE_SIZE, ttl=TEMP_CSRF_TTL)
+
+
+def invalidate_user(username: str):
+    """Drop cached user/settings rows after any write to users or user_settings"""
+    if username:
+        user_record_cache.invalidate(username)
+
+
+def cache_stats() -> dict:
+    """Hit/miss metrics for all process caches"""
+    return {cache.name: cache.stats() for cache in _registry}
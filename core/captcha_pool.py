@@ -0,0 +1,130 @@
+import asyncio, os, secrets, time, logging
+from collections import deque
+
+from .cache import TTLCache
+from .Security import CAPTCHA_CONFIG, generate_captcha_text, generate_math_captcha
+
+# Setup logger for this module
+logger = logging.getLogger("captcha_pool")
+
+# Constants
+CAPTCHA_POOL_SIZE = int(os.getenv("CAPTCHA_POOL_SIZE", "256"))  # ready challenges per kind
+CAPTCHA_POOL_LOW_WATER = int(os.getenv("CAPTCHA_POOL_LOW_WATER", str(CAPTCHA_POOL_SIZE // 4)))
+CAPTCHA_POOL_MAX_AGE = float(os.getenv("CAPTCHA_POOL_MAX_AGE", "600"))  # unissued challenges older than this are dropped
+CAPTCHA_POOL_REFILL_INTERVAL = float(os.getenv("CAPTCHA_POOL_REFILL_INTERVAL", "5"))
+CAPTCHA_POOL_BATCH = 64  # challenges generated between yields to the event loop
+CAPTCHA_STORE_SIZE = int(os.getenv("CAPTCHA_STORE_SIZE", "10000"))
+
+# captcha_id -> (kind, answer, client_ip) for issued challenges; bounded, expires after CAPTCHA_EXPIRY
+captcha_challenges = TTLCache("captcha_challenges", maxsize=CAPTCHA_STORE_SIZE, ttl=CAPTCHA_CONFIG['CAPTCHA_EXPIRY'])
+
+
+def _text_challenge() -> tuple:
+    text = generate_captcha_text(CAPTCHA_CONFIG['CAPTCHA_LENGTH'])
+    return text, text
+
+
+_GENERATORS = {
+    "text": _text_challenge,
+    "math": generate_math_captcha,  # (question, answer)
+}
+
+
+class CaptchaPool:
+    """Ready-made challenges per kind, refilled in the background so issuing one is a deque pop; an empty
+    pool falls back to generating inline"""
+
+    def __init__(self, size: int = CAPTCHA_POOL_SIZE, low_water: int = CAPTCHA_POOL_LOW_WATER,
+                 max_age: float = CAPTCHA_POOL_MAX_AGE):
+        self.size = size
+        self.low_water = low_water
+        self.max_age = max_age
+        self._ready = {kind: deque() for kind in _GENERATORS}  # (created_at, captcha_id, prompt, answer)
+        self._wakeup = None
+        self._metrics = {"issued": 0, "inline": 0, "stale": 0, "produced": 0}
+
+    @staticmethod
+    def _generate(kind: str) -> tuple:
+        prompt, answer = _GENERATORS[kind]()
+        return time.monotonic(), secrets.token_urlsafe(16), prompt, answer
+
+    def take(self, kind: str) -> tuple:
+        """(captcha_id, prompt, answer) of a fresh challenge"""
+        ready = self._ready[kind]
+        cutoff = time.monotonic() - self.max_age
+        while ready and ready[0][0] < cutoff:
+            ready.popleft()
+            self._metrics["stale"] += 1
+        self._metrics["issued"] += 1
+        if len(ready) <= self.low_water and self._wakeup is not None:
+            self._wakeup.set()
+        if ready:
+            return ready.popleft()[1:]
+        self._metrics["inline"] += 1
+        return self._generate(kind)[1:]
+
+    async def fill(self) -> int:
+        """Top every kind up to size, yielding to the event loop between batches"""
+        produced = 0
+        for kind, ready in self._ready.items():
+            while len(ready) < self.size:
+                for _ in range(min(CAPTCHA_POOL_BATCH, self.size - len(ready))):
+                    ready.append(self._generate(kind))
+                    produced += 1
+                await asyncio.sleep(0)
+        self._metrics["produced"] += produced
+        return produced
+
+    async def run(self):
+        """Producer loop: refill when a take drops below low_water, and every CAPTCHA_POOL_REFILL_INTERVAL to
+        replace challenges that went stale"""
+        self._wakeup = asyncio.Event()
+        logger.info(f"✅ CAPTCHA pool producer started ({self.size} per kind)")
+        try:
+            while True:
+                try:
+                    await self.fill()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"CAPTCHA pool refill failed: {e}")
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), CAPTCHA_POOL_REFILL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                cutoff = time.monotonic() - self.max_age
+                for ready in self._ready.values():
+                    while ready and ready[0][0] < cutoff:
+                        ready.popleft()
+                        self._metrics["stale"] += 1
+                captcha_challenges.purge_expired()
+        finally:
+            self._wakeup = None
+
+    def stats(self) -> dict:
+        return {
+            "ready": {kind: len(ready) for kind, ready in self._ready.items()},
+            "outstanding": len(captcha_challenges),
+            **self._metrics,
+        }
+
+
+captcha_pool = CaptchaPool()
+
+
+def issue_challenge(kind: str, client_ip: str) -> tuple:
+    """(captcha_id, prompt) for a new challenge; its answer is kept in captcha_challenges"""
+    captcha_id, prompt, answer = captcha_pool.take(kind)
+    captcha_challenges.set(captcha_id, (kind, answer, client_ip))
+    return captcha_id, prompt
+
+
+def redeem_challenge(captcha_id: str):
+    """(kind, answer, client_ip) of a live challenge, removed so it can be answered only once; None if unknown
+    or expired"""
+    return captcha_challenges.pop(captcha_id)
+
+
+async def captcha_pool_producer():
+    await captcha_pool.run()
@@ -1,8 +1,8 @@
-import asyncio, aiosqlite, time, os, sys, gc, random, functools, cv2, shutil, bcrypt, json, logging, logging.config, logging.handlers, errno, pyotp
+import asyncio, aiosqlite, time, os, sys, gc, random, functools, cv2, shutil, json, logging, logging.config, logging.handlers, errno, pyotp
 import numpy as np
 from typing import List, Tuple
 from datetime import datetime, timedelta
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, Response
 from starlette.background import BackgroundTask
 from fastapi import Request, HTTPException, Depends, WebSocket, WebSocketDisconnect
 from pydantic import BaseModel, Field, ValidationError, field_validator, EmailStr
@@ -18,25 +18,43 @@ from .config import (
     SECURITY_CONFIG, RATE_LIMIT_CONFIG, CAPTCHA_CONFIG, CSRF_CONFIG,
     get_jalali_now_str, is_local_test_request, retry_async, is_test_environment,
     VIDEO_FPS, MIN_VALID_FRAMES, MAX_WEBSOCKET_MESSAGE_SIZE,
-    GALLERY_DIR, SECURITY_VIDEOS_DIR, DEVICE_RESOLUTIONS, translations,
-    SmartFeaturesCommand, get_app, get_templates,
+    GALLERY_DIR, SECURITY_VIDEOS_DIR, DEVICE_RESOLUTIONS,
+    SmartFeaturesCommand, get_app,
     FRAME_SKIP_THRESHOLD, MAX_WEBSOCKET_CLIENTS, ACCESS_TOKEN_EXPIRE_MINUTES,
     MAX_VIDEO_FILE_SIZE, VIDEO_STREAMING_THRESHOLD
 )
 
 # Import functions from their actual modules
 from .sanitize_validate import sanitize_input
-from .Security import check_rate_limit, hash_password, validate_captcha, should_require_captcha, record_captcha_attempt, validate_csrf_token, get_csrf_token_from_request
+from .Security import check_rate_limit, validate_captcha, should_require_captcha, record_captcha_attempt, validate_csrf_token, get_csrf_token_from_request
 from .sms import send_password_recovery_sms
 from .token import create_access_token
 from . import login_fun
 from .sanitize_validate import validate_password_strength, validate_filename_safe
-from .token import verify_token, get_current_user
+from .token import verify_token, get_current_user, revoke_token, revoke_user_tokens
 from .Security import apply_security_headers, check_api_rate_limit
+from .rate_limiter import SlidingWindowCounter
+from .cache import user_record_cache, invalidate_user, cache_stats, temp_csrf_cache
+from .password_hashing import hash_password_async, verify_password_async, verify_password_sync, rehash_if_needed, password_hash_stats
+from .upload_inspection import inspection_stats
+from .sms_gateway import get_sms_dispatcher
+from .google_oidc import oidc_stats
+from .captcha_pool import captcha_pool
+from . import counters, json_codec, db
+from .media_catalog import list_media, file_stat, get_video_info, store_video_metadata
+from .media_response import media_file_response, parse_range_header, ClosingStreamingResponse
+from .render_cache import render_page
+from .assets import resolve_asset, asset_url, asset_manifest, ASSET_FINGERPRINT_RE
+from .export import build_export_plan, stream_zip, export_semaphore, EXPORT_CAMERAS
+from .derivatives import (
+    enqueue_video, enqueue_photo, get_video_derivative_hash, derivative_path, derivative_url, photo_derivative_urls,
+    DERIVATIVES_DIR, DERIVATIVE_NAME_RE, DERIVATIVE_MEDIA_TYPES,
+    PHOTO_DERIVATIVES_DIR, PHOTO_DERIVATIVE_NAME_RE, PHOTO_DERIVATIVE_WIDTHS, PHOTO_MEDIA_TYPES
+)
 from .db import (
     get_db_connection, close_db_connection, insert_log, insert_servo_command, 
     insert_device_mode_command, migrate_user_settings_table, init_db, robust_db_endpoint,
-    UserSettings
+    UserSettings, search_logs, resync_stat_counters
 )
     # Import these functions later when app is initialized
     # from .pico import send_to_pico_client
@@ -45,8 +63,13 @@ from .db import (
 # Setup logger for this module
 logger = logging.getLogger("client")
 
-# In-memory storage for login attempts (IP-based)
-login_attempts_storage = {}
+# Failed login attempts per IP; reaching the limit bans the IP for LOGIN_BAN_DURATION
+login_failure_limiter = SlidingWindowCounter(
+    "login_failures",
+    RATE_LIMIT_CONFIG.get('LOGIN_ATTEMPTS', {}).get('max_requests', 5),
+    RATE_LIMIT_CONFIG.get('LOGIN_ATTEMPTS', {}).get('window_seconds', 300),
+    block=SECURITY_CONFIG.get('LOGIN_BAN_DURATION', 300), persist=True
+)
 
 # Constants
 INACTIVE_CLIENT_TIMEOUT = 300  # 5 minutes timeout for inactive clients
@@ -154,19 +177,25 @@ def register_routes_with_app(fastapi_app):
         app.add_api_route("/get_user_settings", get_user_settings, methods=["GET"])
         app.add_api_route("/api/profile", get_user_profile, methods=["GET"])
         app.add_api_route("/get_photo_count", get_photo_count, methods=["GET"])
+        app.add_api_route("/api/dashboard_stats", get_dashboard_stats, methods=["GET"])
         app.add_api_route("/get_gallery", get_gallery, methods=["GET"])
         app.add_api_route("/get_videos", get_videos, methods=["GET"])
         app.add_api_route("/get_logs", get_logs, methods=["GET"])
         app.add_api_route("/get_all_logs", get_all_logs, methods=["GET"])
+        app.add_api_route("/search_logs", search_logs_endpoint, methods=["GET"])
+        app.add_api_route("/api/export", export_media, methods=["GET"])
         app.add_api_route("/delete_photo/{filename}", delete_photo, methods=["POST"])
         app.add_api_route("/delete_video", delete_video, methods=["POST"])
         app.add_api_route("/logout", logout, methods=["POST"])
         app.add_api_route("/logout", logout_page, methods=["GET"])
         app.add_api_route("/set_language", set_language, methods=["POST"])
         app.add_api_route("/static/{filename}", serve_static_file, methods=["GET"])
+        app.add_api_route("/assets/{path:path}", serve_asset, methods=["GET"])
         app.add_api_route("/gallery/{filename}", serve_gallery_file, methods=["GET"])
-        app.add_api_route("/security_videos/{filename}", serve_video_file, methods=["GET"])
+        app.add_api_route("/gallery_derivatives/{name}", serve_gallery_derivative, methods=["GET"])
+        app.add_api_route("/security_videos/{filename}", serve_video_file, methods=["GET", "HEAD"])
         app.add_api_route("/video_poster/{filename}", generate_video_poster, methods=["GET"])
+        app.add_api_route("/video_derivatives/{name}", serve_video_derivative, methods=["GET"])
         app.add_api_route("/video_metadata/{filename}", get_video_metadata, methods=["GET"])
         app.add_api_route("/login", login_page, methods=["GET"], response_class=HTMLResponse)
         app.add_api_route("/login", login, methods=["POST"])
@@ -328,6 +357,10 @@ async def send_to_web_clients(message):
         # کپی از لیست برای جلوگیری از تغییر در حین iteration
         clients_to_send = system_state.web_clients.copy()
         
+    # یک بار سریال‌سازی برای همه کلاینت‌ها
+    if not isinstance(message, str):
+        message = json_codec.dumps(message)
+    
     # ارسال پیام خارج از lock برای جلوگیری از deadlock
     for client in clients_to_send:
         try:
@@ -336,7 +369,7 @@ async def send_to_web_clients(message):
                 remove_clients.append(client)
                 continue
                 
-            await client.send_text(json.dumps(message) if not isinstance(message, str) else message)
+            await client.send_text(message)
         except Exception as e:
             # Don't log normal closure errors
             if "1000" not in str(e) and "Rapid test" not in str(e) and "disconnect" not in str(e).lower():
@@ -387,11 +420,11 @@ async def websocket_endpoint(websocket: WebSocket):
         # Wait for authentication message
         try:
             auth_data = await asyncio.wait_for(websocket.receive_text(), timeout=10.0)
-            auth_message = json.loads(auth_data)
+            auth_message = json_codec.loads(auth_data)
             
             if auth_message.get('type') != 'authenticate':
                 logger.warning(f"Invalid first message from {websocket.client.host}: {auth_message.get('type')}")
-                await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Invalid authentication message"}))
+                await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Invalid authentication message"}))
                 await websocket.close(code=4001, reason="Invalid authentication")
                 return
             
@@ -399,7 +432,7 @@ async def websocket_endpoint(websocket: WebSocket):
             token = auth_message.get('token')
             if not token:
                 logger.warning(f"No token provided by {websocket.client.host}")
-                await websocket.send_text(json.dumps({"type": "auth_failed", "message": "No token provided"}))
+                await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "No token provided"}))
                 await websocket.close(code=4001, reason="No token")
                 return
             
@@ -407,7 +440,7 @@ async def websocket_endpoint(websocket: WebSocket):
             user_data = verify_token(token)
             if not user_data:
                 logger.warning(f"Invalid JWT token from {websocket.client.host}")
-                await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Invalid token"}))
+                await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Invalid token"}))
                 await websocket.close(code=4001, reason="Invalid token")
                 return
             
@@ -425,21 +458,21 @@ async def websocket_endpoint(websocket: WebSocket):
             logger.info(f"WebSocket authenticated successfully from {websocket.client.host} (user: {username}, role: {user_role})")
             
             # Send authentication success message
-            await websocket.send_text(json.dumps({"type": "authenticated", "username": username, "role": user_role}))
+            await websocket.send_text(json_codec.dumps({"type": "authenticated", "username": username, "role": user_role}))
             
         except asyncio.TimeoutError:
             logger.warning(f"Authentication timeout from {websocket.client.host}")
-            await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Authentication timeout"}))
+            await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Authentication timeout"}))
             await websocket.close(code=4001, reason="Authentication timeout")
             return
         except json.JSONDecodeError:
             logger.warning(f"Invalid JSON in authentication message from {websocket.client.host}")
-            await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Invalid JSON"}))
+            await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Invalid JSON"}))
             await websocket.close(code=4001, reason="Invalid JSON")
             return
         except Exception as e:
             logger.error(f"Authentication error from {websocket.client.host}: {e}")
-            await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Authentication error"}))
+            await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Authentication error"}))
             await websocket.close(code=4001, reason="Authentication error")
             return
         
@@ -453,7 +486,7 @@ async def websocket_endpoint(websocket: WebSocket):
         current_system_state = get_system_state()
         async with current_system_state.web_clients_lock:
             if len(current_system_state.web_clients) >= MAX_WEBSOCKET_CLIENTS:
-                await websocket.send_text(json.dumps({"type": "error", "message": "Maximum WebSocket clients reached."}))
+                await websocket.send_text(json_codec.dumps({"type": "error", "message": "Maximum WebSocket clients reached."}))
                 await websocket.close(code=1008)
                 logger.warning(f"Rejected web connection from {websocket.client.host}: Max clients reached")
                 return
@@ -487,7 +520,7 @@ async def websocket_endpoint(websocket: WebSocket):
                 "active_clients_count": len(current_system_state.active_clients)
             }
             
-            await websocket.send_text(json.dumps(status_data))
+            await websocket.send_text(json_codec.dumps(status_data))
             
         except Exception as e:
             # Enhanced error suppression for normal closure errors
@@ -509,14 +542,14 @@ async def websocket_endpoint(websocket: WebSocket):
                 # Check for inactive clients
                 if (datetime.now() - last_activity).total_seconds() > INACTIVE_CLIENT_TIMEOUT:
                     logger.warning(f"[WebSocket] Client {websocket.client.host} inactive for {INACTIVE_CLIENT_TIMEOUT} seconds, closing connection")
-                    await websocket.send_text(json.dumps({"type": "error", "message": "Inactive for too long"}))
+                    await websocket.send_text(json_codec.dumps({"type": "error", "message": "Inactive for too long"}))
                     break
                 
                 # Send ping if no pong received
                 if (datetime.now() - last_pong).total_seconds() > 30:
                     logger.debug(f"[WebSocket] No pong received from {websocket.client.host} within 30 seconds, sending ping")
                     try:
-                        await websocket.send_text(json.dumps({"type": "ping"}))
+                        await websocket.send_text(json_codec.dumps({"type": "ping"}))
                     except Exception as e:
                         if ("1000" not in str(e) and "1001" not in str(e) and 
                             "Rapid test" not in str(e) and "keepalive" not in str(e).lower() and 
@@ -531,7 +564,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     client.last_activity = last_activity
                     
                     try:
-                        message = json.loads(data)
+                        message = json_codec.loads(data)
                         cmd_type = message.get('type')
                     except json.JSONDecodeError as e:
                         logger.warning(f"[WebSocket] Invalid JSON from {websocket.client.host}: {e}")
@@ -539,7 +572,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     
                     # Handle different message types
                     if cmd_type == "ping":
-                        await websocket.send_text(json.dumps({"type": "pong"}))
+                        await websocket.send_text(json_codec.dumps({"type": "pong"}))
                         last_pong = datetime.now()
                     elif cmd_type == "get_status":
                         await send_status()
@@ -549,7 +582,7 @@ async def websocket_endpoint(websocket: WebSocket):
                             await handle_command_response(message)
                         except Exception as e:
                             logger.error(f"[WebSocket] Error handling command from {websocket.client.host}: {e}")
-                            await websocket.send_text(json.dumps({
+                            await websocket.send_text(json_codec.dumps({
                                 "type": "ack", 
                                 "cmd_type": "error", 
                                 "status": "failed", 
@@ -576,7 +609,7 @@ async def websocket_endpoint(websocket: WebSocket):
                         "ABNORMAL_CLOSURE" not in str(e) and "disconnect" not in str(e).lower()):
                         logger.error(f"[WebSocket] Inner error for {websocket.client.host}: {e}")
                     try:
-                        await websocket.send_text(json.dumps({
+                        await websocket.send_text(json_codec.dumps({
                             "type": "ack", 
                             "cmd_type": "error", 
                             "status": "ignored", 
@@ -590,7 +623,7 @@ async def websocket_endpoint(websocket: WebSocket):
             except asyncio.TimeoutError:
                 logger.debug(f"[WebSocket] Timeout waiting for message from {websocket.client.host}, sending ping")
                 try:
-                    await websocket.send_text(json.dumps({"type": "ping"}))
+                    await websocket.send_text(json_codec.dumps({"type": "ping"}))
                     last_pong = datetime.now()
                 except Exception as e:
                     if ("1000" not in str(e) and "1001" not in str(e) and 
@@ -613,7 +646,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     "ABNORMAL_CLOSURE" not in str(e) and "disconnect" not in str(e).lower()):
                     logger.error(f"[WebSocket] Outer error for {websocket.client.host}: {e}", exc_info=True)
                 try:
-                    await websocket.send_text(json.dumps({
+                    await websocket.send_text(json_codec.dumps({
                         "type": "ack", 
                         "cmd_type": "error", 
                         "status": "ignored", 
@@ -731,14 +764,9 @@ async def index(request: Request, user=Depends(get_current_user)):
         response = RedirectResponse(url="/login", status_code=302)
         return apply_security_headers(response)
     
-    # User is authenticated, serve the main dashboard
-    try:
-        lang = request.cookies.get('language', 'fa')
-        return get_templates().TemplateResponse("index.html", {"request": request, "translations": translations, "lang": lang})
-    except Exception as e:
-        logger.error(f"Error rendering index page: {e}")
-        # Fallback to dashboard
-        return get_templates().TemplateResponse("index.html", {"request": request, "translations": translations, "lang": lang})
+    # User is authenticated, serve the main dashboard (cached render; user data is fetched by the page)
+    lang = request.cookies.get('language', 'fa')
+    return render_page(request, "index.html", lang, user.get("role"))
 
 
 
@@ -746,14 +774,8 @@ async def dashboard(request: Request, user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    try:
-        lang = request.cookies.get('language', 'fa')
-        return get_templates().TemplateResponse("index.html", {"request": request, "translations": translations, "lang": lang})
-    except Exception as e:
-        logger.error(f"Error rendering dashboard: {e}")
-        # Fallback to index.html if dashboard.html doesn't exist
-        lang = request.cookies.get('language', 'fa')
-        return get_templates().TemplateResponse("index.html", {"request": request, "translations": translations, "lang": lang})
+    lang = request.cookies.get('language', 'fa')
+    return render_page(request, "index.html", lang, user.get("role"))
 
 
 
@@ -883,6 +905,7 @@ async def set_smart_features(cmd: SmartFeaturesCommand, request: Request, user=D
                     (user.get("sub"), request.client.host, validated_motion, validated_tracking, get_jalali_now_str())
                 )
                 await conn.commit()
+                invalidate_user(user.get("sub"))
                 
                 logger.info(f"Smart features saved to database for user: {user.get('sub')}")
                 
@@ -895,6 +918,7 @@ async def set_smart_features(cmd: SmartFeaturesCommand, request: Request, user=D
                         (user.get("sub"), request.client.host, get_jalali_now_str())
                     )
                     await conn.commit()
+                    invalidate_user(user.get("sub"))
                     logger.info(f"Smart features saved with fallback for user: {user.get('sub')}")
                 except Exception as e2:
                     logger.error(f"Fallback smart features save also failed: {e2}")
@@ -1020,8 +1044,9 @@ async def delete_video_by_filename(filename: str, user=Depends(get_current_user)
     # Delete from database
     conn = await get_db_connection()
     try:
-        await conn.execute("DELETE FROM security_videos WHERE filename=?", (filename,))
+        cursor = await conn.execute("DELETE FROM security_videos WHERE filename=?", (filename,))
         await conn.commit()
+        counters.bump("videos", -cursor.rowcount)
         logger.info(f"Removed {filename} from database")
     except Exception as e:
         logger.error(f"Error removing {filename} from database: {e}")
@@ -1183,6 +1208,7 @@ async def save_user_settings(settings: UserSettings, request: Request, user=Depe
                             logger.error(f"Fallback insert also failed: {e2}")
                             raise
                     
+                    invalidate_user(validated_settings['username'])
                     logger.info(f"User settings saved successfully for {validated_settings['username']}")
                     
                 finally:
@@ -1267,96 +1293,106 @@ async def save_user_settings(settings: UserSettings, request: Request, user=Depe
         logger.error(f"Unexpected error in save_user_settings: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+async def load_user_record(username: str):
+    """Return (user_row, settings_row) for username, served from user_record_cache when fresh"""
+    record = user_record_cache.get(username)
+    if record is not None:
+        return record
+    
+    # First, ensure all required columns exist
+    await migrate_user_settings_table()
+    
+    conn = await get_db_connection()
+    try:
+        user_query = await conn.execute(
+            'SELECT username, role, created_at FROM users WHERE username = ?',
+            (username,)
+        )
+        user_data = await user_query.fetchone()
+        if not user_data:
+            return None
+        
+        try:
+            settings_query = await conn.execute(
+                'SELECT theme, language, flash_settings, servo1, servo2, device_mode, photo_quality, smart_motion, smart_tracking, stream_enabled FROM user_settings WHERE username = ? ORDER BY updated_at DESC LIMIT 1',
+                (username,)
+            )
+            settings_data = await settings_query.fetchone()
+        except Exception as e:
+            logger.warning(f"Error querying user settings, using fallback: {e}")
+            settings_data = None
+    finally:
+        await close_db_connection(conn)
+    
+    record = (tuple(user_data), tuple(settings_data) if settings_data else None)
+    user_record_cache.set(username, record)
+    return record
+
 async def get_user_settings(request: Request, user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     try:
-        # First, ensure all required columns exist
-        await migrate_user_settings_table()
-        
-        conn = await get_db_connection()
+        record = await load_user_record(user.get("sub"))
+        if not record:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_data, settings_data = record
         
+        # Prepare response data with validation
+        # Generate/fetch CSRF token for authenticated user so frontend can include it in POST requests
         try:
-            # Get user data with improved error handling
-            user_query = await conn.execute(
-                'SELECT username, role FROM users WHERE username = ?',
-                (user.get("sub"),)
-            )
-            user_data = await user_query.fetchone()
-            
-            if not user_data:
-                raise HTTPException(status_code=404, detail="User not found")
-            
-            # Get user settings with improved validation and error handling
-            try:
-                settings_query = await conn.execute(
-                    'SELECT theme, language, flash_settings, servo1, servo2, device_mode, photo_quality, smart_motion, smart_tracking, stream_enabled FROM user_settings WHERE username = ? ORDER BY updated_at DESC LIMIT 1',
-                    (user.get("sub"),)
-                )
-                settings_data = await settings_query.fetchone()
-            except Exception as e:
-                logger.warning(f"Error querying user settings, using fallback: {e}")
-                settings_data = None
-            
-            # Prepare response data with validation
-            # Generate/fetch CSRF token for authenticated user so frontend can include it in POST requests
+            from .db import get_user_csrf_token
+            csrf_token_val = await get_user_csrf_token(user.get("sub"))
+        except Exception:
+            csrf_token_val = None
+        response_data = {
+            "status": "success",
+            "user_role": user_data[1],
+            "username": user_data[0],
+            "language": request.cookies.get('language', 'fa'),
+            "csrf_token": csrf_token_val
+        }
+        
+        if settings_data:
+            # Validate and sanitize retrieved data
+            flash_settings = settings_data[2] if settings_data[2] else "{}"
             try:
-                from .db import get_user_csrf_token
-                csrf_token_val = await get_user_csrf_token(user.get("sub"))
-            except Exception:
-                csrf_token_val = None
-            response_data = {
-                "status": "success",
-                "user_role": user_data[1],
-                "username": user_data[0],
-                "language": request.cookies.get('language', 'fa'),
-                "csrf_token": csrf_token_val
+                # Validate JSON format
+                if flash_settings and flash_settings != "{}":
+                    json.loads(flash_settings)
+            except json.JSONDecodeError:
+                flash_settings = "{}"
+            
+            response_data["settings"] = {
+                "theme": settings_data[0] if settings_data[0] in ['light', 'dark'] else "light",
+                "language": settings_data[1] if settings_data[1] in ['fa', 'en'] else "fa",
+                "flashSettings": flash_settings,
+                "servo1": max(0, min(180, settings_data[3])) if settings_data[3] is not None else 90,
+                "servo2": max(0, min(180, settings_data[4])) if settings_data[4] is not None else 90,
+                "device_mode": settings_data[5] if settings_data[5] in ['desktop', 'mobile'] else "desktop",
+                "photoQuality": max(1, min(100, settings_data[6])) if settings_data[6] is not None else 80,
+                "smart_motion": bool(settings_data[7]) if settings_data[7] is not None else False,
+                "smart_tracking": bool(settings_data[8]) if settings_data[8] is not None else False,
+                "stream_enabled": bool(settings_data[9]) if settings_data[9] is not None else False
+            }
+        else:
+            # Return validated default settings
+            response_data["settings"] = {
+                "theme": "light",
+                "language": "fa",
+                "flashSettings": "{}",
+                "device_mode": "desktop",
+                "servo1": 90,
+                "servo2": 90,
+                "photoQuality": 80,
+                "smart_motion": False,
+                "smart_tracking": False,
+                "stream_enabled": False
             }
-            
-            if settings_data:
-                # Validate and sanitize retrieved data
-                flash_settings = settings_data[2] if settings_data[2] else "{}"
-                try:
-                    # Validate JSON format
-                    if flash_settings and flash_settings != "{}":
-                        json.loads(flash_settings)
-                except json.JSONDecodeError:
-                    flash_settings = "{}"
-                
-                response_data["settings"] = {
-                    "theme": settings_data[0] if settings_data[0] in ['light', 'dark'] else "light",
-                    "language": settings_data[1] if settings_data[1] in ['fa', 'en'] else "fa",
-                    "flashSettings": flash_settings,
-                    "servo1": max(0, min(180, settings_data[3])) if settings_data[3] is not None else 90,
-                    "servo2": max(0, min(180, settings_data[4])) if settings_data[4] is not None else 90,
-                    "device_mode": settings_data[5] if settings_data[5] in ['desktop', 'mobile'] else "desktop",
-                    "photoQuality": max(1, min(100, settings_data[6])) if settings_data[6] is not None else 80,
-                    "smart_motion": bool(settings_data[7]) if settings_data[7] is not None else False,
-                    "smart_tracking": bool(settings_data[8]) if settings_data[8] is not None else False,
-                    "stream_enabled": bool(settings_data[9]) if settings_data[9] is not None else False
-                }
-            else:
-                # Return validated default settings
-                response_data["settings"] = {
-                    "theme": "light",
-                    "language": "fa",
-                    "flashSettings": "{}",
-                    "device_mode": "desktop",
-                    "servo1": 90,
-                    "servo2": 90,
-                    "photoQuality": 80,
-                    "smart_motion": False,
-                    "smart_tracking": False,
-                    "stream_enabled": False
-                }
-            
-            logger.info(f"User settings retrieved successfully for {user.get('sub')}")
-            return response_data
-            
-        finally:
-            await close_db_connection(conn)
         
+        logger.debug(f"User settings retrieved for {user.get('sub')}")
+        return response_data
+    
     except HTTPException:
         # Re-raise HTTP exceptions
         raise
@@ -1388,45 +1424,27 @@ async def get_user_profile(request: Request, user=Depends(get_current_user)):
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     try:
-        conn = await get_db_connection()
+        record = await load_user_record(user.get("sub"))
+        if not record:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_data, settings_data = record
         
-        try:
-            # Get user data
-            user_query = await conn.execute(
-                'SELECT username, role, created_at FROM users WHERE username = ?',
-                (user.get("sub"),)
-            )
-            user_data = await user_query.fetchone()
-            
-            if not user_data:
-                raise HTTPException(status_code=404, detail="User not found")
-            
-            # Get user settings for additional info
-            settings_query = await conn.execute(
-                'SELECT theme, language FROM user_settings WHERE username = ? ORDER BY updated_at DESC LIMIT 1',
-                (user.get("sub"),)
-            )
-            settings_data = await settings_query.fetchone()
-            
-            # Prepare profile data
-            profile_data = {
-                "status": "success",
-                "profile": {
-                    "username": user_data[0],
-                    "role": user_data[1],
-                    "created_at": user_data[2],
-                    "theme": settings_data[0] if settings_data and settings_data[0] else "light",
-                    "language": settings_data[1] if settings_data and settings_data[1] else "fa",
-                    "is_online": True,  # User is online if they can access this endpoint
-                    "last_seen": datetime.now().isoformat()
-                }
+        # Prepare profile data
+        profile_data = {
+            "status": "success",
+            "profile": {
+                "username": user_data[0],
+                "role": user_data[1],
+                "created_at": user_data[2],
+                "theme": settings_data[0] if settings_data and settings_data[0] else "light",
+                "language": settings_data[1] if settings_data and settings_data[1] else "fa",
+                "is_online": True,  # User is online if they can access this endpoint
+                "last_seen": datetime.now().isoformat()
             }
-            
-            logger.info(f"Profile data retrieved successfully for {user.get('sub')}")
-            return profile_data
-            
-        finally:
-            await close_db_connection(conn)
+        }
+        
+        logger.debug(f"Profile data retrieved for {user.get('sub')}")
+        return profile_data
         
     except HTTPException:
         raise
@@ -1536,11 +1554,11 @@ async def video_stream_websocket(websocket: WebSocket):
         # Wait for authentication message
         try:
             auth_data = await asyncio.wait_for(websocket.receive_text(), timeout=10.0)
-            auth_message = json.loads(auth_data)
+            auth_message = json_codec.loads(auth_data)
             
             if auth_message.get('type') != 'authenticate':
                 logger.warning(f"Invalid first message from video client {websocket.client.host}: {auth_message.get('type')}")
-                await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Invalid authentication message"}))
+                await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Invalid authentication message"}))
                 await websocket.close(code=4001, reason="Invalid authentication")
                 return
             
@@ -1548,7 +1566,7 @@ async def video_stream_websocket(websocket: WebSocket):
             token = auth_message.get('token')
             if not token:
                 logger.warning(f"No token provided by video client {websocket.client.host}")
-                await websocket.send_text(json.dumps({"type": "auth_failed", "message": "No token provided"}))
+                await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "No token provided"}))
                 await websocket.close(code=4001, reason="No token")
                 return
             
@@ -1556,7 +1574,7 @@ async def video_stream_websocket(websocket: WebSocket):
             user_data = verify_token(token)
             if not user_data:
                 logger.warning(f"Invalid JWT token from video client {websocket.client.host}")
-                await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Invalid token"}))
+                await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Invalid token"}))
                 await websocket.close(code=4001, reason="Invalid token")
                 return
             
@@ -1574,21 +1592,21 @@ async def video_stream_websocket(websocket: WebSocket):
             logger.info(f"Video WebSocket authenticated successfully from {websocket.client.host} (user: {username}, role: {user_role})")
             
             # Send authentication success message
-            await websocket.send_text(json.dumps({"type": "authenticated", "username": username, "role": user_role}))
+            await websocket.send_text(json_codec.dumps({"type": "authenticated", "username": username, "role": user_role}))
             
         except asyncio.TimeoutError:
             logger.warning(f"Video WebSocket authentication timeout from {websocket.client.host}")
-            await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Authentication timeout"}))
+            await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Authentication timeout"}))
             await websocket.close(code=4001, reason="Authentication timeout")
             return
         except json.JSONDecodeError:
             logger.warning(f"Invalid JSON in video WebSocket authentication message from {websocket.client.host}")
-            await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Invalid JSON"}))
+            await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Invalid JSON"}))
             await websocket.close(code=4001, reason="Invalid JSON")
             return
         except Exception as e:
             logger.error(f"Video WebSocket authentication error from {websocket.client.host}: {e}")
-            await websocket.send_text(json.dumps({"type": "auth_failed", "message": "Authentication error"}))
+            await websocket.send_text(json_codec.dumps({"type": "auth_failed", "message": "Authentication error"}))
             await websocket.close(code=4001, reason="Authentication error")
             return
         
@@ -1606,7 +1624,7 @@ async def video_stream_websocket(websocket: WebSocket):
                     # Send ping every 30 seconds to check connection
                     if current_time - last_ping_time > 30:
                         try:
-                            await websocket.send_text(json.dumps({"type": "ping"}))
+                            await websocket.send_text(json_codec.dumps({"type": "ping"}))
                             last_ping_time = current_time
                         except Exception as e:
                             # Connection is broken, break the loop
@@ -1691,55 +1709,70 @@ async def get_photo_count(user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     try:
-        photo_count = len([f for f in await asyncio.to_thread(os.listdir, GALLERY_DIR) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]) if os.path.exists(GALLERY_DIR) else 0
-        return {"status": "success", "count": photo_count}
+        if counters.is_stale():
+            await resync_stat_counters()
+        return {"status": "success", "count": counters.counters.get("photos", 0)}
     except Exception as e:
         logger.error(f"Photo count error: {e}")
         raise HTTPException(status_code=500, detail="Photo count error")
 
-
-async def get_gallery(page: int = 0, limit: int = 9, user=Depends(get_current_user)):
+async def get_dashboard_stats(user=Depends(get_current_user)):
+    """Dashboard totals (photos, videos, logs by level, security events by severity) from materialized counters"""
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     try:
-        if not os.path.exists(GALLERY_DIR):
-            await asyncio.to_thread(os.makedirs, GALLERY_DIR, exist_ok=True)
-        files = [f for f in await asyncio.to_thread(os.listdir, GALLERY_DIR) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-        files.sort(key=lambda x: os.path.getctime(os.path.join(GALLERY_DIR, x)), reverse=True)
-        start = page * limit
-        end = start + limit
-        page_files = files[start:end]
-        gallery_data = [{"filename": f, "url": f"/gallery/{f}", "size": os.path.getsize(os.path.join(GALLERY_DIR, f)), "timestamp": datetime.fromtimestamp(os.path.getctime(os.path.join(GALLERY_DIR, f))).isoformat()} for f in page_files]
-        return {"status": "success", "photos": gallery_data, "total": len(files), "page": page, "limit": limit, "has_more": end < len(files)}
+        if counters.is_stale():
+            await resync_stat_counters()
+        return {"status": "success", "stats": counters.summary()}
     except Exception as e:
-        raise e
+        logger.error(f"Dashboard stats error: {e}")
+        raise HTTPException(status_code=500, detail="Dashboard stats error")
+
 
-async def get_videos(page: int = 0, limit: int = 6, user=Depends(get_current_user)):
+async def get_gallery(page: int = 0, limit: int = 9, cursor: str = None, user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    if not os.path.exists(SECURITY_VIDEOS_DIR):
-        await asyncio.to_thread(os.makedirs, SECURITY_VIDEOS_DIR, exist_ok=True)
-    files = [f for f in await asyncio.to_thread(os.listdir, SECURITY_VIDEOS_DIR) if f.lower().endswith(('.mp4', '.avi', '.mov'))]
-    files.sort(key=lambda x: os.path.getctime(os.path.join(SECURITY_VIDEOS_DIR, x)), reverse=True)
-    start = page * limit
-    end = start + limit
-    page_files = files[start:end]
-    videos_data = []
-    for f in page_files:
-        # Extract hour from the timestamp in the filename (e.g., "video_2025-05-25_23-57-00.mp4")
-        try:
-            timestamp_part = f.split('_')[2].split('.')[0]  # Get "23-57-00"
-            hour = int(timestamp_part.split('-')[0])  # Extract "23" as the hour
-        except (IndexError, ValueError):
-            hour = 0  # Default to 0 if parsing fails
-        videos_data.append({
-            "filename": f,
-            "url": f"/security_videos/{f}",
-            "size": os.path.getsize(os.path.join(SECURITY_VIDEOS_DIR, f)),
-            "timestamp": datetime.fromtimestamp(os.path.getctime(os.path.join(SECURITY_VIDEOS_DIR, f))).isoformat(),
-            "hour": hour
-        })
-    return {"status": "success", "videos": videos_data, "total": len(files), "page": page, "limit": limit, "has_more": end < len(files)}
+    limit = max(1, min(limit, 100))
+    try:
+        rows, next_cursor, has_more = await list_media("manual_photos", limit, cursor=cursor, offset=max(page, 0) * limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    gallery_data = []
+    for row in rows:
+        photo = {
+            "filename": row["filename"],
+            "url": f"/gallery/{row['filename']}",
+            "size": row["size"],
+            "timestamp": datetime.fromtimestamp(row["mtime"]).isoformat()
+        }
+        if row["derivative_hash"] and row["width"]:
+            photo.update(photo_derivative_urls(row["derivative_hash"], row["width"]))
+        else:
+            # older photo: build its widths in the background, full size until then (no-op if queued or failed)
+            enqueue_photo(row["filename"])
+        gallery_data.append(photo)
+    return {"status": "success", "photos": gallery_data, "total": counters.counters.get("photos", 0), "page": page,
+            "limit": limit, "has_more": has_more, "next_cursor": next_cursor}
+
+async def get_videos(page: int = 0, limit: int = 6, cursor: str = None, user=Depends(get_current_user)):
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    limit = max(1, min(limit, 100))
+    try:
+        rows, next_cursor, has_more = await list_media("security_videos", limit, cursor=cursor, offset=max(page, 0) * limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    videos_data = [{
+        "filename": row["filename"],
+        "url": f"/security_videos/{row['filename']}",
+        "size": row["size"],
+        "timestamp": datetime.fromtimestamp(row["mtime"]).isoformat(),
+        "hour": row["hour_of_day"],
+        "poster_url": derivative_url(row["derivative_hash"], "poster.jpg") if row["derivative_hash"] else f"/video_poster/{row['filename']}",
+        "thumbnails_url": derivative_url(row["derivative_hash"], "vtt") if row["derivative_hash"] else None
+    } for row in rows]
+    return {"status": "success", "videos": videos_data, "total": counters.counters.get("videos", 0), "page": page,
+            "limit": limit, "has_more": has_more, "next_cursor": next_cursor}
 
 async def get_logs(limit: int = 50, source: str = None, level: str = None, user=Depends(get_current_user)):
     if not user:
@@ -1821,6 +1854,115 @@ async def get_all_logs(user=Depends(get_current_user)):
         if conn is not None:
             await close_db_connection(conn)
 
+async def search_logs_endpoint(q: str, origin: str = None, source: str = None, level: str = None,
+                               threat_level: str = None, since: str = None, until: str = None,
+                               limit: int = 50, offset: int = 0, order: str = "rank",
+                               user=Depends(get_current_user)):
+    """Full-text search over logs, camera_logs and security_events with highlighted snippets"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if not q or len(q) > 200:
+        raise HTTPException(status_code=400, detail="Invalid search query")
+    if origin and origin not in ("logs", "camera_logs", "security_events"):
+        raise HTTPException(status_code=400, detail="Invalid origin")
+    if order not in ("rank", "recent"):
+        raise HTTPException(status_code=400, detail="Invalid order")
+
+    try:
+        await init_db()
+    except Exception as e:
+        logger.error(f"Database initialization error in search_logs: {e}")
+        raise HTTPException(status_code=503, detail="Database temporarily unavailable")
+    # read at call time: init_log_search sets it (False when SQLite lacks FTS5)
+    if not db.log_search_available:
+        raise HTTPException(status_code=503, detail="Log search unavailable on this server")
+
+    try:
+        results = await search_logs(q, origin=origin, source=source, level=level, threat_level=threat_level,
+                                    since=since, until=until, limit=limit, offset=offset, order=order)
+        return {"status": "success", "query": q, "count": len(results), "results": results}
+    except Exception as e:
+        logger.error(f"Error in search_logs: {e}")
+        raise HTTPException(status_code=500, detail="Search error")
+
+def _parse_export_time(value: str) -> float:
+    """Epoch seconds or ISO-8601 (local time) -> epoch seconds"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+async def export_media(request: Request, start: str, end: str, camera: str = "esp32cam",
+                       include: str = "videos,photos", user=Depends(get_current_user)):
+    """Stream a store-mode ZIP (manifest + videos + photos) for a time range; resumable with Range/If-Range"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    if camera not in EXPORT_CAMERAS:
+        raise HTTPException(status_code=400, detail="Unknown camera")
+    table_by_kind = {"videos": "security_videos", "photos": "manual_photos"}
+    kinds = [k.strip() for k in include.split(",") if k.strip()]
+    if not kinds or any(k not in table_by_kind for k in kinds):
+        raise HTTPException(status_code=400, detail="Invalid include (videos, photos)")
+    try:
+        start_ts, end_ts = _parse_export_time(start), _parse_export_time(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start/end")
+    if end_ts <= start_ts:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    # Take the permit now, without waiting: no await between the check and acquire(), so concurrent requests
+    # cannot both pass. It is released when the response is done (or right away if we fail before that)
+    if export_semaphore.locked():
+        raise HTTPException(status_code=503, detail="Too many exports in progress, try again later",
+                            headers={"Retry-After": "30"})
+    await export_semaphore.acquire()
+    try:
+        return await _export_response(request, start, end, camera, start_ts, end_ts,
+                                      tuple(table_by_kind[k] for k in kinds))
+    except BaseException:
+        export_semaphore.release()
+        raise
+
+
+async def _export_response(request: Request, start: str, end: str, camera: str, start_ts: float, end_ts: float,
+                           tables: tuple):
+    try:
+        plan, etag = await build_export_plan(start_ts, end_ts, camera, tables)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Type": "application/zip",
+        "Content-Disposition": f'attachment; filename="export_{camera}_{int(start_ts)}_{int(end_ts)}.zip"',
+        "Cache-Control": "private, no-transform",
+    }
+    status_code, first, last = 200, 0, plan.total_size - 1
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        ranges = parse_range_header(range_header, plan.total_size)
+        if ranges and len(ranges) == 1:
+            status_code, (first, last) = 206, ranges[0]
+            headers["Content-Range"] = f"bytes {first}-{last}/{plan.total_size}"
+    headers["Content-Length"] = str(last - first + 1)
+
+    async def body():
+        try:
+            async for chunk in stream_zip(plan, first, last):
+                yield chunk
+        except Exception as e:
+            # headers are already sent; cutting the stream short makes the client see an incomplete download
+            logger.error(f"Export aborted: {e}")
+            raise
+
+    await insert_log(f"Media export {camera} {start}..{end}: {len(plan.entries) - 1} files, {plan.total_size} bytes", "export")
+    # the permit is released once the response has been handled, even if the body never started
+    return ClosingStreamingResponse(body(), status_code=status_code, headers=headers, on_close=export_semaphore.release)
+
+
 async def delete_photo(filename: str, request: Request, user=Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
@@ -1840,8 +1982,9 @@ async def delete_photo(filename: str, request: Request, user=Depends(get_current
     await asyncio.to_thread(os.remove, filepath)
     conn = await get_db_connection()
     try:
-        await conn.execute("DELETE FROM manual_photos WHERE filename=?", (filename,))
+        cursor = await conn.execute("DELETE FROM manual_photos WHERE filename=?", (filename,))
         await conn.commit()
+        counters.bump("photos", -cursor.rowcount)
     finally:
         await close_db_connection(conn)
     try:
@@ -1864,6 +2007,7 @@ async def logout(req: Request):
     try:
         client_ip = req.client.host
         await insert_log(f"Logout from {client_ip}", "auth")
+        revoke_token(req.cookies.get("access_token") or req.headers.get("Authorization", "").replace("Bearer ", ""))
         
         # Create response and clear cookie
         response = JSONResponse(content={"status": "success", "message": "Successfully logged out"})
@@ -1891,6 +2035,29 @@ async def set_language(request: Request):
     response.set_cookie(key="language", value=lang, max_age=60*60*24*365)
     return response
 
+async def serve_asset(path: str, request: Request):
+    """Fingerprinted static asset; picks the .br/.gz sibling that matches Accept-Encoding"""
+    resolved = resolve_asset(path, request.headers.get("accept-encoding", ""))
+    if not resolved:
+        # unknown or outdated fingerprint: send the client to the current file instead of a 404
+        logical = ASSET_FINGERPRINT_RE.sub(r"\1\2", path)
+        if logical in asset_manifest:
+            return RedirectResponse(url=asset_url(logical), status_code=307)
+        raise HTTPException(status_code=404, detail="Asset not found")
+    file_path, media_type, encoding, etag = resolved
+    headers = {
+        'Cache-Control': 'public, max-age=31536000, immutable',
+        'Vary': 'Accept-Encoding',
+        'ETag': etag,
+        'X-Content-Type-Options': 'nosniff'
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return FileResponse(file_path, media_type=media_type, headers=headers)
+
+
 async def serve_static_file(filename: str):
     logger.info(f"[STATIC] Requested static file: {filename}")
     
@@ -1951,6 +2118,22 @@ async def serve_gallery_file(filename: str, request: Request, user=Depends(get_c
     return apply_security_headers(response)
 
 
+async def serve_gallery_derivative(name: str, request: Request, user=Depends(get_current_user)):
+    """Resized gallery photos; content-hashed names, so they are cached as immutable"""
+    if not user:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    match = PHOTO_DERIVATIVE_NAME_RE.match(name or "")
+    if not match or int(match.group(1)) not in PHOTO_DERIVATIVE_WIDTHS:
+        raise HTTPException(status_code=400, detail="Invalid derivative name")
+    file_path = os.path.join(PHOTO_DERIVATIVES_DIR, name)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Derivative not found")
+    response = FileResponse(file_path, media_type=PHOTO_MEDIA_TYPES[match.group(2)], headers={
+        'Cache-Control': 'private, max-age=31536000, immutable'
+    })
+    return apply_security_headers(response)
+
+
 def get_video_content_type(filename: str) -> str:
     """Get the appropriate Content-Type for video files based on extension"""
     file_ext = os.path.splitext(filename)[1].lower()
@@ -1963,6 +2146,17 @@ def get_video_content_type(filename: str) -> str:
     }
     return content_types.get(file_ext, 'video/mp4')  # Default to mp4
 
+VIDEO_STREAM_HEADERS = {
+    'Content-Disposition': 'inline; filename=""',
+    'Cache-Control': 'public, max-age=3600, must-revalidate',
+    'X-Streaming-Only': 'true',
+    'X-Video-Security': 'streaming-only',
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'SAMEORIGIN',
+    'X-Download-Options': 'noopen',
+    'X-Permitted-Cross-Domain-Policies': 'none'
+}
+
 async def serve_video_file(request: Request, filename: str):
     """Serve video files with optimized streaming and no download capability"""
     # Validate filename
@@ -1973,139 +2167,38 @@ async def serve_video_file(request: Request, filename: str):
     # Construct file path
     file_path = os.path.join("security_videos", filename)
     
-    if not os.path.exists(file_path):
-        logger.warning(f"Video file not found: {filename}")
-        raise HTTPException(status_code=404, detail=f"File {filename} not found")
-    
     try:
-        file_size = os.path.getsize(file_path)
-        
-        # Enhanced streaming response for all videos
-        logger.info(f"Streaming video: {filename} ({file_size} bytes)")
-        
-        # Check for range requests (HTTP 206 Partial Content)
+        # Range/conditional handling lives in media_file_response
         range_header = request.headers.get('range')
         if range_header:
-            logger.info(f"Range request for {filename}: {range_header}")
-            return await handle_range_request(request, file_path, file_size, filename, range_header)
-        
-        # Full file streaming with optimized settings
-        logger.info(f"Full file streaming for {filename}")
-        return await handle_full_file_streaming(request, file_path, file_size, filename)
+            logger.debug(f"Range request for {filename}: {range_header}")
+        return await _stream_video(request, file_path, filename)
         
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        logger.warning(f"Video file not found: {filename}")
+        raise HTTPException(status_code=404, detail=f"File {filename} not found")
     except OSError as e:
         logger.warning(f"Error accessing video file: {filename} - {e}")
         raise HTTPException(status_code=404, detail="File not found")
     except Exception as e:
-        unregister_file_connection(filename)
         logger.error(f"Error serving video file {filename}: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-async def handle_range_request(request: Request, file_path: str, file_size: int, filename: str, range_header: str):
-    """Handle HTTP range requests for video seeking"""
+async def _stream_video(request: Request, file_path: str, filename: str):
+    """Conditional/range-aware video response; disk reads run off the event loop"""
+    register_file_connection(filename)
     try:
-        import re
-        match = re.match(r'bytes=(\d+)-(\d+)?', range_header)
-        if not match:
-            raise HTTPException(status_code=400, detail="Invalid range header")
-        
-        start = int(match.group(1))
-        end = int(match.group(2)) if match.group(2) else file_size - 1
-        
-        # Validate range
-        if start >= file_size or end >= file_size or start > end:
-            raise HTTPException(status_code=416, detail="Range not satisfiable")
-        
-        content_length = end - start + 1
-        
-        async def range_generator():
-            try:
-                with open(file_path, 'rb') as f:
-                    f.seek(start)
-                    remaining = content_length
-                    chunk_size = 64 * 1024  # 64KB chunks for better performance
-                    
-                    while remaining > 0:
-                        read_size = min(chunk_size, remaining)
-                        chunk = f.read(read_size)
-                        if not chunk:
-                            break
-                        yield chunk
-                        remaining -= len(chunk)
-            except Exception as e:
-                logger.error(f"Error in range generator: {e}")
-                raise HTTPException(status_code=500, detail="Error reading file")
-            finally:
-                unregister_file_connection(filename)
-        
-        content_type = get_video_content_type(filename)
-        
-        response = StreamingResponse(
-            range_generator(),
-            headers={
-                'Accept-Ranges': 'bytes',
-                'Content-Range': f'bytes {start}-{end}/{file_size}',
-                'Content-Length': str(content_length),
-                'Content-Type': content_type,
-                'Content-Disposition': 'inline; filename=""',
-                'Cache-Control': 'public, max-age=3600, must-revalidate',
-                'ETag': f'"{hash(filename + str(file_size))}"',
-                'X-Streaming-Only': 'true',
-                'X-Video-Security': 'streaming-only',
-                'X-Content-Type-Options': 'nosniff',
-                'X-Frame-Options': 'SAMEORIGIN',
-                'X-Download-Options': 'noopen',
-                'X-Permitted-Cross-Domain-Policies': 'none'
-            },
-            status_code=206
+        response = await media_file_response(
+            request, file_path, get_video_content_type(filename),
+            headers=VIDEO_STREAM_HEADERS,
+            on_close=lambda: unregister_file_connection(filename)
         )
-        
-        register_file_connection(filename)
-        return apply_security_headers(response)
-        
-    except Exception as e:
-        logger.error(f"Error handling range request: {e}")
-        raise HTTPException(status_code=500, detail="Error processing range request")
-
-
-async def handle_full_file_streaming(request: Request, file_path: str, file_size: int, filename: str):
-    """Handle full file streaming with optimized performance"""
-    async def full_file_generator():
-        try:
-            with open(file_path, 'rb') as f:
-                chunk_size = 64 * 1024  # 64KB chunks for better performance
-                while True:
-                    chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
-                    yield chunk
-        except Exception as e:
-            logger.error(f"Error in full file generator: {e}")
-            raise HTTPException(status_code=500, detail="Error reading file")
-        finally:
-            unregister_file_connection(filename)
-    
-    content_type = get_video_content_type(filename)
-    
-    response = StreamingResponse(
-        full_file_generator(),
-        headers={
-            'Accept-Ranges': 'bytes',
-            'Content-Type': content_type,
-            'Content-Disposition': 'inline; filename=""',
-            'Cache-Control': 'public, max-age=3600, must-revalidate',
-            'ETag': f'"{hash(filename + str(file_size))}"',
-            'X-Streaming-Only': 'true',
-            'X-Video-Security': 'streaming-only',
-            'X-Content-Type-Options': 'nosniff',
-            'X-Frame-Options': 'SAMEORIGIN',
-            'X-Download-Options': 'noopen',
-            'X-Permitted-Cross-Domain-Policies': 'none'
-        }
-    )
-    
-    register_file_connection(filename)
+    except BaseException:
+        unregister_file_connection(filename)
+        raise
     return apply_security_headers(response)
 
 
@@ -2116,61 +2209,17 @@ async def login_page(request: Request):
         return RedirectResponse(url="/", status_code=302)
     
     lang = request.cookies.get('language', 'fa')
-    return get_templates().TemplateResponse("login.html", {"request": request, "translations": translations, "lang": lang})
+    return render_page(request, "login.html", lang)
 
 
 
 def check_login_attempts(client_ip: str) -> bool:
     """Enhanced in-memory login attempts tracking"""
     try:
-        global login_attempts_storage
         # Skip login attempts check for local test requests
         if is_local_test_request(client_ip):
             return True
-        
-        current_time = time.time()
-        
-        # Safely access config with defaults
-        try:
-            config = RATE_LIMIT_CONFIG.get('LOGIN_ATTEMPTS', {})
-            max_requests = config.get('max_requests', 5)
-            window_seconds = config.get('window_seconds', 300)
-        except Exception as e:
-            logger.warning(f"[LOGIN] Error accessing rate limit config: {e}")
-            # Use default values if config access fails
-            max_requests = 5
-            window_seconds = 300
-        
-        window_start = current_time - window_seconds
-        
-        # Clean old entries
-        login_attempts_storage = {ip: data for ip, data in login_attempts_storage.items() 
-                                if data['last_attempt'] > window_start}
-        
-        # Check current IP
-        if client_ip not in login_attempts_storage:
-            login_attempts_storage[client_ip] = {'count': 0, 'last_attempt': 0, 'blocked_until': 0}
-        
-        # Check if still blocked
-        if login_attempts_storage[client_ip]['blocked_until'] > current_time:
-            return False
-        
-        # Reset count if window expired
-        if login_attempts_storage[client_ip]['last_attempt'] < window_start:
-            login_attempts_storage[client_ip]['count'] = 0
-        
-        # Check if limit exceeded
-        if login_attempts_storage[client_ip]['count'] >= max_requests:
-            try:
-                ban_duration = SECURITY_CONFIG.get('LOGIN_BAN_DURATION', 300)
-            except Exception as e:
-                logger.warning(f"[LOGIN] Error accessing security config: {e}")
-                ban_duration = 300  # Default to 5 minutes
-            
-            login_attempts_storage[client_ip]['blocked_until'] = current_time + ban_duration
-            return False
-        
-        return True
+        return login_failure_limiter.check(client_ip)
     except Exception as e:
         logger.error(f"[LOGIN] Error in check_login_attempts: {e}")
         # If there's an error, allow the login attempt to proceed
@@ -2180,45 +2229,22 @@ def check_login_attempts(client_ip: str) -> bool:
 def record_login_attempt(client_ip: str, success: bool):
     """Enhanced in-memory login attempt recording"""
     try:
-        current_time = time.time()
-        
-        # Initialize if not exists
-        if client_ip not in login_attempts_storage:
-            login_attempts_storage[client_ip] = {'count': 0, 'last_attempt': 0, 'blocked_until': 0}
-        
         if success:
             # Reset on successful login
-            login_attempts_storage[client_ip]['count'] = 0
-            login_attempts_storage[client_ip]['blocked_until'] = 0
+            login_failure_limiter.reset(client_ip)
         else:
-            # Increment failed attempts
-            login_attempts_storage[client_ip]['count'] += 1
-            login_attempts_storage[client_ip]['last_attempt'] = current_time
-            
-            # Block if limit exceeded - safely access config
-            try:
-                config = RATE_LIMIT_CONFIG.get('LOGIN_ATTEMPTS', {})
-                max_requests = config.get('max_requests', 5)  # Default to 5
-                
-                if login_attempts_storage[client_ip]['count'] >= max_requests:
-                    ban_duration = SECURITY_CONFIG.get('LOGIN_BAN_DURATION', 300)  # Default to 5 minutes
-                    login_attempts_storage[client_ip]['blocked_until'] = current_time + ban_duration
-            except Exception as e:
-                logger.warning(f"[LOGIN] Error accessing rate limit config: {e}")
-                # Use default values if config access fails
-                if login_attempts_storage[client_ip]['count'] >= 5:
-                    login_attempts_storage[client_ip]['blocked_until'] = current_time + 300
+            # Increment failed attempts (blocks when the limit is reached)
+            login_failure_limiter.add(client_ip)
     except Exception as e:
         logger.error(f"[LOGIN] Error in record_login_attempt: {e}")
         # Don't let this function fail the login process
         pass
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password using bcrypt"""
+    """Verify password using bcrypt (blocking; login uses verify_password_async)"""
     try:
-        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        return verify_password_sync(plain_password, hashed_password)
     except ImportError:
-        logger.error("bcrypt is required for password verification. Please install it: pip install bcrypt")
         return False
 
 
@@ -2332,7 +2358,10 @@ async def login(request: LoginRequest, req: Request):
                     logger.debug(f"[LOGIN] Verifying password for {username}")
                     
                     try:
-                        password_ok = verify_password(sanitized_password, password_hash)
+                        # bcrypt runs on the password worker pool, not the event loop (429 when saturated)
+                        password_ok = await verify_password_async(sanitized_password, password_hash)
+                    except HTTPException:
+                        raise
                     except Exception as e:
                         logger.error(f"[LOGIN] bcrypt error: {e}")
                         raise HTTPException(status_code=500, detail="خطا در تأیید رمز عبور")
@@ -2340,6 +2369,14 @@ async def login(request: LoginRequest, req: Request):
                     if password_ok:
                         record_login_attempt(client_ip, True)
                         
+                        # Upgrade hashes made with a different BCRYPT_ROUNDS
+                        new_hash = await rehash_if_needed(sanitized_password, password_hash)
+                        if new_hash:
+                            await conn.execute('UPDATE users SET password_hash = ? WHERE username = ?', (new_hash, username))
+                            await conn.commit()
+                            invalidate_user(username)
+                            logger.info(f"[LOGIN] Password hash upgraded for {username}")
+                        
                         # Check if user has 2FA enabled
                         if two_fa_enabled and two_fa_secret:
                             logger.info(f"[LOGIN] 2FA required for {username}")
@@ -2438,18 +2475,23 @@ async def login(request: LoginRequest, req: Request):
 
 # Temporary CSRF token functions for unauthenticated users
 async def validate_temp_csrf_token(session_id: str, token: str) -> bool:
-    """Validate temporary CSRF token for unauthenticated users"""
+    """Validate temporary CSRF token for unauthenticated users (temp_csrf_cache, database on a miss)"""
     try:
-        conn = await get_db_connection()
-        cursor = await conn.execute(
-            "SELECT csrf_token, expires_at FROM temp_csrf_tokens WHERE session_id = ? AND expires_at > ?",
-            (session_id, datetime.now().isoformat())
-        )
-        result = await cursor.fetchone()
-        await close_db_connection(conn)
+        stored_token = temp_csrf_cache.get(session_id)
+        if stored_token is None:
+            conn = await get_db_connection()
+            cursor = await conn.execute(
+                "SELECT csrf_token, expires_at FROM temp_csrf_tokens WHERE session_id = ? AND expires_at > ?",
+                (session_id, datetime.now().isoformat())
+            )
+            result = await cursor.fetchone()
+            await close_db_connection(conn)
+            if result and result[0]:
+                stored_token, expiry = result
+                temp_csrf_cache.set(session_id, stored_token,
+                                    ttl=(datetime.fromisoformat(expiry) - datetime.now()).total_seconds())
         
-        if result and result[0]:
-            stored_token, expiry = result
+        if stored_token:
             if validate_csrf_token(token, stored_token):
                 # Don't delete the token immediately - let it expire naturally
                 # This allows for retry attempts and better user experience
@@ -2529,7 +2571,7 @@ async def register(request: RegisterRequest, req: Request):
                     raise HTTPException(status_code=400, detail="ایمیل قبلاً ثبت شده است")
             
             # Hash password
-            password_hash = hash_password(sanitized_password)
+            password_hash = await hash_password_async(sanitized_password)
             
             # Insert new user
             if sanitized_email:
@@ -2771,7 +2813,7 @@ async def reset_password(reset_request: PasswordResetRequest, req: Request):
                 raise HTTPException(status_code=400, detail="کد قبلاً استفاده شده است")
             
             # Hash new password
-            password_hash = hash_password(sanitized_password)
+            password_hash = await hash_password_async(sanitized_password)
             
             # Update user password
             await conn.execute(
@@ -2787,6 +2829,11 @@ async def reset_password(reset_request: PasswordResetRequest, req: Request):
             
             await conn.commit()
             
+            user_query = await conn.execute('SELECT username FROM users WHERE phone = ?', (phone,))
+            for row in await user_query.fetchall():
+                invalidate_user(row[0])
+                revoke_user_tokens(row[0])
+            
             await insert_log(f"Password reset successful for {phone} from {client_ip}", "auth")
             
             return {"status": "success", "message": "رمز عبور با موفقیت تغییر یافت"}
@@ -2839,22 +2886,34 @@ async def create_security_video(frames: List[Tuple[bytes, datetime]]):
             await asyncio.to_thread(video_writer.write, frame)
         await asyncio.to_thread(video_writer.release)
         system_state.video_count += 1
+        video_size, video_mtime = await asyncio.to_thread(file_stat, video_filepath)
         async def insert_video():
             conn = await get_db_connection()
             try:
                 await conn.execute(
-                    "INSERT INTO security_videos (filename, filepath, hour_of_day, duration, created_at) VALUES (?, ?, ?, ?, ?)",
-                    (video_filename, video_filepath, hour_of_day, 3600, get_jalali_now_str())
+                    "INSERT INTO security_videos (filename, filepath, hour_of_day, duration, created_at, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (video_filename, video_filepath, hour_of_day, 3600, get_jalali_now_str(), video_size, video_mtime)
                 )
                 await conn.commit()
+                counters.bump("videos")
             finally:
                 await close_db_connection(conn)
         await retry_async(insert_video)
         logger.info(f"Security video created: {video_filename}")
+        # Properties are known here, so the metadata endpoint never has to probe this file
+        try:
+            video_stat = await asyncio.to_thread(os.stat, video_filepath)
+            await store_video_metadata(video_filename, video_stat, {
+                "width": width, "height": height, "fps": round(float(VIDEO_FPS), 2),
+                "frame_count": len(frames), "duration": len(frames) / VIDEO_FPS
+            })
+        except Exception as e:
+            logger.warning(f"Could not cache metadata for {video_filename}: {e}")
+        enqueue_video(video_filename)
         async with system_state.web_clients_lock:
             for client in system_state.web_clients:
                 try:
-                    await client.send_text(json.dumps({
+                    await client.send_text(json_codec.dumps({
                         "type": "video_created",
                         "filename": video_filename,
                         "url": f"/security_videos/{video_filename}",
@@ -2878,30 +2937,23 @@ async def create_security_video_async(frames: List[Tuple[bytes, datetime]]):
 
 
 async def generate_video_poster(request: Request, filename: str):
-    """Generate video poster (thumbnail) from the first frame, similar to Windows behavior"""
+    """Serve the video poster built by the derivative worker; never decodes video in the request"""
+    # Validate filename
+    if not filename or '..' in filename or '/' in filename:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    
+    file_path = os.path.join("security_videos", filename)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Video file not found")
+    
     try:
-        # Validate filename
-        if not filename or '..' in filename or '/' in filename:
-            raise HTTPException(status_code=400, detail="Invalid filename")
-        
-        # Construct file path
-        file_path = os.path.join("security_videos", filename)
-        
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="Video file not found")
-        
-        # Check if poster already exists
-        poster_dir = os.path.join("security_videos", "posters")
-        os.makedirs(poster_dir, exist_ok=True)
-        
-        poster_filename = f"{os.path.splitext(filename)[0]}_poster.jpg"
-        poster_path = os.path.join(poster_dir, poster_filename)
-        
-        # Generate poster if it doesn't exist
-        if not os.path.exists(poster_path):
-            await generate_video_poster_frame(file_path, poster_path)
-        
-        # Serve the poster image
+        content_hash = await get_video_derivative_hash(filename)
+    except Exception as e:
+        logger.warning(f"Could not look up poster for {filename}: {e}")
+        content_hash = None
+    
+    if content_hash:
+        poster_path = derivative_path(content_hash, "poster.jpg")
         if os.path.exists(poster_path):
             return FileResponse(
                 poster_path,
@@ -2911,110 +2963,35 @@ async def generate_video_poster(request: Request, filename: str):
                     'X-Poster-Generated': 'true'
                 }
             )
-        else:
-            raise HTTPException(status_code=500, detail="Failed to generate poster")
-            
-    except Exception as e:
-        logger.error(f"Error generating video poster for {filename}: {e}")
-        raise HTTPException(status_code=500, detail="Error generating poster")
-
-
-async def generate_video_poster_frame(video_path: str, poster_path: str):
-    """Extract first frame from video and save as JPEG poster"""
-    try:
-        import cv2
-        
-        # Open video file
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise Exception("Could not open video file")
-        
-        # Read first frame
-        ret, frame = cap.read()
-        if not ret:
-            raise Exception("Could not read video frame")
-        
-        # Resize frame for optimal poster size (16:9 aspect ratio)
-        height, width = frame.shape[:2]
-        target_width = 320
-        target_height = int(target_width * 9 / 16)
-        
-        # Resize frame
-        resized_frame = cv2.resize(frame, (target_width, target_height), interpolation=cv2.INTER_AREA)
-        
-        # Save as JPEG with high quality
-        cv2.imwrite(poster_path, resized_frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
-        
-        # Release video capture
-        cap.release()
-        
-        logger.info(f"Generated poster for video: {os.path.basename(video_path)}")
-        
-    except ImportError:
-        logger.warning("OpenCV not available, using fallback poster generation")
-        await generate_fallback_poster(video_path, poster_path)
-    except Exception as e:
-        logger.error(f"Error generating poster frame: {e}")
-        await generate_fallback_poster(video_path, poster_path)
-
-
-async def generate_fallback_poster(video_path: str, poster_path: str):
-    """Fallback poster generation using ffmpeg if available"""
-    try:
-        import subprocess
-        
-        # Use ffmpeg to extract first frame
-        cmd = [
-            'ffmpeg', '-i', video_path, 
-            '-vframes', '1', 
-            '-q:v', '2',  # High quality
-            '-vf', 'scale=320:180',  # 16:9 aspect ratio
-            '-y',  # Overwrite output
-            poster_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0 and os.path.exists(poster_path):
-            logger.info(f"Generated poster using ffmpeg: {os.path.basename(video_path)}")
-        else:
-            raise Exception(f"ffmpeg failed: {result.stderr}")
-            
-    except (subprocess.TimeoutExpired, FileNotFoundError, Exception) as e:
-        logger.error(f"Fallback poster generation failed: {e}")
-        # Create a default poster with video info
-        await create_default_poster(video_path, poster_path)
+    
+    # Legacy posters generated on demand by older versions
+    legacy_poster = os.path.join("security_videos", "posters", f"{os.path.splitext(filename)[0]}_poster.jpg")
+    if os.path.exists(legacy_poster):
+        return FileResponse(legacy_poster, media_type="image/jpeg",
+                            headers={'Cache-Control': 'public, max-age=86400', 'X-Poster-Generated': 'true'})
+    
+    # Not generated yet: queue it and send the placeholder without caching it
+    enqueue_video(filename)
+    return FileResponse(
+        os.path.join("static", "images", "placeholder.gif"),
+        media_type="image/gif",
+        headers={'Cache-Control': 'no-store', 'X-Poster-Generated': 'pending'}
+    )
 
 
-async def create_default_poster(video_path: str, poster_path: str):
-    """Create a default poster with video information when all else fails"""
-    try:
-        from PIL import Image, ImageDraw, ImageFont
-        import os
-        
-        # Create a 320x180 black image
-        img = Image.new('RGB', (320, 180), color='black')
-        draw = ImageDraw.Draw(img)
-        
-        # Try to use a default font
-        try:
-            font = ImageFont.truetype("arial.ttf", 16)
-        except:
-            font = ImageFont.load_default()
-        
-        # Get video filename
-        filename = os.path.basename(video_path)
-        
-        # Draw video icon and filename
-        draw.text((160, 80), "🎥", fill="white", anchor="mm", font=font)
-        draw.text((160, 120), filename[:20], fill="white", anchor="mm", font=font)
-        
-        # Save the default poster
-        img.save(poster_path, "JPEG", quality=90)
-        logger.info(f"Created default poster for: {filename}")
-        
-    except Exception as e:
-        logger.error(f"Failed to create default poster: {e}")
+async def serve_video_derivative(name: str):
+    """Content-hashed poster/sprite/WebVTT files; the name changes with the content so they never expire"""
+    match = DERIVATIVE_NAME_RE.match(name or "")
+    if not match:
+        raise HTTPException(status_code=400, detail="Invalid derivative name")
+    path = os.path.join(DERIVATIVES_DIR, name)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Derivative not found")
+    return FileResponse(
+        path,
+        media_type=DERIVATIVE_MEDIA_TYPES[match.group(1)],
+        headers={'Cache-Control': 'public, max-age=31536000, immutable'}
+    )
 
 
 async def get_video_metadata(request: Request, filename: str):
@@ -3027,14 +3004,13 @@ async def get_video_metadata(request: Request, filename: str):
         # Construct file path
         file_path = os.path.join("security_videos", filename)
         
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="Video file not found")
-        
         # Get basic file info
-        stat_info = os.stat(file_path)
+        try:
+            stat_info = await asyncio.to_thread(os.stat, file_path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Video file not found")
         file_size = stat_info.st_size
         
-        # Get video metadata using OpenCV
         metadata = {
             "filename": filename,
             "file_size": file_size,
@@ -3044,40 +3020,33 @@ async def get_video_metadata(request: Request, filename: str):
             "access_time": datetime.fromtimestamp(stat_info.st_atime).isoformat(),
             "poster_url": f"/video_poster/{filename}"
         }
+        content_hash = await get_video_derivative_hash(filename)
+        if content_hash:
+            metadata.update({
+                "poster_url": derivative_url(content_hash, "poster.jpg"),
+                "sprite_url": derivative_url(content_hash, "sprite.jpg"),
+                "thumbnails_url": derivative_url(content_hash, "vtt")
+            })
         
-        try:
-            import cv2
-            
-            cap = cv2.VideoCapture(file_path)
-            if cap.isOpened():
-                # Get video properties
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                
-                # Calculate duration
-                duration = frame_count / fps if fps > 0 else 0
-                duration_formatted = format_duration(duration)
-                
-                metadata.update({
-                    "width": width,
-                    "height": height,
-                    "fps": round(fps, 2),
-                    "frame_count": frame_count,
-                    "duration": duration,
-                    "duration_formatted": duration_formatted,
-                    "aspect_ratio": f"{width}:{height}",
-                    "resolution": f"{width}x{height}"
-                })
-                
-                cap.release()
-                
-        except ImportError:
-            logger.warning("OpenCV not available, using basic metadata")
+        # Cached by (inode, mtime, size); the decoder only runs for files never probed before
+        info = await get_video_info(filename, stat_info, file_path)
+        if info:
+            width, height = info["width"], info["height"]
+            metadata.update({
+                "width": width,
+                "height": height,
+                "fps": info["fps"],
+                "frame_count": info["frame_count"],
+                "duration": info["duration"],
+                "duration_formatted": format_duration(info["duration"] or 0),
+                "aspect_ratio": f"{width}:{height}",
+                "resolution": f"{width}x{height}"
+            })
         
         return JSONResponse(content=metadata)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting video metadata for {filename}: {e}")
         raise HTTPException(status_code=500, detail="Error getting metadata")
@@ -3172,7 +3141,13 @@ async def health_check():
                 "websocket": current_system_state.error_counts.get("websocket", 0),
                 "database": current_system_state.error_counts.get("database", 0),
                 "frame_processing": current_system_state.error_counts.get("frame_processing", 0)
-            }
+            },
+            "caches": cache_stats(),
+            "password_hashing": password_hash_stats(),
+            "upload_inspection": inspection_stats(),
+            "sms": get_sms_dispatcher().stats(),
+            "google_oauth": oidc_stats(),
+            "captcha": captcha_pool.stats()
         }
         
         # Determine overall health status
@@ -380,6 +380,17 @@ def get_jalali_now_str():
         logger.warning(f"Error getting Jalali datetime: {e}")
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
+def get_jalali_str_before(delta: timedelta) -> str:
+    """Get (now - delta) in the same string format as get_jalali_now_str, for created_at comparisons"""
+    try:
+        if PERSIANTOOLS_AVAILABLE:
+            return (JalaliDateTime.now() - delta).strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            return (datetime.now() - delta).strftime('%Y-%m-%d %H:%M:%S')
+    except Exception as e:
+        logger.warning(f"Error getting Jalali datetime: {e}")
+        return (datetime.now() - delta).strftime('%Y-%m-%d %H:%M:%S')
+
 def is_local_test_request(client_ip: str) -> bool:
     """Check if request is from localhost for testing"""
     return client_ip in ['127.0.0.1', 'localhost', '::1']
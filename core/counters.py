@@ -0,0 +1,55 @@
+import os, time, logging
+
+# Setup logger for this module
+logger = logging.getLogger("counters")
+
+# Constants
+COUNTER_RESYNC_INTERVAL = int(os.getenv("COUNTER_RESYNC_INTERVAL", "300"))  # drift correction from stat_counters
+
+# کلیدهای شمارنده (جدول stat_counters توسط trigger ها نگهداری می‌شود):
+#   photos, videos, logs.<log_type>, camera_logs.<log_type>, security_events.<severity>
+COUNTER_GROUPS = {
+    "logs": "logs_by_level",
+    "camera_logs": "camera_logs_by_level",
+    "security_events": "security_events_by_severity",
+}
+
+# In-memory mirror of stat_counters
+counters = {}
+last_sync = 0.0
+
+
+def bump(key: str, delta: int = 1):
+    """Apply a committed insert/delete to the in-memory mirror"""
+    counters[key] = counters.get(key, 0) + delta
+
+
+def is_stale() -> bool:
+    return time.time() - last_sync > COUNTER_RESYNC_INTERVAL
+
+
+async def refresh_counters(conn):
+    """Reload the mirror from stat_counters using an open connection"""
+    global counters, last_sync
+    cursor = await conn.execute("SELECT key, value FROM stat_counters")
+    counters = {row[0]: row[1] for row in await cursor.fetchall()}
+    last_sync = time.time()
+
+
+def summary() -> dict:
+    """Dashboard totals straight from the mirror"""
+    data = {
+        "photos": counters.get("photos", 0),
+        "videos": counters.get("videos", 0),
+        "logs_by_level": {},
+        "camera_logs_by_level": {},
+        "security_events_by_severity": {},
+    }
+    for key, value in counters.items():
+        prefix, _, name = key.partition(".")
+        group = COUNTER_GROUPS.get(prefix)
+        if group and name and value:
+            data[group][name] = value
+    data["logs_total"] = sum(data["logs_by_level"].values())
+    data["security_events_total"] = sum(data["security_events_by_severity"].values())
+    return data
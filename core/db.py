@@ -1,4 +1,4 @@
-import asyncio, aiosqlite, os, functools, gzip, logging, logging.config, logging.handlers
+import asyncio, aiosqlite, os, functools, logging, logging.config, logging.handlers
 from typing import Optional
 from datetime import datetime, timedelta
 from fastapi import Request, HTTPException
@@ -14,6 +14,9 @@ from .config import (
 from .Security import log_security_event, validate_csrf_token, generate_csrf_token, get_csrf_token_from_request
 from .token import get_current_user
 
+from . import counters
+from .cache import user_csrf_cache, USER_CSRF_TTL
+
 # Setup logger for this module
 logger = logging.getLogger("db")
 
@@ -112,36 +115,32 @@ async def check_db_health():
 
 
 async def restore_db_from_backup():
+    from .backup import restore_candidates, materialize_backup, discard_backup
     try:
-        backups = sorted(
-            [f for f in await asyncio.to_thread(os.listdir, BACKUP_DIR) if f.endswith('.gz')],
-            key=lambda x: os.path.getctime(os.path.join(BACKUP_DIR, x)),
-            reverse=True
-        )[:MAX_BACKUP_CHECK]
+        backups = (await asyncio.to_thread(restore_candidates))[:MAX_BACKUP_CHECK]
         corrupt_count = 0
+        discarded = set()
         for backup in backups:
-            backup_file = os.path.join(BACKUP_DIR, backup)
+            if backup["file"] in discarded:
+                continue
             temp_file = os.path.join(BACKUP_DIR, "temp.db")
             try:
-                await asyncio.to_thread(lambda: gzip.open(backup_file, 'rb').readinto, open(temp_file, 'wb'))
+                await asyncio.to_thread(materialize_backup, backup, temp_file)
                 await asyncio.to_thread(os.replace, temp_file, DB_FILE)
                 if await check_db_health():
-                    logger.info(f"Database restored from {backup}")
+                    logger.info(f"Database restored from {backup['file']}")
                     system_state = get_system_state()
                     system_state.db_initialized = False
                     await init_db()
                     return True
-                await asyncio.to_thread(os.remove, temp_file)
-                logger.warning(f"Backup {backup} is corrupt, deleted")
-                await asyncio.to_thread(os.remove, backup_file)
-                corrupt_count += 1
+                logger.warning(f"Backup {backup['file']} is corrupt, deleted")
             except Exception as e:
-                logger.error(f"Error restoring backup {backup}: {e}")
+                logger.error(f"Error restoring backup {backup['file']}: {e}")
                 if os.path.exists(temp_file):
                     await asyncio.to_thread(os.remove, temp_file)
-                if os.path.exists(backup_file):
-                    await asyncio.to_thread(os.remove, backup_file)
-                corrupt_count += 1
+            # Drop it from the manifest too (with any differentials built on it) so nothing refers to it later
+            discarded |= await asyncio.to_thread(discard_backup, backup)
+            corrupt_count += 1
         if corrupt_count > 3:
             logger.error("Multiple corrupt backups detected")
         logger.error("No valid backups found")
@@ -668,7 +667,11 @@ async def init_db():
             quality INTEGER DEFAULT 80,
             flash_used BOOLEAN DEFAULT FALSE,
             flash_intensity INTEGER DEFAULT 50,
-            created_at TEXT DEFAULT ''
+            created_at TEXT DEFAULT '',
+            size INTEGER DEFAULT NULL,
+            mtime REAL DEFAULT NULL,
+            derivative_hash TEXT DEFAULT NULL,
+            width INTEGER DEFAULT NULL
         )""")
         logger.info("✅ Manual photos table created/verified")
         
@@ -679,10 +682,75 @@ async def init_db():
             filepath TEXT NOT NULL,
             hour_of_day INTEGER NOT NULL,
             duration INTEGER DEFAULT 3600,
-            created_at TEXT DEFAULT ''
+            created_at TEXT DEFAULT '',
+            size INTEGER DEFAULT NULL,
+            mtime REAL DEFAULT NULL,
+            derivative_hash TEXT DEFAULT NULL
         )""")
         logger.info("✅ Security videos table created/verified")
         
+        # Media catalog columns (size/mtime) for legacy databases; filled by core/media_catalog.py
+        # derivative_hash names the generated posters/thumbnails (core/derivatives.py)
+        for media_table in ('manual_photos', 'security_videos'):
+            for column_name, column_def in (('size', 'INTEGER DEFAULT NULL'), ('mtime', 'REAL DEFAULT NULL'),
+                                            ('derivative_hash', 'TEXT DEFAULT NULL')):
+                try:
+                    await conn.execute(f"ALTER TABLE {media_table} ADD COLUMN {column_name} {column_def}")
+                    logger.info(f"✅ Added {column_name} column to {media_table} table")
+                except Exception as e:
+                    if "duplicate column name" not in str(e).lower():
+                        logger.warning(f"Could not add {column_name} column to {media_table}: {e}")
+        # Source width of a gallery photo, recorded with its derivatives (srcset w descriptors)
+        try:
+            await conn.execute("ALTER TABLE manual_photos ADD COLUMN width INTEGER DEFAULT NULL")
+            logger.info("✅ Added width column to manual_photos table")
+        except Exception as e:
+            if "duplicate column name" not in str(e).lower():
+                logger.warning(f"Could not add width column to manual_photos: {e}")
+        
+        # Hourly summaries of rows removed by the retention engine (core/retention.py)
+        await conn.execute("""CREATE TABLE IF NOT EXISTS hourly_rollups (
+            table_name TEXT NOT NULL,
+            hour TEXT NOT NULL,
+            dim1 TEXT NOT NULL DEFAULT '',
+            dim2 TEXT NOT NULL DEFAULT '',
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (table_name, hour, dim1, dim2)
+        ) WITHOUT ROWID""")
+        logger.info("✅ Hourly rollups table created/verified")
+        
+        # Probed video properties, valid while (inode, mtime_ns, size) match the file (core/media_catalog.py)
+        await conn.execute("""CREATE TABLE IF NOT EXISTS video_metadata (
+            filename TEXT PRIMARY KEY,
+            inode INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            fps REAL,
+            frame_count INTEGER,
+            duration REAL
+        ) WITHOUT ROWID""")
+        logger.info("✅ Video metadata table created/verified")
+        
+        # Rate limiter state shared across workers/restarts when RATE_LIMIT_PERSIST=true (core/rate_limiter.py)
+        await conn.execute("""CREATE TABLE IF NOT EXISTS rate_limit_windows (
+            policy TEXT NOT NULL,
+            key TEXT NOT NULL,
+            window INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (policy, key, window)
+        ) WITHOUT ROWID""")
+        await conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_windows_updated ON rate_limit_windows(policy, updated_at)')
+        await conn.execute("""CREATE TABLE IF NOT EXISTS rate_limit_blocks (
+            policy TEXT NOT NULL,
+            key TEXT NOT NULL,
+            blocked_until REAL NOT NULL,
+            PRIMARY KEY (policy, key)
+        ) WITHOUT ROWID""")
+        logger.info("✅ Rate limit tables created/verified")
+        
         # Create user_settings table with migration
         await migrate_user_settings_table()
         logger.info("✅ User settings table created/verified with migration")
@@ -691,6 +759,12 @@ async def init_db():
         await migrate_logs_table()
         logger.info("✅ Logs table migration completed")
         
+        # Full-text search index over logs and security events
+        await init_log_search(conn)
+        
+        # Materialized dashboard counters
+        await init_stat_counters(conn)
+        
         # Insert default admin user if not exists
         try:
             admin_exists = await conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', (ADMIN_USERNAME,))
@@ -723,6 +797,13 @@ async def init_db():
         await conn.execute('CREATE INDEX IF NOT EXISTS idx_password_recovery_token ON password_recovery(token)')
         await conn.execute('CREATE INDEX IF NOT EXISTS idx_password_recovery_expires_at ON password_recovery(expires_at)')
         await conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_logs_ip_endpoint ON rate_limit_logs(ip_address, endpoint)')
+        # Media catalog: keyset pagination on (mtime, id) and lookups by filename
+        for media_table in ('manual_photos', 'security_videos'):
+            await conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{media_table}_mtime_id ON {media_table}(mtime, id)')
+            await conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{media_table}_filename ON {media_table}(filename)')
+        # Timestamp indexes used by retention batches and time-ordered log queries
+        for table in ('logs', 'camera_logs', 'servo_commands', 'action_commands', 'rate_limit_logs', 'security_events'):
+            await conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table}(created_at)')
         logger.info("✅ Database indexes created successfully")
         
         await conn.commit()
@@ -739,6 +820,198 @@ async def init_db():
         if conn:
             await close_db_connection(conn)
 
+
+# --- Full-text search over logs / camera_logs / security_events (FTS5) ---
+# rowid در جدول FTS به صورت (id << 2) | origin_code ساخته می‌شود تا حذف/به‌روزرسانی
+# از طریق trigger با جستجوی rowid (و نه اسکن کامل) انجام شود.
+LOG_SEARCH_TABLE = "log_search"
+LOG_SEARCH_ORIGINS = {
+    # origin: (code, message, source, level, threat_level, created_at)
+    "logs": (1, "{r}.message", "{r}.source", "{r}.log_type", "{r}.threat_level", "{r}.created_at"),
+    "camera_logs": (2, "{r}.message", "{r}.source", "{r}.log_type", "'low'", "{r}.created_at"),
+    "security_events": (3, "{r}.event_type || ': ' || {r}.description", "'security'", "{r}.event_type",
+                        "{r}.severity", "{r}.created_at"),
+}
+LOG_SEARCH_MAX_LIMIT = int(os.getenv("LOG_SEARCH_MAX_LIMIT", "200"))
+_SNIPPET_OPEN, _SNIPPET_CLOSE = "\x02", "\x03"
+log_search_available = None  # None = not checked yet
+
+
+def _log_search_select(origin: str, ref: str) -> str:
+    """Column list feeding log_search for one source table"""
+    code, *columns = LOG_SEARCH_ORIGINS[origin]
+    values = [f"({ref}.id << 2) | {code}", f"'{origin}'"] + [c.format(r=ref) for c in columns]
+    return ", ".join(values)
+
+
+async def init_log_search(conn):
+    """Create the FTS5 index and its sync triggers; backfill on first creation"""
+    global log_search_available
+    try:
+        cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (LOG_SEARCH_TABLE,))
+        existed = await cursor.fetchone() is not None
+        await conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {LOG_SEARCH_TABLE} USING fts5(
+            message, origin UNINDEXED, source UNINDEXED, level UNINDEXED,
+            threat_level UNINDEXED, created_at UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )""")
+        insert_cols = f"INSERT INTO {LOG_SEARCH_TABLE} (rowid, origin, message, source, level, threat_level, created_at)"
+        for origin, spec in LOG_SEARCH_ORIGINS.items():
+            code = spec[0]
+            await conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{origin}_search_ai AFTER INSERT ON {origin} BEGIN
+                {insert_cols} VALUES ({_log_search_select(origin, 'new')});
+            END""")
+            await conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{origin}_search_ad AFTER DELETE ON {origin} BEGIN
+                DELETE FROM {LOG_SEARCH_TABLE} WHERE rowid = (old.id << 2) | {code};
+            END""")
+            await conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{origin}_search_au AFTER UPDATE ON {origin} BEGIN
+                DELETE FROM {LOG_SEARCH_TABLE} WHERE rowid = (old.id << 2) | {code};
+                {insert_cols} VALUES ({_log_search_select(origin, 'new')});
+            END""")
+            if not existed:
+                await conn.execute(f"{insert_cols} SELECT {_log_search_select(origin, origin)} FROM {origin}")
+        if not existed:
+            logger.info("✅ Log search index created and backfilled")
+        log_search_available = True
+    except Exception as e:
+        # SQLite بدون FTS5 کامپایل شده؛ جستجو غیرفعال می‌شود ولی init_db ادامه می‌دهد
+        log_search_available = False
+        logger.warning(f"⚠️ FTS5 log search unavailable: {e}")
+
+
+# --- Materialized counters (stat_counters) for dashboard totals ---
+# table: (key expression for NEW/OLD row, seed query)
+STAT_COUNTER_SOURCES = {
+    "manual_photos": ("'photos'", "SELECT 'photos', COUNT(*) FROM manual_photos"),
+    "security_videos": ("'videos'", "SELECT 'videos', COUNT(*) FROM security_videos"),
+    "logs": ("'logs.' || COALESCE({r}.log_type, '')",
+             "SELECT 'logs.' || COALESCE(log_type, ''), COUNT(*) FROM logs GROUP BY 1"),
+    "camera_logs": ("'camera_logs.' || COALESCE({r}.log_type, '')",
+                    "SELECT 'camera_logs.' || COALESCE(log_type, ''), COUNT(*) FROM camera_logs GROUP BY 1"),
+    "security_events": ("'security_events.' || COALESCE({r}.severity, 'medium')",
+                        "SELECT 'security_events.' || COALESCE(severity, 'medium'), COUNT(*) FROM security_events GROUP BY 1"),
+}
+_COUNTER_UPSERT = ("INSERT INTO stat_counters (key, value) VALUES ({key}, {delta}) "
+                   "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value")
+
+
+async def init_stat_counters(conn):
+    """Create stat_counters with its insert/delete triggers, seed it once and load the in-memory mirror"""
+    cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'stat_counters'")
+    existed = await cursor.fetchone() is not None
+    await conn.execute("""CREATE TABLE IF NOT EXISTS stat_counters (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID""")
+    for table, (key_expr, _) in STAT_COUNTER_SOURCES.items():
+        # شمارنده در همان تراکنش insert/delete به‌روز می‌شود
+        await conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_counter_ai AFTER INSERT ON {table} BEGIN
+            {_COUNTER_UPSERT.format(key=key_expr.format(r='new'), delta=1)};
+        END""")
+        await conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{table}_counter_ad AFTER DELETE ON {table} BEGIN
+            {_COUNTER_UPSERT.format(key=key_expr.format(r='old'), delta=-1)};
+        END""")
+    if not existed:
+        await rebuild_stat_counters(conn)
+        logger.info("✅ Stat counters table created and seeded")
+    await counters.refresh_counters(conn)
+
+
+async def rebuild_stat_counters(conn):
+    """Recompute every counter from the source tables (seed / repair)"""
+    await conn.execute("DELETE FROM stat_counters")
+    for _, seed_query in STAT_COUNTER_SOURCES.values():
+        await conn.execute(f"INSERT INTO stat_counters (key, value) {seed_query}")
+
+
+async def resync_stat_counters():
+    """Reload the in-memory counter mirror from stat_counters"""
+    conn = await get_db_connection()
+    try:
+        await counters.refresh_counters(conn)
+    finally:
+        await close_db_connection(conn)
+
+
+async def rebuild_log_search_index():
+    """Drop and rebuild the log search index from the source tables"""
+    conn = await get_db_connection()
+    try:
+        await conn.execute(f"DELETE FROM {LOG_SEARCH_TABLE}")
+        insert_cols = f"INSERT INTO {LOG_SEARCH_TABLE} (rowid, origin, message, source, level, threat_level, created_at)"
+        for origin in LOG_SEARCH_ORIGINS:
+            await conn.execute(f"{insert_cols} SELECT {_log_search_select(origin, origin)} FROM {origin}")
+        await conn.execute(f"INSERT INTO {LOG_SEARCH_TABLE} ({LOG_SEARCH_TABLE}) VALUES ('optimize')")
+        await conn.commit()
+        logger.info("✅ Log search index rebuilt")
+    finally:
+        await close_db_connection(conn)
+
+
+def build_fts_query(text: str) -> str:
+    """Turn free user text into a safe FTS5 MATCH expression (quoted terms, optional trailing *)"""
+    terms = []
+    for term in (text or "").split():
+        prefix = term.endswith("*")
+        term = term.rstrip("*").replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def _render_snippet(raw: str) -> str:
+    """HTML-escape a snippet and turn the match markers into <mark> tags"""
+    import html
+    return html.escape(raw or "").replace(_SNIPPET_OPEN, "<mark>").replace(_SNIPPET_CLOSE, "</mark>")
+
+
+async def search_logs(query: str, origin: str = None, source: str = None, level: str = None,
+                      threat_level: str = None, since: str = None, until: str = None,
+                      limit: int = 50, offset: int = 0, order: str = "rank") -> list:
+    """Indexed full-text search across logs, camera_logs and security_events"""
+    match = build_fts_query(query)
+    if not match:
+        return []
+    filters = [f"{LOG_SEARCH_TABLE} MATCH ?"]
+    params = [match]
+    for column, value in (("origin", origin), ("source", source), ("level", level), ("threat_level", threat_level)):
+        if value:
+            filters.append(f"{column} = ?")
+            params.append(value)
+    if since:
+        filters.append("created_at >= ?")
+        params.append(since)
+    if until:
+        filters.append("created_at <= ?")
+        params.append(until)
+    order_by = "created_at DESC" if order == "recent" else "rank"
+    params.extend([max(1, min(int(limit), LOG_SEARCH_MAX_LIMIT)), max(0, int(offset))])
+
+    conn = await get_db_connection()
+    try:
+        cursor = await conn.execute(f"""
+            SELECT rowid, origin, source, level, threat_level, created_at,
+                   snippet({LOG_SEARCH_TABLE}, 0, '{_SNIPPET_OPEN}', '{_SNIPPET_CLOSE}', '…', 16) AS snippet,
+                   bm25({LOG_SEARCH_TABLE}) AS score
+            FROM {LOG_SEARCH_TABLE}
+            WHERE {' AND '.join(filters)}
+            ORDER BY {order_by}
+            LIMIT ? OFFSET ?
+        """, tuple(params))
+        rows = await cursor.fetchall()
+    finally:
+        await close_db_connection(conn)
+    return [{
+        "id": row[0] >> 2,
+        "origin": row[1],
+        "source": row[2],
+        "level": row[3],
+        "threat_level": row[4],
+        "timestamp": row[5],
+        "snippet": _render_snippet(row[6]),
+        "score": round(row[7], 4) if row[7] is not None else None,
+    } for row in rows]
+
 def robust_db_endpoint(func):
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
@@ -928,6 +1201,7 @@ async def insert_log(message: str, log_type: str, source: str = "server", pico_t
              user_id, ip_address, user_agent, session_id, security_event, threat_level),
             init_handler=init_db
         )
+        counters.bump(f"logs.{log_type or ''}")
     except Exception as e:
         logger.error(f"Failed to insert log: {e}")
         # Don't raise exception to avoid breaking the main flow
@@ -996,12 +1270,13 @@ async def store_user_csrf_token(username: str, token: str):
             user_id, 
             f"csrf_session_{username}_{int(datetime.now().timestamp())}", 
             token, 
-            (datetime.now() + timedelta(hours=1)).isoformat(),
+            (datetime.now() + timedelta(seconds=USER_CSRF_TTL)).isoformat(),
             get_jalali_now_str(),
             get_jalali_now_str()
         ))
         await conn.commit()
         await close_db_connection(conn)
+        user_csrf_cache.set(username, token, ttl=USER_CSRF_TTL)
         logger.info(f"CSRF token stored for user {username}")
     except Exception as e:
         logger.error(f"Error storing CSRF token for {username}: {e}")
@@ -1072,7 +1347,10 @@ def require_csrf_token(func):
 
 
 async def get_user_csrf_token(username: str) -> str:
-    """Get CSRF token from database for user with enhanced security"""
+    """Get CSRF token for user, from user_csrf_cache or (on a miss) the database"""
+    cached = user_csrf_cache.get(username)
+    if cached is not None:
+        return cached
     try:
         conn = await get_db_connection()
         cursor = await conn.execute("""
@@ -1089,7 +1367,9 @@ async def get_user_csrf_token(username: str) -> str:
         if result and result[0]:
             token, expiry = result
             # Check if token is expired
-            if expiry and datetime.fromisoformat(expiry) > datetime.now():
+            remaining = (datetime.fromisoformat(expiry) - datetime.now()).total_seconds() if expiry else 0
+            if remaining > 0:
+                user_csrf_cache.set(username, token, ttl=remaining)
                 return token
             else:
                 # Token expired, generate new one
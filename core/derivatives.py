@@ -0,0 +1,355 @@
+import asyncio, functools, hashlib, os, re, time, logging
+import numpy as np
+
+# Import from shared config
+from .config import SECURITY_VIDEOS_DIR, GALLERY_DIR
+from .db import get_db_connection, close_db_connection
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    cv2 = None
+    CV2_AVAILABLE = False
+
+# Setup logger for this module
+logger = logging.getLogger("derivatives")
+
+# Constants
+DERIVATIVES_DIR = os.path.join(SECURITY_VIDEOS_DIR, "derivatives")
+DERIVATIVE_QUEUE_SIZE = int(os.getenv("DERIVATIVE_QUEUE_SIZE", "256"))
+DERIVATIVE_IDLE_SCAN = int(os.getenv("DERIVATIVE_IDLE_SCAN", "300"))  # backfill + orphan sweep when idle this long
+DERIVATIVE_BACKFILL_BATCH = int(os.getenv("DERIVATIVE_BACKFILL_BATCH", "20"))
+POSTER_SIZE = (320, 180)
+SPRITE_TILE_SIZE = (160, 90)
+SPRITE_TILES = int(os.getenv("SPRITE_TILES", "60"))  # evenly spaced thumbnails per video
+SPRITE_COLUMNS = 10
+HASH_CHUNK = 1024 * 1024
+PHOTO_DERIVATIVES_DIR = os.path.join(GALLERY_DIR, "derivatives")
+PHOTO_DERIVATIVE_WIDTHS = tuple(int(w) for w in os.getenv("PHOTO_DERIVATIVE_WIDTHS", "320,640,1280").split(","))
+PHOTO_DERIVATIVE_QUALITY = int(os.getenv("PHOTO_DERIVATIVE_QUALITY", "80"))
+
+# <32 hex content hash>.<kind>
+DERIVATIVE_NAME_RE = re.compile(r"^[0-9a-f]{32}\.(poster\.jpg|sprite\.jpg|vtt)$")
+DERIVATIVE_MEDIA_TYPES = {"poster.jpg": "image/jpeg", "sprite.jpg": "image/jpeg", "vtt": "text/vtt"}
+# <32 hex content hash>.w<width>.<format>
+PHOTO_DERIVATIVE_NAME_RE = re.compile(r"^[0-9a-f]{32}\.w(\d{2,4})\.(jpg|webp)$")
+PHOTO_MEDIA_TYPES = {"jpg": "image/jpeg", "webp": "image/webp"}
+
+_queue = None
+_pending = set()
+_failed = set()  # not retried by the backfill until restart
+derivative_stats = {"processed": 0, "failed": 0, "backfilled": 0, "orphans_removed": 0, "last_duration": 0.0}
+
+
+def derivative_path(content_hash: str, kind: str) -> str:
+    return os.path.join(DERIVATIVES_DIR, f"{content_hash}.{kind}")
+
+
+def derivative_url(content_hash: str, kind: str) -> str:
+    return f"/video_derivatives/{content_hash}.{kind}"
+
+
+def photo_derivative_path(content_hash: str, width: int, fmt: str) -> str:
+    return os.path.join(PHOTO_DERIVATIVES_DIR, f"{content_hash}.w{width}.{fmt}")
+
+
+def photo_srcset_widths(source_width: int) -> list:
+    """(file width, actual width) pairs worth listing: derivatives are never upscaled, so every target at or
+    above the source width holds the same source-sized image and only the first of them is kept"""
+    pairs = []
+    for width in PHOTO_DERIVATIVE_WIDTHS:
+        pairs.append((width, min(width, source_width)))
+        if width >= source_width:
+            break
+    return pairs
+
+
+def photo_derivative_urls(content_hash: str, source_width: int) -> dict:
+    """URLs and srcset strings for the gallery grid; w descriptors are the real widths of the files"""
+    pairs = photo_srcset_widths(source_width)
+    urls = {
+        "thumb_url": f"/gallery_derivatives/{content_hash}.w{pairs[0][0]}.jpg",
+        "srcset": ", ".join(f"/gallery_derivatives/{content_hash}.w{w}.jpg {actual}w" for w, actual in pairs),
+    }
+    if "webp" in _photo_formats():
+        urls["webp_srcset"] = ", ".join(f"/gallery_derivatives/{content_hash}.w{w}.webp {actual}w"
+                                        for w, actual in pairs)
+    return urls
+
+
+def content_hash(filepath: str) -> str:
+    """blake2b-128 of the file contents (names derivatives, so they can be cached forever)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _vtt_timestamp(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def _write_atomic(path: str, writer):
+    tmp_path = f"{path}.tmp"
+    writer(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _write_image(path: str, image, fmt: str = "jpg", params: list = None):
+    def writer(tmp_path):
+        ok, encoded = cv2.imencode(f".{fmt}", image, params or [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if not ok:
+            raise ValueError(f"{fmt} encoding failed")
+        with open(tmp_path, "wb") as f:
+            f.write(encoded.tobytes())
+    _write_atomic(path, writer)
+
+
+def build_video_derivatives(video_path: str) -> str:
+    """Poster, thumbnail sprite sheet and WebVTT track for one video; returns the content hash.
+
+    Blocking (hashing + decoding) - always call through asyncio.to_thread."""
+    if not CV2_AVAILABLE:
+        raise RuntimeError("OpenCV is not available")
+    digest = content_hash(video_path)
+    kinds = ("poster.jpg", "sprite.jpg", "vtt")
+    if all(os.path.exists(derivative_path(digest, kind)) for kind in kinds):
+        return digest
+    os.makedirs(DERIVATIVES_DIR, exist_ok=True)
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise ValueError("Could not open video file")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 1.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration = frame_count / fps if frame_count > 0 else 0.0
+        tiles = max(1, min(SPRITE_TILES, frame_count or 1))
+        step = duration / tiles if duration else 0.0
+
+        thumbs = []
+        poster = None
+        for index in range(tiles):
+            if index:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(index * step * fps))
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if poster is None:
+                poster = cv2.resize(frame, POSTER_SIZE, interpolation=cv2.INTER_AREA)
+            thumbs.append(cv2.resize(frame, SPRITE_TILE_SIZE, interpolation=cv2.INTER_AREA))
+    finally:
+        cap.release()
+    if poster is None:
+        raise ValueError("Could not read video frames")
+
+    tile_w, tile_h = SPRITE_TILE_SIZE
+    columns = min(SPRITE_COLUMNS, len(thumbs))
+    rows = (len(thumbs) + columns - 1) // columns
+    blank = np.zeros_like(thumbs[0])
+    thumbs_grid = thumbs + [blank] * (rows * columns - len(thumbs))
+    sprite = cv2.vconcat([cv2.hconcat(thumbs_grid[r * columns:(r + 1) * columns]) for r in range(rows)])
+
+    sprite_url = derivative_url(digest, "sprite.jpg")
+    cue_length = step if step else 1.0
+    lines = ["WEBVTT", ""]
+    for index in range(len(thumbs)):
+        x, y = (index % columns) * tile_w, (index // columns) * tile_h
+        end = duration if index == len(thumbs) - 1 and duration else (index + 1) * cue_length
+        lines += [f"{_vtt_timestamp(index * cue_length)} --> {_vtt_timestamp(end)}",
+                  f"{sprite_url}#xywh={x},{y},{tile_w},{tile_h}", ""]
+
+    _write_image(derivative_path(digest, "poster.jpg"), poster)
+    _write_image(derivative_path(digest, "sprite.jpg"), sprite)
+
+    def write_vtt(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+    _write_atomic(derivative_path(digest, "vtt"), write_vtt)
+    return digest
+
+
+@functools.lru_cache(maxsize=1)
+def _photo_formats() -> tuple:
+    """JPEG always; WebP when this OpenCV build can encode it"""
+    try:
+        return ("jpg", "webp") if cv2.haveImageWriter(".webp") else ("jpg",)
+    except Exception:
+        return ("jpg",)
+
+
+def build_photo_derivatives(photo_path: str) -> tuple:
+    """Fixed-width JPEG (and WebP) copies of a gallery photo; returns (content hash, source width).
+
+    Never upscales: the first width at or above the original is re-encoded at the original size, wider
+    targets are skipped (photo_srcset_widths never lists them)."""
+    if not CV2_AVAILABLE:
+        raise RuntimeError("OpenCV is not available")
+    with open(photo_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode photo")
+    height, width = image.shape[:2]
+    formats = _photo_formats()
+    target_widths = [target for target, _ in photo_srcset_widths(width)]
+    if all(os.path.exists(photo_derivative_path(digest, target, fmt)) for target in target_widths for fmt in formats):
+        return digest, width
+    os.makedirs(PHOTO_DERIVATIVES_DIR, exist_ok=True)
+    for target_width in target_widths:
+        if target_width < width:
+            resized = cv2.resize(image, (target_width, max(1, round(height * target_width / width))),
+                                 interpolation=cv2.INTER_AREA)
+        else:
+            resized = image
+        for fmt in formats:
+            params = [cv2.IMWRITE_WEBP_QUALITY, PHOTO_DERIVATIVE_QUALITY] if fmt == "webp" \
+                else [cv2.IMWRITE_JPEG_QUALITY, PHOTO_DERIVATIVE_QUALITY, cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+            _write_image(photo_derivative_path(digest, target_width, fmt), resized, fmt, params)
+    return digest, width
+
+
+def _enqueue(kind: str, filename: str) -> bool:
+    """Queue a job unless it is already queued or failed before (failures are not retried until restart)"""
+    job = (kind, filename)
+    if _queue is None or job in _pending or job in _failed:
+        return False
+    try:
+        _queue.put_nowait(job)
+    except asyncio.QueueFull:
+        # the idle backfill will pick it up later
+        logger.debug(f"Derivative queue full, deferring {kind} {filename}")
+        return False
+    _pending.add(job)
+    return True
+
+
+def enqueue_video(filename: str) -> bool:
+    """Schedule derivative generation for a finalized video (no-op if already queued or failed before)"""
+    return _enqueue("video", filename)
+
+
+def enqueue_photo(filename: str) -> bool:
+    """Schedule resized widths for a gallery photo (no-op if already queued or failed before)"""
+    return _enqueue("photo", filename)
+
+
+async def get_video_derivative_hash(filename: str):
+    conn = await get_db_connection()
+    try:
+        cursor = await conn.execute("SELECT derivative_hash FROM security_videos WHERE filename = ? LIMIT 1", (filename,))
+        row = await cursor.fetchone()
+    finally:
+        await close_db_connection(conn)
+    return row[0] if row else None
+
+
+# kind -> (catalog table, source directory, derivative directory, builder)
+DERIVATIVE_JOBS = {
+    "video": ("security_videos", SECURITY_VIDEOS_DIR, DERIVATIVES_DIR, build_video_derivatives),
+    "photo": ("manual_photos", GALLERY_DIR, PHOTO_DERIVATIVES_DIR, build_photo_derivatives),
+}
+
+# rows to (re)build; photos built before the source width was recorded are redone once
+_MISSING_DERIVATIVES = {"video": "derivative_hash IS NULL", "photo": "(derivative_hash IS NULL OR width IS NULL)"}
+
+
+async def process_job(kind: str, filename: str):
+    table, source_dir, _, builder = DERIVATIVE_JOBS[kind]
+    started = time.time()
+    source_path = os.path.join(source_dir, filename)
+    if not os.path.exists(source_path):
+        return
+    try:
+        result = await asyncio.to_thread(builder, source_path)
+    except Exception as e:
+        derivative_stats["failed"] += 1
+        _failed.add((kind, filename))
+        logger.warning(f"⚠️ Derivatives failed for {filename}: {e}")
+        return
+    conn = await get_db_connection()
+    try:
+        if kind == "photo":
+            # the srcset needs the source width (narrow originals are not upscaled)
+            digest, width = result
+            await conn.execute("UPDATE manual_photos SET derivative_hash = ?, width = ? WHERE filename = ?",
+                               (digest, width, filename))
+        else:
+            await conn.execute(f"UPDATE {table} SET derivative_hash = ? WHERE filename = ?", (result, filename))
+        await conn.commit()
+    finally:
+        await close_db_connection(conn)
+    derivative_stats["processed"] += 1
+    derivative_stats["last_duration"] = round(time.time() - started, 3)
+    logger.info(f"✅ Derivatives ready for {filename} ({derivative_stats['last_duration']}s)")
+
+
+def _sweep_dir(folder: str, referenced: set) -> int:
+    removed = 0
+    if not os.path.isdir(folder):
+        return removed
+    cutoff = time.time() - DERIVATIVE_IDLE_SCAN
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.split(".", 1)[0] in referenced:
+                continue
+            try:
+                # files younger than one scan may belong to a job that has not been recorded yet
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
+
+
+async def _backfill_and_sweep():
+    """Queue media that never got derivatives and delete derivative files nothing references"""
+    for kind, (table, _, derivative_dir, _) in DERIVATIVE_JOBS.items():
+        conn = await get_db_connection()
+        try:
+            cursor = await conn.execute(
+                f"SELECT filename FROM {table} WHERE {_MISSING_DERIVATIVES[kind]} ORDER BY mtime DESC LIMIT ?",
+                (DERIVATIVE_BACKFILL_BATCH + len(_failed),)
+            )
+            missing = [row[0] for row in await cursor.fetchall()]
+            cursor = await conn.execute(f"SELECT DISTINCT derivative_hash FROM {table} WHERE derivative_hash IS NOT NULL")
+            referenced = {row[0] for row in await cursor.fetchall()}
+        finally:
+            await close_db_connection(conn)
+
+        for filename in missing:
+            if _enqueue(kind, filename):
+                derivative_stats["backfilled"] += 1
+        derivative_stats["orphans_removed"] += await asyncio.to_thread(_sweep_dir, derivative_dir, referenced)
+
+
+async def derivative_worker():
+    """Single background consumer: one job at a time so decoding never competes with live streaming"""
+    global _queue
+    _queue = asyncio.Queue(maxsize=DERIVATIVE_QUEUE_SIZE)
+    try:
+        await _backfill_and_sweep()
+    except Exception as e:
+        logger.error(f"Derivative backfill error: {e}")
+    while True:
+        try:
+            try:
+                job = await asyncio.wait_for(_queue.get(), timeout=DERIVATIVE_IDLE_SCAN)
+            except asyncio.TimeoutError:
+                await _backfill_and_sweep()
+                continue
+            try:
+                await process_job(*job)
+            finally:
+                _pending.discard(job)
+                _queue.task_done()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Derivative worker error: {e}")
+            await asyncio.sleep(1)
@@ -39,6 +39,10 @@ from .client import authenticate_websocket
 from .db import robust_db_endpoint, insert_action_command, execute_db_insert, insert_log
 from .client import create_security_video_async, send_to_web_clients
 from .sanitize_validate import validate_image_format
+from . import counters, json_codec
+from .media_catalog import file_stat
+from .derivatives import enqueue_photo
+from .upload_inspection import inspect_upload, UPLOAD_INSPECTION_ENFORCE
 
 # Global function reference for pico communication (will be set by main server)
 send_to_pico_client = None
@@ -235,7 +239,7 @@ async def esp32cam_websocket_endpoint(websocket: WebSocket):
 
     # Send connection success message
     try:
-        await websocket.send_text(json.dumps({"type": "connection_ack", "status": "success", "message": "ESP32CAM connected successfully"}))
+        await websocket.send_text(json_codec.dumps({"type": "connection_ack", "status": "success", "message": "ESP32CAM connected successfully"}))
     except Exception as e:
         logger.warning(f"[WebSocket] Could not send connection success message: {e}")
     
@@ -254,7 +258,7 @@ async def esp32cam_websocket_endpoint(websocket: WebSocket):
                         
                         # پردازش پیام‌های متنی
                         try:
-                            json_message = json.loads(data)
+                            json_message = json_codec.loads(data)
                             if json_message.get("type") == "photo_sent":
                                 logger.info(f"[WebSocket] Manual photo received from ESP32CAM: {json_message.get('size', 0)} bytes")
                                 # ذخیره عکس در گالری
@@ -371,7 +375,7 @@ async def esp32cam_websocket_endpoint(websocket: WebSocket):
             except asyncio.TimeoutError:
                 logger.debug(f"[WebSocket] ESP32CAM timeout, sending ping")
                 try:
-                    await websocket.send_text(json.dumps({"type": "ping"}))
+                    await websocket.send_text(json_codec.dumps({"type": "ping"}))
                 except Exception as e:
                     if "1000" not in str(e) and "disconnect" not in str(e).lower():
                         logger.warning(f"[WebSocket] ESP32CAM ping failed: {e}")
@@ -432,6 +436,7 @@ async def save_manual_photo_binary(frame_data):
         
         # ذخیره در دیتابیس
         await insert_photo_to_db(filename, filepath, 80, False, 50)
+        enqueue_photo(filename)
         await insert_log(f"Manual photo saved from ESP32CAM: {filename}", "photo")
         
         # ارسال به فرانت‌اند
@@ -501,7 +506,7 @@ async def send_to_esp32cam_client(message):
             client = getattr(system_state, 'esp32cam_client', None)
             if client:
                 try:
-                    await client.send_text(json.dumps(message))
+                    await client.send_text(json_codec.dumps(message))
                     # به‌روزرسانی وضعیت دستگاه
                     system_state.device_status["esp32cam"]["last_seen"] = datetime.now()
                     logger.debug(f"Message sent to ESP32CAM: {message}")
@@ -535,10 +540,12 @@ async def send_to_esp32cam_client(message):
 # --- Common photo insertion function ---
 async def insert_photo_to_db(filename: str, filepath: str, quality: int = 80, flash_used: bool = False, intensity: int = 50):
     """Common function to insert photo into database"""
+    size, mtime = await asyncio.to_thread(file_stat, filepath)
     await execute_db_insert(
-        "INSERT INTO manual_photos (filename, filepath, quality, flash_used, flash_intensity, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (filename, filepath, quality, flash_used, intensity, get_jalali_now_str())
+        "INSERT INTO manual_photos (filename, filepath, quality, flash_used, flash_intensity, created_at, size, mtime) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (filename, filepath, quality, flash_used, intensity, get_jalali_now_str(), size, mtime)
     )
+    counters.bump("photos")
 
 
 
@@ -622,6 +629,13 @@ async def upload_photo(request: Request, user=Depends(get_current_user)):
         raise HTTPException(status_code=400, detail="Photo size exceeds limit")
     if not validate_image_format(photo_bytes):
         raise HTTPException(status_code=400, detail="Invalid photo format")
+    # Steganography / embedded content checks run in the inspection worker within a time budget. Ordinary
+    # camera JPEGs trip the LSB heuristic, so the check only runs when its verdict can reject the upload
+    if UPLOAD_INSPECTION_ENFORCE:
+        verdict = await inspect_upload(photo_bytes)
+        if verdict["suspicious"]:
+            logger.warning(f"⚠️ Upload inspection rejected photo from {request.client.host}: {', '.join(verdict['findings'])}")
+            raise HTTPException(status_code=400, detail="Photo rejected by content inspection")
     processed_photo = await preprocess_frame(photo_bytes)
     final_photo = await add_persian_text_overlay(processed_photo)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -630,6 +644,7 @@ async def upload_photo(request: Request, user=Depends(get_current_user)):
     await asyncio.to_thread(os.makedirs, GALLERY_DIR, exist_ok=True)
     await asyncio.to_thread(lambda: open(filepath, 'wb').write(final_photo))
     await insert_photo_to_db(filename, filepath, quality, flash_used, intensity)
+    enqueue_photo(filename)
     try:
         await insert_log(f"Photo uploaded: {filename}, Intensity: {intensity}%", "photo")
     except Exception as e:
@@ -880,7 +895,7 @@ async def send_frame_to_clients(frame_data: bytes):
     try:
         # بررسی اندازه فریم قبل از ارسال
         frame_to_send = base64.b64encode(frame_data).decode('utf-8')
-        frame_message = json.dumps({"type": "frame", "data": frame_to_send, "resolution": system_state.resolution})
+        frame_message = json_codec.dumps({"type": "frame", "data": frame_to_send, "resolution": system_state.resolution})
         
         # بررسی اندازه پیام و فشرده‌سازی هوشمند
         if len(frame_message) > MAX_WEBSOCKET_MESSAGE_SIZE:
@@ -888,7 +903,7 @@ async def send_frame_to_clients(frame_data: bytes):
             # فشرده‌سازی هوشمند
             compressed_frame = await compress_frame_intelligently(frame_data)
             compressed_data = base64.b64encode(compressed_frame).decode('utf-8')
-            frame_message = json.dumps({"type": "frame", "data": compressed_data, "resolution": system_state.resolution})
+            frame_message = json_codec.dumps({"type": "frame", "data": compressed_data, "resolution": system_state.resolution})
         
         # ارسال به فرانت‌اند
         await send_to_web_clients(frame_message)
@@ -0,0 +1,285 @@
+import asyncio, hashlib, json, os, struct, time, zlib, logging
+from datetime import datetime
+
+# Import from shared config
+from .config import GALLERY_DIR, SECURITY_VIDEOS_DIR
+from .db import get_db_connection, close_db_connection
+from .cache import TTLCache
+
+# Setup logger for this module
+logger = logging.getLogger("export")
+
+# Constants
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(1024 * 1024)))  # per read; bounds memory per export
+EXPORT_MAX_FILES = int(os.getenv("EXPORT_MAX_FILES", "5000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+EXPORT_CAMERAS = ("esp32cam",)  # the only capture source feeding manual_photos/security_videos
+
+# table -> (folder inside the archive, directory on disk)
+EXPORT_SOURCES = {
+    "security_videos": ("videos", SECURITY_VIDEOS_DIR),
+    "manual_photos": ("photos", GALLERY_DIR),
+}
+
+_ZIP64_LIMIT = 0xFFFFFFFF
+_FLAGS = 0x0808  # bit 3: sizes/CRC in data descriptor, bit 11: UTF-8 names
+_EXTERNAL_ATTR = 0o100644 << 16
+
+# CRC32 per (path, inode, mtime_ns, size): a resumed export does not have to re-read what it already sent
+export_crc_cache = TTLCache("export_crc", maxsize=int(os.getenv("EXPORT_CRC_CACHE_SIZE", "4096")), ttl=86400)
+export_semaphore = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+
+def _dos_datetime(mtime: float) -> tuple:
+    t = time.localtime(max(mtime, 315532800))  # ZIP cannot express dates before 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class ZipEntry:
+    """One stored (uncompressed) member; sizes are known up front so the whole layout is deterministic"""
+
+    def __init__(self, name: str, size: int, mtime: float, path: str = None, data: bytes = None, stat_key: tuple = None):
+        self.name = name.encode("utf-8")
+        self.size = size
+        self.mtime = mtime
+        self.path = path
+        self.data = data
+        self.stat_key = stat_key
+        self.crc = zlib.crc32(data) if data is not None else None
+        self.offset = 0
+        self.zip64 = size >= _ZIP64_LIMIT
+
+    def local_header(self) -> bytes:
+        dos_time, dos_date = _dos_datetime(self.mtime)
+        if self.zip64:
+            extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+            sizes = (_ZIP64_LIMIT, _ZIP64_LIMIT)
+        else:
+            extra = b""
+            sizes = (0, 0)
+        return struct.pack("<IHHHHHIIIHH", 0x04034b50, 45 if self.zip64 else 20, _FLAGS, 0, dos_time, dos_date,
+                           0, *sizes, len(self.name), len(extra)) + self.name + extra
+
+    def descriptor_size(self) -> int:
+        return 24 if self.zip64 else 16
+
+    def descriptor(self) -> bytes:
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074b50, self.crc, self.size, self.size)
+        return struct.pack("<IIII", 0x08074b50, self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        dos_time, dos_date = _dos_datetime(self.mtime)
+        extra_fields = []
+        size_field = self.size
+        offset_field = self.offset
+        if self.zip64:
+            extra_fields += [self.size, self.size]
+            size_field = _ZIP64_LIMIT
+        if self.offset >= _ZIP64_LIMIT:
+            extra_fields.append(self.offset)
+            offset_field = _ZIP64_LIMIT
+        extra = struct.pack(f"<HH{len(extra_fields)}Q", 1, 8 * len(extra_fields), *extra_fields) if extra_fields else b""
+        version = 45 if extra_fields else 20
+        return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | version, version, _FLAGS, 0, dos_time,
+                           dos_date, self.crc or 0, size_field, size_field, len(self.name), len(extra), 0, 0, 0,
+                           _EXTERNAL_ATTR, offset_field) + self.name + extra
+
+
+class ZipStreamPlan:
+    """Byte layout of a store-mode ZIP built from known sizes: total length and per-member offsets"""
+
+    def __init__(self, entries: list):
+        self.entries = entries
+        offset = 0
+        for entry in entries:
+            entry.offset = offset
+            offset += len(entry.local_header()) + entry.size + entry.descriptor_size()
+        self.central_offset = offset
+        # central directory size depends only on names/offsets, so it can be measured before the CRCs are known
+        self.central_size = sum(len(entry.central_header()) for entry in entries)
+        self.total_size = self.central_offset + self.central_size + len(self._end_records())
+
+    def _needs_zip64_end(self) -> bool:
+        return (len(self.entries) >= 0xFFFF or self.central_offset >= _ZIP64_LIMIT
+                or self.central_size >= _ZIP64_LIMIT)
+
+    def _end_records(self) -> bytes:
+        count = len(self.entries)
+        records = b""
+        if self._needs_zip64_end():
+            zip64_end_offset = self.central_offset + self.central_size
+            records += struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                                   self.central_size, self.central_offset)
+            records += struct.pack("<IIQI", 0x07064b50, 0, zip64_end_offset, 1)
+        records += struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                               min(self.central_size, _ZIP64_LIMIT), min(self.central_offset, _ZIP64_LIMIT), 0)
+        return records
+
+    def trailer(self) -> bytes:
+        return b"".join(entry.central_header() for entry in self.entries) + self._end_records()
+
+
+def _check_stat(entry: ZipEntry, fd: int):
+    st = os.fstat(fd)
+    if (st.st_ino, st.st_mtime_ns, st.st_size) != entry.stat_key:
+        raise RuntimeError(f"{entry.path} changed during export")
+
+
+def _file_crc(entry: ZipEntry) -> int:
+    cache_key = (entry.path, *entry.stat_key)
+    crc = export_crc_cache.get(cache_key)
+    if crc is not None:
+        return crc
+    crc = 0
+    fd = os.open(entry.path, os.O_RDONLY)
+    try:
+        _check_stat(entry, fd)
+        offset = 0
+        while offset < entry.size:
+            block = os.pread(fd, min(EXPORT_CHUNK_SIZE, entry.size - offset), offset)
+            if not block:
+                raise RuntimeError(f"{entry.path} is shorter than expected")
+            crc = zlib.crc32(block, crc)
+            offset += len(block)
+    finally:
+        os.close(fd)
+    export_crc_cache.set(cache_key, crc)
+    return crc
+
+
+def _open_checked(entry: ZipEntry) -> int:
+    fd = os.open(entry.path, os.O_RDONLY)
+    try:
+        _check_stat(entry, fd)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _slice(data: bytes, segment_start: int, start: int, end: int) -> bytes:
+    """Part of a segment that falls inside [start, end] (absolute, inclusive)"""
+    lo = max(start - segment_start, 0)
+    hi = min(end - segment_start + 1, len(data))
+    return data[lo:hi] if lo < hi else b""
+
+
+async def _copy_range(entry: ZipEntry, lo: int, hi: int, data_start: int):
+    """Yield member bytes [lo, hi) (archive offsets); computes the CRC when the whole member is read"""
+    fd = await asyncio.to_thread(_open_checked, entry)
+    try:
+        whole = lo == data_start and hi == data_start + entry.size and entry.crc is None
+        crc = 0
+        position = lo
+        while position < hi:
+            block = await asyncio.to_thread(os.pread, fd, min(EXPORT_CHUNK_SIZE, hi - position), position - data_start)
+            if not block:
+                raise RuntimeError(f"{entry.path} is shorter than expected")
+            if whole:
+                crc = zlib.crc32(block, crc)
+            yield block
+            position += len(block)
+    finally:
+        os.close(fd)
+    if whole:
+        entry.crc = crc
+        export_crc_cache.set((entry.path, *entry.stat_key), crc)
+
+
+async def stream_zip(plan: ZipStreamPlan, start: int = 0, end: int = None):
+    """Yield archive bytes [start, end] (inclusive); members before `start` are skipped, their CRCs come
+    from the cache or a read-only pass, so an interrupted download can resume with a Range request"""
+    end = plan.total_size - 1 if end is None else end
+    needs_trailer = end >= plan.central_offset
+    for entry in plan.entries:
+        header = entry.local_header()
+        data_start = entry.offset + len(header)
+        data_end = data_start + entry.size
+        entry_end = data_end + entry.descriptor_size()
+        if entry.offset > end:
+            break
+        if entry_end <= start:
+            if needs_trailer and entry.crc is None:
+                entry.crc = await asyncio.to_thread(_file_crc, entry)
+            continue
+
+        chunk = _slice(header, entry.offset, start, end)
+        if chunk:
+            yield chunk
+
+        lo, hi = max(start, data_start), min(end + 1, data_end)
+        if entry.data is not None:
+            chunk = _slice(entry.data, data_start, start, end)
+            if chunk:
+                yield chunk
+        else:
+            if end >= data_end and entry.crc is None and lo > data_start:
+                # resuming inside this member: its CRC covers bytes the client already has
+                entry.crc = await asyncio.to_thread(_file_crc, entry)
+            if lo < hi:
+                async for block in _copy_range(entry, lo, hi, data_start):
+                    yield block
+            if end >= data_end and entry.crc is None:
+                entry.crc = await asyncio.to_thread(_file_crc, entry)
+
+        chunk = _slice(entry.descriptor(), data_end, start, end) if end >= data_end else b""
+        if chunk:
+            yield chunk
+
+    if needs_trailer:
+        chunk = _slice(plan.trailer(), plan.central_offset, start, end)
+        if chunk:
+            yield chunk
+
+
+def _stat_files(rows: list) -> list:
+    """(table, filename, path, stat) for catalog rows whose files still exist"""
+    found = []
+    for table, filename in rows:
+        path = os.path.join(EXPORT_SOURCES[table][1], filename)
+        try:
+            found.append((table, filename, path, os.stat(path)))
+        except OSError:
+            continue
+    return found
+
+
+async def build_export_plan(start_ts: float, end_ts: float, camera: str, include: tuple) -> tuple:
+    """Select media in [start_ts, end_ts) from the catalog and lay out the archive; returns (plan, etag)"""
+    rows = []
+    conn = await get_db_connection()
+    try:
+        for table in include:
+            cursor = await conn.execute(
+                f"SELECT filename FROM {table} WHERE mtime >= ? AND mtime < ? ORDER BY mtime, id LIMIT ?",
+                (start_ts, end_ts, EXPORT_MAX_FILES + 1)
+            )
+            rows += [(table, row[0]) for row in await cursor.fetchall()]
+    finally:
+        await close_db_connection(conn)
+    if len(rows) > EXPORT_MAX_FILES:
+        raise ValueError(f"Export would contain more than {EXPORT_MAX_FILES} files; narrow the time range")
+
+    files = await asyncio.to_thread(_stat_files, rows)
+    manifest = {
+        "camera": camera,
+        "range": {"start": datetime.fromtimestamp(start_ts).isoformat(), "end": datetime.fromtimestamp(end_ts).isoformat()},
+        "files": [{
+            "name": f"{EXPORT_SOURCES[table][0]}/{filename}",
+            "type": "video" if table == "security_videos" else "photo",
+            "size": st.st_size,
+            "modified": datetime.fromtimestamp(st.st_mtime).isoformat(),
+        } for table, filename, _, st in files],
+    }
+    # Everything in the archive derives from the selection, so a resumed download gets identical bytes
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8")
+    etag = '"' + hashlib.blake2b(manifest_bytes, digest_size=16).hexdigest() + '"'
+    newest = max([st.st_mtime for *_, st in files], default=end_ts)
+
+    entries = [ZipEntry("manifest.json", len(manifest_bytes), newest, data=manifest_bytes)]
+    entries += [ZipEntry(f"{EXPORT_SOURCES[table][0]}/{filename}", st.st_size, st.st_mtime, path=path,
+                         stat_key=(st.st_ino, st.st_mtime_ns, st.st_size))
+                for table, filename, path, st in files]
+    return ZipStreamPlan(entries), etag
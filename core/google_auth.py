@@ -13,10 +13,12 @@ from .config import SystemState
 
 # Import required functions from other modules
 from .db import init_db, get_db_connection, close_db_connection, insert_log as db_insert_log
-from .Security import hash_password, check_rate_limit
+from .Security import check_rate_limit
+from .password_hashing import hash_password_async
 from .config import get_jalali_now_str
 from .sanitize_validate import sanitize_input
 from .token import create_access_token
+from .google_oidc import get_http_client, endpoint, verify_id_token, IdTokenError
 
 
 
@@ -121,7 +123,8 @@ async def get_google_auth_url(state: str = None) -> str:
     }
     
     query_string = '&'.join([f"{k}={v}" for k, v in params.items()])
-    return f"{GOOGLE_AUTH_URL}?{query_string}"
+    auth_url = await endpoint('authorization_endpoint', GOOGLE_AUTH_URL)
+    return f"{auth_url}?{query_string}"
 
 
 async def exchange_google_code_for_token(code: str) -> dict:
@@ -129,40 +132,63 @@ async def exchange_google_code_for_token(code: str) -> dict:
     if not GOOGLE_OAUTH_ENABLED:
         raise HTTPException(status_code=500, detail="Google OAuth not configured - please set GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET environment variables")
     
-    async with httpx.AsyncClient() as client:
-        data = {
-            'client_id': GOOGLE_CLIENT_ID,
-            'client_secret': GOOGLE_CLIENT_SECRET,
-            'code': code,
-            'grant_type': 'authorization_code',
-            'redirect_uri': GOOGLE_REDIRECT_URI
-        }
-        
-        response = await client.post(GOOGLE_TOKEN_URL, data=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            logger.error(f"Google OAuth token exchange failed: {response.status_code} - {response.text}")
-            raise HTTPException(status_code=400, detail="Failed to exchange code for token")
+    data = {
+        'client_id': GOOGLE_CLIENT_ID,
+        'client_secret': GOOGLE_CLIENT_SECRET,
+        'code': code,
+        'grant_type': 'authorization_code',
+        'redirect_uri': GOOGLE_REDIRECT_URI
+    }
+    
+    token_url = await endpoint('token_endpoint', GOOGLE_TOKEN_URL)
+    response = await get_http_client().post(token_url, data=data)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        logger.error(f"Google OAuth token exchange failed: {response.status_code} - {response.text}")
+        raise HTTPException(status_code=400, detail="Failed to exchange code for token")
 
 
 async def get_google_user_info(access_token: str) -> GoogleUserInfo:
     """Get user information from Google"""
-    async with httpx.AsyncClient() as client:
-        headers = {'Authorization': f'Bearer {access_token}'}
-        response = await client.get(GOOGLE_USERINFO_URL, headers=headers)
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            return GoogleUserInfo(
-                id=user_data['id'],
-                email=user_data['email'],
-                name=user_data.get('name', ''),
-                picture=user_data.get('picture'),
-                verified_email=user_data.get('verified_email', False)
-            )
-        else:
-            raise HTTPException(status_code=400, detail="Failed to get user info")
+    headers = {'Authorization': f'Bearer {access_token}'}
+    userinfo_url = await endpoint('userinfo_endpoint', GOOGLE_USERINFO_URL)
+    response = await get_http_client().get(userinfo_url, headers=headers)
+    
+    if response.status_code == 200:
+        user_data = response.json()
+        return GoogleUserInfo(
+            # v2 userinfo returns 'id', the OpenID userinfo endpoint 'sub'
+            id=user_data.get('id') or user_data['sub'],
+            email=user_data['email'],
+            name=user_data.get('name', ''),
+            picture=user_data.get('picture'),
+            verified_email=user_data.get('verified_email', user_data.get('email_verified', False))
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Failed to get user info")
+
+
+async def get_google_user_from_tokens(token_data: dict) -> GoogleUserInfo:
+    """User from the id_token of the token response, verified locally against Google's cached signing keys;
+    falls back to the userinfo endpoint when there is no usable id_token"""
+    id_token = token_data.get("id_token")
+    if id_token:
+        try:
+            claims = await verify_id_token(id_token, GOOGLE_CLIENT_ID)
+            if claims.get('email'):
+                return GoogleUserInfo(
+                    id=claims['sub'],
+                    email=claims['email'],
+                    name=claims.get('name', ''),
+                    picture=claims.get('picture'),
+                    verified_email=bool(claims.get('email_verified', False))
+                )
+        except IdTokenError as e:
+            logger.warning(f"Google id_token rejected, falling back to userinfo: {e}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Google signing keys unavailable, falling back to userinfo: {e}")
+    return await get_google_user_info(token_data["access_token"])
 
 
 async def create_or_get_google_user(google_user: GoogleUserInfo, client_ip: Optional[str] = None, user_agent: Optional[str] = None) -> dict:
@@ -295,7 +321,7 @@ async def create_or_get_google_user(google_user: GoogleUserInfo, client_ip: Opti
 
             # Create new user
             username = f"google_{google_user.id}"
-            password_hash = hash_password(secrets.token_urlsafe(32))  # Random password
+            password_hash = await hash_password_async(secrets.token_urlsafe(32))  # Random password
             
             await conn.execute(
                 'INSERT INTO users (username, email, google_id, password_hash, role, is_active, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
@@ -311,6 +337,8 @@ async def create_or_get_google_user(google_user: GoogleUserInfo, client_ip: Opti
                 "role": "user",
                 "is_new_user": True
             }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in create_or_get_google_user: {e}")
         raise HTTPException(status_code=500, detail="Database error during Google OAuth")
@@ -479,8 +507,8 @@ async def google_auth_callback(req: Request):
             await insert_log(f"Google OAuth no access token from {client_ip}", "auth")
             return RedirectResponse(url="/login?error=google_auth_failed")
         
-        # Get user info from Google
-        google_user = await get_google_user_info(access_token)
+        # Get user info from the verified id_token (userinfo request only as a fallback)
+        google_user = await get_google_user_from_tokens(token_data)
         
         # Create or get user from database (pass IP/UA to help link when email missing)
         user_agent = req.headers.get('user-agent')
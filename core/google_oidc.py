@@ -0,0 +1,152 @@
+import asyncio, os, re, time, logging, jwt
+import httpx
+
+from .cache import TTLCache
+
+# Setup logger for this module
+logger = logging.getLogger("google_oidc")
+
+# Optional: HTTP/2 to Google's endpoints (pip install h2), HTTP/1.1 keep-alive without it
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Constants
+GOOGLE_DISCOVERY_URL = os.getenv("GOOGLE_DISCOVERY_URL", "https://accounts.google.com/.well-known/openid-configuration")
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "10"))
+GOOGLE_METADATA_TTL = float(os.getenv("GOOGLE_METADATA_TTL", "3600"))  # when the response has no max-age
+GOOGLE_ISSUERS = ("https://accounts.google.com", "accounts.google.com")
+JWKS_MIN_REFRESH_INTERVAL = 60.0  # an unknown kid refetches the JWKS at most this often
+ID_TOKEN_LEEWAY = 60  # seconds of clock skew tolerated on exp/iat
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+# discovery document and JWKS, keyed by URL, kept for the max-age Google sends
+oidc_metadata_cache = TTLCache("google_oidc_metadata", maxsize=8, ttl=GOOGLE_METADATA_TTL)
+
+_client = None
+_fetch_locks = {}  # url -> asyncio.Lock, one fetch per URL at a time
+_fetched_at = {}  # url -> monotonic time of the last fetch
+_stats = {"fetches": 0, "verified": 0, "rejected": 0}
+
+
+class IdTokenError(Exception):
+    """id_token failed signature, audience, issuer or expiry checks"""
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Application-wide client for Google's OAuth endpoints: pooled keep-alive (HTTP/2 when available)"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=httpx.Timeout(GOOGLE_HTTP_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=120),
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _fetch_locks.clear()
+
+
+def _max_age(response: httpx.Response) -> float:
+    match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+    return float(match.group(1)) if match else GOOGLE_METADATA_TTL
+
+
+async def _cached_json(url: str, parse=None, refresh: bool = False):
+    """GET url through the metadata cache; concurrent misses share one request"""
+    if not refresh:
+        value = oidc_metadata_cache.get(url)
+        if value is not None:
+            return value
+    lock = _fetch_locks.setdefault(url, asyncio.Lock())
+    async with lock:
+        if not refresh:
+            value = oidc_metadata_cache.get(url)
+            if value is not None:
+                return value
+        response = await get_http_client().get(url)
+        response.raise_for_status()
+        _stats["fetches"] += 1
+        _fetched_at[url] = time.monotonic()
+        value = response.json()
+        if parse:
+            value = parse(value)
+        oidc_metadata_cache.set(url, value, ttl=_max_age(response))
+        return value
+
+
+async def discovery(discovery_url: str = GOOGLE_DISCOVERY_URL) -> dict:
+    """Google's OpenID configuration (authorization/token/userinfo endpoints, jwks_uri, issuer)"""
+    return await _cached_json(discovery_url)
+
+
+async def endpoint(name: str, override: str = None, discovery_url: str = GOOGLE_DISCOVERY_URL) -> str:
+    """Configured URL if set, otherwise the one from the discovery document (e.g. 'token_endpoint')"""
+    if override:
+        return override
+    return (await discovery(discovery_url))[name]
+
+
+def _parse_jwks(jwks: dict) -> dict:
+    keys = {}
+    for jwk in jwks.get("keys", []):
+        try:
+            keys[jwk["kid"]] = jwt.PyJWK(jwk)
+        except (KeyError, jwt.exceptions.PyJWKError) as e:
+            logger.warning(f"Skipping unusable JWK {jwk.get('kid')}: {e}")
+    return keys
+
+
+async def signing_key(kid: str, discovery_url: str = GOOGLE_DISCOVERY_URL):
+    """Public key for kid; an unknown kid (Google rotated its keys) refetches the JWKS, rate limited"""
+    jwks_uri = (await discovery(discovery_url))["jwks_uri"]
+    keys = await _cached_json(jwks_uri, _parse_jwks)
+    if kid not in keys and time.monotonic() - _fetched_at.get(jwks_uri, 0.0) > JWKS_MIN_REFRESH_INTERVAL:
+        keys = await _cached_json(jwks_uri, _parse_jwks, refresh=True)
+    return keys.get(kid)
+
+
+async def verify_id_token(id_token: str, audience: str, discovery_url: str = GOOGLE_DISCOVERY_URL) -> dict:
+    """Claims of a Google id_token, checked locally against the cached JWKS (no tokeninfo/userinfo call)"""
+    try:
+        header = jwt.get_unverified_header(id_token)
+        key = await signing_key(header.get("kid"), discovery_url)
+        if key is None:
+            raise IdTokenError(f"unknown signing key {header.get('kid')}")
+        claims = jwt.decode(
+            id_token, key, algorithms=["RS256"], audience=audience, leeway=ID_TOKEN_LEEWAY,
+            options={"require": ["exp", "iat", "iss", "sub", "aud"]},
+        )
+        issuers = {(await discovery(discovery_url)).get("issuer"), *GOOGLE_ISSUERS}
+        if claims["iss"] not in issuers:
+            raise IdTokenError(f"unexpected issuer {claims['iss']}")
+    except IdTokenError:
+        _stats["rejected"] += 1
+        raise
+    except jwt.exceptions.PyJWTError as e:
+        _stats["rejected"] += 1
+        raise IdTokenError(str(e)) from e
+    _stats["verified"] += 1
+    return claims
+
+
+async def warm_up(discovery_url: str = GOOGLE_DISCOVERY_URL):
+    """Fetch discovery and JWKS ahead of the first sign-in"""
+    try:
+        await _cached_json((await discovery(discovery_url))["jwks_uri"], _parse_jwks)
+        logger.info("✅ Google OpenID metadata and signing keys cached")
+    except Exception as e:
+        logger.warning(f"⚠️ Google OpenID metadata prefetch failed: {e}")
+
+
+def oidc_stats() -> dict:
+    return {"http2": HTTP2_AVAILABLE, **_stats}
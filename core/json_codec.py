@@ -0,0 +1,50 @@
+import json, logging
+from typing import Any
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# Setup logger for this module
+logger = logging.getLogger("json_codec")
+
+JSON_BACKEND = "orjson" if ORJSON_AVAILABLE else "json"
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so existing `except json.JSONDecodeError` keeps working
+JSONDecodeError = json.JSONDecodeError
+
+if ORJSON_AVAILABLE:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(obj: Any) -> bytes:
+        try:
+            return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+        except TypeError:
+            # Types orjson does not know (Decimal, custom classes, >64-bit ints): same result/error as before
+            return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode("utf-8")
+
+    def loads(data) -> Any:
+        return orjson.loads(data)
+else:
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return dumps(obj).encode("utf-8")
+
+    def loads(data) -> Any:
+        return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: JSONResponse rendered by the fastest available backend"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
@@ -43,13 +43,17 @@ hash_password = None
 
 # Import required functions from other modules
 from .db import get_db_connection, close_db_connection
+from .cache import invalidate_user
+from .password_hashing import hash_password_async
 from .config import get_jalali_now_str
-from .token import get_current_user
-from .Security import check_rate_limit, generate_captcha_text, generate_math_captcha, validate_captcha, record_captcha_attempt, is_captcha_blocked
-from .config import CAPTCHA_CONFIG, PICO_AUTH_TOKENS, ESP32CAM_AUTH_TOKENS
+from .token import get_current_user, revoke_user_tokens
+from .Security import check_rate_limit, validate_captcha, record_captcha_attempt, is_captcha_blocked, CAPTCHA_CONFIG
+from .captcha_pool import issue_challenge, redeem_challenge
+from .config import PICO_AUTH_TOKENS, ESP32CAM_AUTH_TOKENS
 
 # Import UI translations
 from .translations_ui import UI_TRANSLATIONS
+from .render_cache import translations_response
 
 # Translations
 translations = UI_TRANSLATIONS
@@ -65,10 +69,6 @@ def set_dependencies(log_func, verify_pwd_func, hash_pwd_func):
 
 
 
-
-# Initialize CAPTCHA storage
-captcha_storage = {}
-
 # User model
 class User(BaseModel):
     username: str
@@ -115,21 +115,23 @@ async def create_user(user: User, request: Request, current_user=Depends(get_cur
     
     try:
         conn = await get_db_connection()
-        
-        # Check if username already exists
-        existing_user = await conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', (user.username,))
-        if (await existing_user.fetchone())[0] > 0:
-            raise HTTPException(status_code=400, detail="Username already exists")
-        
-        # Hash password and create user
-        password_hash = hash_password(user.password)
-        await conn.execute('''
-            INSERT INTO users (username, password_hash, role, is_active, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user.username, password_hash, user.role, user.is_active, get_jalali_now_str()))
-        
-        await conn.commit()
-        await close_db_connection(conn)
+        try:
+            # Check if username already exists
+            existing_user = await conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', (user.username,))
+            if (await existing_user.fetchone())[0] > 0:
+                raise HTTPException(status_code=400, detail="Username already exists")
+            
+            # Hash password and create user
+            password_hash = await hash_password_async(user.password)
+            await conn.execute('''
+                INSERT INTO users (username, password_hash, role, is_active, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user.username, password_hash, user.role, user.is_active, get_jalali_now_str()))
+            
+            await conn.commit()
+        finally:
+            # also on the 400/429 paths, which are raised while the connection is open
+            await close_db_connection(conn)
         
         await insert_log(f"User '{user.username}' created by admin '{current_user.get('sub')}'", "auth")
         
@@ -199,6 +201,9 @@ async def toggle_user_status(username: str, current_user=Depends(get_current_use
         await conn.execute('UPDATE users SET is_active = ? WHERE username = ?', (new_status, username))
         await conn.commit()
         await close_db_connection(conn)
+        invalidate_user(username)
+        if not new_status:
+            revoke_user_tokens(username)
         
         action = "activated" if new_status else "deactivated"
         await insert_log(f"User '{username}' {action} by admin '{current_user.get('sub')}'", "auth")
@@ -213,11 +218,10 @@ async def toggle_user_status(username: str, current_user=Depends(get_current_use
     
     
 
-async def get_translations(lang: str = "fa"):
-    """Get comprehensive UI translations for the specified language"""
+async def get_translations(request: Request, lang: str = "fa"):
+    """Get comprehensive UI translations for the specified language (pre-serialized, ETag revalidation)"""
     try:
-        # Return the comprehensive UI translations
-        return JSONResponse(UI_TRANSLATIONS.get(lang, UI_TRANSLATIONS["fa"]))
+        return translations_response(request, lang)
     except Exception as e:
         logger.error(f"Error getting translations for {lang}: {e}")
         # Fallback to basic translations
@@ -234,11 +238,14 @@ async def get_text_captcha(request: Request):
     if is_captcha_blocked(client_ip):
         raise HTTPException(status_code=429, detail="Too many CAPTCHA attempts")
     
-    # Generate CAPTCHA
-    captcha_text = generate_captcha_text(CAPTCHA_CONFIG['CAPTCHA_LENGTH'])
+    # Take a pre-generated CAPTCHA from the pool; its answer is stored with expiry
+    captcha_id, captcha_text = issue_challenge("text", client_ip)
     
-    # Store CAPTCHA with expiry
-    captcha_id = secrets.token_urlsafe(16)
+    return {
+        "captcha_id": captcha_id,
+        "captcha_text": captcha_text,
+        "expires_in": CAPTCHA_CONFIG['CAPTCHA_EXPIRY']
+    }
 
 async def get_mobile_captcha(request: Request):
     """Generate mobile CAPTCHA for mobile login"""
@@ -248,16 +255,8 @@ async def get_mobile_captcha(request: Request):
     if is_captcha_blocked(client_ip):
         raise HTTPException(status_code=429, detail="Too many CAPTCHA attempts")
     
-    # Generate CAPTCHA
-    captcha_text = generate_captcha_text(CAPTCHA_CONFIG['CAPTCHA_LENGTH'])
-    
-    # Store CAPTCHA with expiry
-    captcha_id = secrets.token_urlsafe(16)
-    captcha_storage[captcha_id] = {
-        'text': captcha_text,
-        'expires_at': time.time() + CAPTCHA_CONFIG['CAPTCHA_EXPIRY'],
-        'client_ip': client_ip
-    }
+    # Take a pre-generated CAPTCHA from the pool; its answer is stored with expiry
+    captcha_id, captcha_text = issue_challenge("text", client_ip)
     
     return {
         "captcha_id": captcha_id,
@@ -277,17 +276,8 @@ async def get_math_captcha(request: Request):
     if is_captcha_blocked(client_ip):
         raise HTTPException(status_code=429, detail="Too many CAPTCHA attempts")
     
-    # Generate CAPTCHA
-    question, answer = generate_math_captcha()
-    
-    # Store CAPTCHA with expiry
-    captcha_id = secrets.token_urlsafe(16)
-    captcha_storage[captcha_id] = {
-        'question': question,
-        'answer': answer,
-        'expires_at': time.time() + CAPTCHA_CONFIG['CAPTCHA_EXPIRY'],
-        'client_ip': client_ip
-    }
+    # Take a pre-generated CAPTCHA from the pool; its answer is stored with expiry
+    captcha_id, question = issue_challenge("math", client_ip)
     
     return {
         "captcha_id": captcha_id,
@@ -306,42 +296,34 @@ async def verify_captcha(request: Request):
         if not captcha_id or not user_input:
             raise HTTPException(status_code=400, detail="Missing captcha_id or user_input")
         
-        # Get stored CAPTCHA
-        if captcha_id not in captcha_storage:
+        # Get and consume the stored CAPTCHA (expired ones are already gone)
+        challenge = redeem_challenge(captcha_id)
+        if challenge is None:
             raise HTTPException(status_code=400, detail="Invalid or expired CAPTCHA")
-        
-        captcha_data = captcha_storage[captcha_id]
-        
-        # Check expiry
-        if time.time() > captcha_data['expires_at']:
-            del captcha_storage[captcha_id]
-            raise HTTPException(status_code=400, detail="CAPTCHA expired")
+        kind, answer, _ = challenge
         
         # Verify CAPTCHA
         client_ip = request.client.host
         is_valid = False
         
-        if 'text' in captcha_data:
+        if kind == "text":
             # Text CAPTCHA
             is_valid = validate_captcha(
                 user_input, 
-                captcha_data['text'], 
+                answer, 
                 CAPTCHA_CONFIG['CAPTCHA_CASE_SENSITIVE']
             )
-        elif 'answer' in captcha_data:
+        elif kind == "math":
             # Math CAPTCHA
             try:
                 user_answer = int(user_input)
-                is_valid = user_answer == captcha_data['answer']
+                is_valid = user_answer == answer
             except ValueError:
                 is_valid = False
         
         # Record attempt
         record_captcha_attempt(client_ip, is_valid)
         
-        # Clean up used CAPTCHA
-        del captcha_storage[captcha_id]
-        
         return {"valid": is_valid}
         
     except HTTPException:
@@ -0,0 +1,266 @@
+import asyncio, os, re, time, logging
+from datetime import datetime
+
+# Import from shared config
+from .config import GALLERY_DIR, SECURITY_VIDEOS_DIR, get_jalali_now_str
+from .db import get_db_connection, close_db_connection
+from .cache import video_metadata_cache
+from . import counters
+
+try:
+    import cv2
+    CV2_AVAILABLE = True
+except ImportError:
+    cv2 = None
+    CV2_AVAILABLE = False
+
+# Setup logger for this module
+logger = logging.getLogger("media_catalog")
+
+# Constants
+MEDIA_RECONCILE_INTERVAL = int(os.getenv("MEDIA_RECONCILE_INTERVAL", "600"))
+MEDIA_RECONCILE_BATCH = int(os.getenv("MEDIA_RECONCILE_BATCH", "500"))
+MEDIA_SETTLE_SECONDS = int(os.getenv("MEDIA_SETTLE_SECONDS", "120"))  # files younger than this may still be written
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov")
+
+# security_video_YYYYmmdd_HHMMSS_<hour>.mp4
+_VIDEO_NAME_RE = re.compile(r"_(\d{8})_(\d{2})(\d{4})(?:_(\d{1,2}))?\.\w+$")
+
+MEDIA_SOURCES = {
+    "manual_photos": (GALLERY_DIR, PHOTO_EXTENSIONS),
+    "security_videos": (SECURITY_VIDEOS_DIR, VIDEO_EXTENSIONS),
+}
+
+
+def video_hour_from_name(filename: str, mtime: float = None) -> int:
+    """Hour of day for a video: from its name when it follows the naming scheme, else from mtime"""
+    match = _VIDEO_NAME_RE.search(filename)
+    if match:
+        hour = int(match.group(4) if match.group(4) is not None else match.group(2))
+        if 0 <= hour <= 23:
+            return hour
+    return datetime.fromtimestamp(mtime).hour if mtime else 0
+
+
+def file_stat(filepath: str):
+    """(size, mtime) for a media file, or (None, None) if it is gone"""
+    try:
+        st = os.stat(filepath)
+        return st.st_size, st.st_mtime
+    except OSError:
+        return None, None
+
+
+def encode_cursor(mtime: float, row_id: int) -> str:
+    return f"{mtime!r}:{row_id}"
+
+
+def decode_cursor(cursor: str):
+    """Parse a keyset cursor 'mtime:id'; raises ValueError on garbage"""
+    mtime, _, row_id = (cursor or "").partition(":")
+    return float(mtime), int(row_id)
+
+
+async def list_media(table: str, limit: int, cursor: str = None, offset: int = 0) -> tuple:
+    """One page of the catalog, newest first; keyset pagination when a cursor is given"""
+    columns = "id, filename, size, mtime, derivative_hash" + (", hour_of_day" if table == "security_videos" else ", width")
+    params = []
+    where = "WHERE mtime IS NOT NULL"
+    if cursor:
+        before_mtime, before_id = decode_cursor(cursor)
+        where += " AND (mtime, id) < (?, ?)"
+        params += [before_mtime, before_id]
+    query = f"SELECT {columns} FROM {table} {where} ORDER BY mtime DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    if not cursor and offset:
+        query += " OFFSET ?"
+        params.append(offset)
+
+    conn = await get_db_connection()
+    try:
+        result = await conn.execute(query, tuple(params))
+        rows = await result.fetchall()
+    finally:
+        await close_db_connection(conn)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]["mtime"], rows[-1]["id"]) if has_more and rows else None
+    return rows, next_cursor, has_more
+
+
+def _scan_dir(folder: str, extensions: tuple) -> dict:
+    """filename -> (size, mtime) using scandir (stat info comes with the directory entry)"""
+    found = {}
+    if not os.path.isdir(folder):
+        return found
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                try:
+                    st = entry.stat()
+                    found[entry.name] = (st.st_size, st.st_mtime)
+                except OSError:
+                    continue
+    return found
+
+
+async def reconcile_table(conn, table: str) -> dict:
+    """Bring one catalog table in line with its directory (add missing, drop vanished, backfill stats)"""
+    folder, extensions = MEDIA_SOURCES[table]
+    if not await asyncio.to_thread(os.path.isdir, folder):
+        # Missing/unmounted media directory: the catalog is all we have, leave it alone
+        logger.warning(f"⚠️ Media directory {folder} not found, skipping reconcile of {table}")
+        return {"added": 0, "removed": 0, "updated": 0}
+    on_disk = await asyncio.to_thread(_scan_dir, folder, extensions)
+    cursor = await conn.execute(f"SELECT id, filename, size, mtime FROM {table}")
+    in_db = {}
+    duplicates = []
+    for row in await cursor.fetchall():
+        if row["filename"] in in_db:
+            duplicates.append(row["id"])
+        else:
+            in_db[row["filename"]] = (row["id"], row["size"], row["mtime"])
+
+    settle_before = time.time() - MEDIA_SETTLE_SECONDS
+    missing = [name for name in on_disk if name not in in_db and on_disk[name][1] < settle_before]
+    if on_disk:
+        vanished = [in_db[name][0] for name in in_db if name not in on_disk] + duplicates
+    else:
+        # An empty scan is more likely a mount that is not ready than every file deleted at once
+        if in_db:
+            logger.warning(f"⚠️ {folder} is empty but {table} lists {len(in_db)} files, not removing any")
+        vanished = duplicates
+    stale = [(on_disk[name][0], on_disk[name][1], row_id) for name, (row_id, size, mtime) in in_db.items()
+             if name in on_disk and (size, mtime) != on_disk[name]]
+
+    for i in range(0, len(missing), MEDIA_RECONCILE_BATCH):
+        batch = missing[i:i + MEDIA_RECONCILE_BATCH]
+        if table == "manual_photos":
+            await conn.executemany(
+                "INSERT INTO manual_photos (filename, filepath, created_at, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                [(name, os.path.join(folder, name), get_jalali_now_str(), *on_disk[name]) for name in batch]
+            )
+        else:
+            await conn.executemany(
+                "INSERT INTO security_videos (filename, filepath, hour_of_day, created_at, size, mtime) VALUES (?, ?, ?, ?, ?, ?)",
+                [(name, os.path.join(folder, name), video_hour_from_name(name, on_disk[name][1]),
+                  get_jalali_now_str(), *on_disk[name]) for name in batch]
+            )
+        await conn.commit()
+    for i in range(0, len(vanished), MEDIA_RECONCILE_BATCH):
+        batch = vanished[i:i + MEDIA_RECONCILE_BATCH]
+        await conn.execute(f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(batch))})", batch)
+        await conn.commit()
+    if stale:
+        await conn.executemany(f"UPDATE {table} SET size = ?, mtime = ? WHERE id = ?", stale)
+        await conn.commit()
+    return {"added": len(missing), "removed": len(vanished), "updated": len(stale)}
+
+
+def _stat_key(st: os.stat_result) -> tuple:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def probe_video(filepath: str) -> dict:
+    """Read fps/frame count/dimensions from the container (blocking; run in a thread)"""
+    if not CV2_AVAILABLE:
+        return {}
+    cap = cv2.VideoCapture(filepath)
+    try:
+        if not cap.isOpened():
+            return {}
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": round(fps, 2),
+            "frame_count": frame_count,
+            "duration": frame_count / fps if fps > 0 else 0,
+        }
+    finally:
+        cap.release()
+
+
+async def store_video_metadata(filename: str, st: os.stat_result, info: dict):
+    """Persist probed (or known-at-recording-time) properties for the current version of a file"""
+    video_metadata_cache.set(filename, (_stat_key(st), info))
+    if not info:
+        return
+    conn = await get_db_connection()
+    try:
+        await conn.execute(
+            "INSERT OR REPLACE INTO video_metadata (filename, inode, mtime_ns, size, width, height, fps, frame_count, duration) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (filename, *_stat_key(st), info.get("width"), info.get("height"), info.get("fps"),
+             info.get("frame_count"), info.get("duration"))
+        )
+        await conn.commit()
+    finally:
+        await close_db_connection(conn)
+
+
+async def get_video_info(filename: str, st: os.stat_result, filepath: str = None) -> dict:
+    """Video properties for `st`: memory, then video_metadata, then (only on a miss) the decoder"""
+    key = _stat_key(st)
+    cached = video_metadata_cache.get(filename)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    conn = await get_db_connection()
+    try:
+        cursor = await conn.execute(
+            "SELECT width, height, fps, frame_count, duration FROM video_metadata "
+            "WHERE filename = ? AND inode = ? AND mtime_ns = ? AND size = ?",
+            (filename, *key)
+        )
+        row = await cursor.fetchone()
+    finally:
+        await close_db_connection(conn)
+    if row:
+        info = dict(zip(("width", "height", "fps", "frame_count", "duration"), row))
+        video_metadata_cache.set(filename, (key, info))
+        return info
+
+    info = await asyncio.to_thread(probe_video, filepath or os.path.join(SECURITY_VIDEOS_DIR, filename))
+    await store_video_metadata(filename, st, info)
+    return info
+
+
+async def reconcile_media_catalog() -> dict:
+    """Reconcile manual_photos and security_videos with the gallery and video directories"""
+    started = time.time()
+    results = {}
+    conn = await get_db_connection()
+    try:
+        for table in MEDIA_SOURCES:
+            try:
+                results[table] = await reconcile_table(conn, table)
+            except Exception as e:
+                logger.error(f"Media catalog reconcile error on {table}: {e}")
+        try:
+            await conn.execute("DELETE FROM video_metadata WHERE filename NOT IN (SELECT filename FROM security_videos)")
+            await conn.commit()
+        except Exception as e:
+            logger.error(f"Media catalog reconcile error on video_metadata: {e}")
+        await counters.refresh_counters(conn)
+    finally:
+        await close_db_connection(conn)
+    changes = sum(sum(r.values()) for r in results.values())
+    if changes:
+        logger.info(f"✅ Media catalog reconciled in {time.time() - started:.2f}s: {results}")
+    return results
+
+
+async def periodic_media_reconcile():
+    """Filesystem scanner loop: reconcile at startup and every MEDIA_RECONCILE_INTERVAL seconds"""
+    while True:
+        try:
+            await reconcile_media_catalog()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Media catalog reconcile failed: {e}")
+        await asyncio.sleep(MEDIA_RECONCILE_INTERVAL)
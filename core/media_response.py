@@ -0,0 +1,193 @@
+import asyncio, os, re, secrets, logging
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+# Setup logger for this module
+logger = logging.getLogger("media_response")
+
+# Constants
+MEDIA_CHUNK_MIN = int(os.getenv("MEDIA_CHUNK_MIN", str(64 * 1024)))  # first chunk: fast start/seek
+MEDIA_CHUNK_MAX = int(os.getenv("MEDIA_CHUNK_MAX", str(1024 * 1024)))  # grows up to this for long reads
+MEDIA_MAX_RANGES = int(os.getenv("MEDIA_MAX_RANGES", "16"))
+
+_RANGE_SPEC_RE = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def file_etag(st: os.stat_result) -> str:
+    """Strong ETag stable across processes and restarts: inode-mtime-size"""
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def parse_range_header(range_header: str, file_size: int):
+    """Parse 'bytes=a-b, c-, -n' into [(start, end)] (inclusive).
+
+    Returns None when the header is malformed (RFC 9110: ignore it and send 200),
+    raises HTTPException(416) when no range is satisfiable."""
+    unit, _, specs = (range_header or "").partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        match = _RANGE_SPEC_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            start, end = max(file_size - length, 0), file_size - 1
+        else:
+            start = int(first)
+            end = min(int(last), file_size - 1) if last else file_size - 1
+            if last and int(last) < start:
+                return None
+            if start >= file_size:
+                continue
+        ranges.append((start, end))
+    if not ranges:
+        raise HTTPException(status_code=416, detail="Range not satisfiable",
+                            headers={"Content-Range": f"bytes */{file_size}"})
+    if len(ranges) > MEDIA_MAX_RANGES:
+        return None
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges: list) -> list:
+    """Merge overlapping/adjacent ranges so a client cannot ask for the same bytes many times"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _etag_matches(header_value: str, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match"""
+    if header_value.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header_value.split(","))
+
+
+def _not_modified_since(header_value: str, mtime: float) -> bool:
+    try:
+        return int(mtime) <= parsedate_to_datetime(header_value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+def _if_range_allows(header_value: str, etag: str, mtime: float) -> bool:
+    """If-Range: honour Range only if the validator still matches (strong comparison for ETags)"""
+    value = header_value.strip()
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag
+    return _not_modified_since(value, mtime)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """StreamingResponse that runs on_close once it has been handled, even when the body never started (client
+    gone before the first chunk); resources a body needs must be acquired inside the body itself"""
+
+    def __init__(self, content, on_close=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            aclose = getattr(self.body_iterator, "aclose", None)
+            if aclose:
+                await aclose()
+            if self.on_close:
+                self.on_close()
+
+
+async def _read_ranges(file_path: str, ranges: list, parts: list = None):
+    """Read byte ranges with pread in a worker thread; chunk size doubles while a range keeps streaming.
+    The file is opened on the first iteration, so a body that never runs holds no descriptor"""
+    fd = await asyncio.to_thread(os.open, file_path, os.O_RDONLY)
+    try:
+        for index, (start, end) in enumerate(ranges):
+            if parts:
+                yield parts[index]
+            offset, remaining, chunk = start, end - start + 1, MEDIA_CHUNK_MIN
+            while remaining > 0:
+                data = await asyncio.to_thread(os.pread, fd, min(chunk, remaining), offset)
+                if not data:
+                    break
+                yield data
+                offset += len(data)
+                remaining -= len(data)
+                chunk = min(chunk * 2, MEDIA_CHUNK_MAX)
+        if parts:
+            yield parts[-1]
+    finally:
+        os.close(fd)
+
+
+async def media_file_response(request: Request, file_path: str, content_type: str, headers: dict = None,
+                              on_close=None) -> Response:
+    """Conditional, range-aware file response that never touches the disk on the event loop.
+
+    Handles If-None-Match/If-Modified-Since (304), If-Range, single ranges (206),
+    multiple ranges (206 multipart/byteranges) and full bodies (200)."""
+    st = await asyncio.to_thread(os.stat, file_path)
+    etag = file_etag(st)
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    base_headers = dict(headers or {})
+    base_headers.update({"Accept-Ranges": "bytes", "ETag": etag, "Last-Modified": last_modified})
+
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if (if_none_match and _etag_matches(if_none_match, etag)) or \
+       (not if_none_match and if_modified_since and _not_modified_since(if_modified_since, st.st_mtime)):
+        if on_close:
+            on_close()
+        return Response(status_code=304, headers=base_headers)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header and st.st_size > 0:
+        if_range = request.headers.get("if-range")
+        if not if_range or _if_range_allows(if_range, etag, st.st_mtime):
+            ranges = parse_range_header(range_header, st.st_size)
+
+    if not ranges:
+        body = _read_ranges(file_path, [(0, st.st_size - 1)] if st.st_size else [])
+        status = 200
+        base_headers["Content-Type"] = content_type
+        base_headers["Content-Length"] = str(st.st_size)
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        body = _read_ranges(file_path, ranges)
+        status = 206
+        base_headers["Content-Type"] = content_type
+        base_headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+        base_headers["Content-Length"] = str(end - start + 1)
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            (("" if i == 0 else "\r\n") + f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+             f"Content-Range: bytes {start}-{end}/{st.st_size}\r\n\r\n").encode()
+            for i, (start, end) in enumerate(ranges)
+        ]
+        parts.append(f"\r\n--{boundary}--\r\n".encode())
+        body = _read_ranges(file_path, ranges, parts)
+        status = 206
+        base_headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        base_headers["Content-Length"] = str(sum(len(p) for p in parts) + sum(e - s + 1 for s, e in ranges))
+
+    if request.method == "HEAD":
+        if on_close:
+            on_close()
+        return Response(status_code=status, headers=base_headers)
+
+    return ClosingStreamingResponse(body, status_code=status, headers=base_headers, on_close=on_close)
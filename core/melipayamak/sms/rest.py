@@ -1,5 +1,8 @@
 import requests
 
+# shared keep-alive connection pool for every Rest instance
+_session = requests.Session()
+
 
 class Rest:
     PATH = "https://rest.payamak-panel.com/api/SendSMS/%s"
@@ -9,7 +12,7 @@ class Rest:
         self.password = password
 
     def post(self, url, data):
-        r = requests.post(url, data)
+        r = _session.post(url, data)
         return r.json()
 
     def get_data(self):
@@ -1,6 +1,13 @@
+from functools import lru_cache
 from zeep import Client
 
 
+@lru_cache(maxsize=None)
+def wsdl_client(url):
+    """zeep Client per WSDL URL, built once: fetching and parsing the WSDL costs a round trip per call otherwise"""
+    return Client(url)
+
+
 class Soap:
     PATH = "http://api.payamak-panel.com/post/%s.asmx?wsdl"
 
@@ -19,12 +26,12 @@ class Soap:
         }
 
     def get_credit(self):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         result = client.service.GetCredit(**self.get_data())
         return result
 
     def is_delivered(self, recId):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         result = None
         
         if isinstance(recId, list):
@@ -40,7 +47,7 @@ class Soap:
         return result
 
     def send(self, to, _from, text, isflash=False):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'from': _from,
             'text': text,
@@ -55,7 +62,7 @@ class Soap:
         return result
 
     def send2(self, to, _from, text, isflash=False, udh=''):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         to = to if isinstance(to, list) else [to]
         data = {
             'from': _from,
@@ -68,7 +75,7 @@ class Soap:
         return result
 
     def send_with_domain(self, to, _from, text, isflash, domainName):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'from': _from,
             'text': text,
@@ -80,7 +87,7 @@ class Soap:
         return result
 
     def send_by_base_number(self, text, to, bodyId):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'text': text,
             'to': to,
@@ -94,7 +101,7 @@ class Soap:
         return result
     
     def get_messages(self, location, index, count, _from=''):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'location': location,
             'index': index,
@@ -105,7 +112,7 @@ class Soap:
         return result
 
     def get_messages_str(self, location, index, count, _from=''):
-        client = Client(self.receiveUrl)
+        client = wsdl_client(self.receiveUrl)
         data = {
             'location': location,
             'index': index,
@@ -116,7 +123,7 @@ class Soap:
         return result
 
     def get_messages_by_date(self, location, index, count, dateFrom, dateTo, _from=''):
-        client = Client(self.receiveUrl)
+        client = wsdl_client(self.receiveUrl)
         data = {
             'location': location,
             'index': index,
@@ -129,7 +136,7 @@ class Soap:
         return result
 
     def get_messages_receptions(self, msgId, fromRows):
-        client = Client(self.receiveUrl)
+        client = wsdl_client(self.receiveUrl)
         data = {
             'msgId': msgId,
             'fromRows': fromRows
@@ -138,7 +145,7 @@ class Soap:
         return result
 
     def get_users_messages_by_date(self, location, index, count, _from,dateFrom, dateTo):
-        client = Client(self.receiveUrl)
+        client = wsdl_client(self.receiveUrl)
         data = {
             'location': location,
             'index': index,
@@ -152,7 +159,7 @@ class Soap:
         return result
 
     def remove(self, msgIds):
-        client = Client(self.receiveUrl)
+        client = wsdl_client(self.receiveUrl)
         data = {
             'msgIds': msgIds,
         }
@@ -160,7 +167,7 @@ class Soap:
         return result
 
     def get_price(self, irancellCount, mtnCount,  _from, text):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'irancellCount': irancellCount,
             'mtnCount': mtnCount,
@@ -171,7 +178,7 @@ class Soap:
         return result
 
     def get_inbox_count(self, isRead=False):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'isRead': isRead,
         }
@@ -179,7 +186,7 @@ class Soap:
         return result
 
     def send_with_speech(self, to, _from, text, speech):
-        client = Client(self.voiceUrl)
+        client = wsdl_client(self.voiceUrl)
         data = {
             'to': to,
             'from': _from,
@@ -190,7 +197,7 @@ class Soap:
         return result
 
     def send_with_speech_schdule_date(self, to, _from, text, speech, scheduleDate):
-        client = Client(self.voiceUrl)
+        client = wsdl_client(self.voiceUrl)
         data = {
             'to': to,
             'from': _from,
@@ -203,7 +210,7 @@ class Soap:
         return result
 
     def get_send_with_speech(self, recId):
-        client = Client(self.voiceUrl)
+        client = wsdl_client(self.voiceUrl)
         data = {
             'recId': recId
         }
@@ -212,7 +219,7 @@ class Soap:
         return result
 
     def get_multi_delivery(self, recId):
-        client = Client(self.sendUrl)
+        client = wsdl_client(self.sendUrl)
         data = {
             'recId': recId
         }
@@ -220,7 +227,7 @@ class Soap:
         return result
 
     def send_multiple_schedule(self, to, _from, text, isflash, scheduleDateTime, period):
-        client = Client(self.scheduleUrl)
+        client = wsdl_client(self.scheduleUrl)
         data = {
             'to': to,
             'from': _from,
@@ -233,7 +240,7 @@ class Soap:
         return result
 
     def send_schedule(self, to, _from, text, isflash, scheduleDateTime, period):
-        client = Client(self.scheduleUrl)
+        client = wsdl_client(self.scheduleUrl)
         data = {
             'to': to,
             'from': _from,
@@ -246,7 +253,7 @@ class Soap:
         return result
 
     def get_schedule_status(self, scheduleId):
-        client = Client(self.scheduleUrl)
+        client = wsdl_client(self.scheduleUrl)
         data = {
             'scheduleId': scheduleId
         }
@@ -254,7 +261,7 @@ class Soap:
         return result
 
     def remove_schedule(self, scheduleId):
-        client = Client(self.scheduleUrl)
+        client = wsdl_client(self.scheduleUrl)
         data = {
             'scheduleId': scheduleId
         }
@@ -262,7 +269,7 @@ class Soap:
         return result
 
     def add_usance(self, to, _from, text, isflash, scheduleStartDateTime, repeatAfterDays, scheduleEndDateTime):
-        client = Client(self.scheduleUrl)
+        client = wsdl_client(self.scheduleUrl)
         data = {
             'to': to,
             'from': _from,
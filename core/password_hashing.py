@@ -0,0 +1,158 @@
+import asyncio, os, time, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+try:
+    import bcrypt
+    BCRYPT_AVAILABLE = True
+except ImportError:
+    BCRYPT_AVAILABLE = False
+
+# Setup logger for this module
+logger = logging.getLogger("password_hashing")
+
+
+def _env_rounds() -> int:
+    try:
+        rounds = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    except ValueError:
+        logger.error("⚠️ Invalid BCRYPT_ROUNDS, using 12")
+        return 12
+    if not 4 <= rounds <= 31:
+        logger.error(f"⚠️ BCRYPT_ROUNDS={rounds} is outside 4-31, using 12")
+        return 12
+    return rounds
+
+
+# Constants
+BCRYPT_ROUNDS = _env_rounds()
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# hashes waiting or running beyond this are rejected with 429 instead of queueing for seconds
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(PASSWORD_HASH_WORKERS * 4)))
+PASSWORD_HASH_RETRY_AFTER = 2  # seconds
+SATURATION_LOG_INTERVAL = 10  # seconds between "saturated" warnings during a storm
+
+# bcrypt releases the GIL while hashing, so these threads run next to the event loop instead of blocking it
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_metrics = {"pending": 0, "running": 0, "peak_pending": 0, "completed": 0, "rejected": 0,
+            "rehashed": 0, "wait_total": 0.0, "run_total": 0.0, "last_saturation_log": 0.0}
+_lock = threading.Lock()
+
+
+def _require_bcrypt():
+    if not BCRYPT_AVAILABLE:
+        logger.error("bcrypt is required for password hashing. Please install it: pip install bcrypt")
+        raise ImportError("bcrypt is required for password hashing")
+
+
+def hash_password_sync(password: str, rounds: int = None) -> str:
+    """Blocking bcrypt hash; only for code that is not running on the event loop"""
+    _require_bcrypt()
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    """Blocking bcrypt check; only for code that is not running on the event loop"""
+    _require_bcrypt()
+    try:
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    except ValueError:
+        # malformed or non-bcrypt hash stored for the user
+        return False
+
+
+def hash_rounds(hashed_password: str) -> int:
+    """Cost factor of a bcrypt hash ($2b$12$...), 0 when it cannot be read"""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hash_rounds(hashed_password) != BCRYPT_ROUNDS
+
+
+def _release(future):
+    with _lock:
+        _metrics["pending"] -= 1
+
+
+async def _run(func, *args):
+    with _lock:
+        if _metrics["pending"] >= PASSWORD_HASH_MAX_PENDING:
+            _metrics["rejected"] += 1
+            rejected = True
+        else:
+            _metrics["pending"] += 1
+            _metrics["peak_pending"] = max(_metrics["peak_pending"], _metrics["pending"])
+            rejected = False
+    if rejected:
+        now = time.monotonic()
+        if now - _metrics["last_saturation_log"] >= SATURATION_LOG_INTERVAL:
+            _metrics["last_saturation_log"] = now
+            logger.warning(f"⚠️ Password hashing saturated ({PASSWORD_HASH_MAX_PENDING} pending), "
+                           f"rejecting with 429 ({_metrics['rejected']} rejected so far)")
+        raise HTTPException(status_code=429, detail="سرور مشغول است، لطفاً چند ثانیه دیگر تلاش کنید",
+                            headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER)})
+    submitted = time.monotonic()
+
+    def job():
+        started = time.monotonic()
+        with _lock:
+            _metrics["running"] += 1
+            _metrics["wait_total"] += started - submitted
+        try:
+            return func(*args)
+        finally:
+            with _lock:
+                _metrics["running"] -= 1
+                _metrics["completed"] += 1
+                _metrics["run_total"] += time.monotonic() - started
+
+    future = _executor.submit(job)
+    # a hash keeps its slot until it finishes, even if the request awaiting it was cancelled
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password_async(password: str) -> str:
+    """bcrypt hash on the password worker pool; raises 429 when the pool is saturated"""
+    return await _run(hash_password_sync, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """bcrypt check on the password worker pool; raises 429 when the pool is saturated"""
+    return await _run(verify_password_sync, plain_password, hashed_password)
+
+
+async def rehash_if_needed(plain_password: str, hashed_password: str):
+    """New hash at the configured cost for a password that was just verified, or None when the stored hash is
+    current. Best effort: a saturated pool skips the upgrade, it is retried on the next login."""
+    if not needs_rehash(hashed_password):
+        return None
+    try:
+        new_hash = await hash_password_async(plain_password)
+    except HTTPException:
+        return None
+    _metrics["rehashed"] += 1
+    return new_hash
+
+
+def password_hash_stats() -> dict:
+    completed = _metrics["completed"] or 1
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "rounds": BCRYPT_ROUNDS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "pending": _metrics["pending"],
+        "running": _metrics["running"],
+        "queued": _metrics["pending"] - _metrics["running"],
+        "peak_pending": _metrics["peak_pending"],
+        "completed": _metrics["completed"],
+        "rejected": _metrics["rejected"],
+        "rehashed": _metrics["rehashed"],
+        "avg_wait_ms": round(_metrics["wait_total"] / completed * 1000, 2),
+        "avg_hash_ms": round(_metrics["run_total"] / completed * 1000, 2),
+    }
@@ -8,6 +8,7 @@ from pydantic import BaseModel, Field, ValidationError
 from .token import get_current_user
 from .Security import check_rate_limit
 from .utils import send_to_web_clients_wrapper
+from . import json_codec
 from .client import authenticate_websocket
 from .db import insert_log, insert_servo_command, insert_action_command
 
@@ -104,7 +105,7 @@ async def send_to_pico_client(message):
             client = getattr(system_state, 'pico_client', None)
             if client:
                 try:
-                    await client.send_text(json.dumps(message))
+                    await client.send_text(json_codec.dumps(message))
                     # به‌روزرسانی وضعیت دستگاه
                     system_state.device_status["pico"]["last_seen"] = datetime.now()
                     logger.debug(f"Message sent to Pico: {message}")
@@ -139,7 +140,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
         if not await authenticate_websocket(websocket, "pico"):
             logger.warning(f"[WebSocket] Pico authentication failed from {websocket.client.host}")
             try:
-                await websocket.send_text(json.dumps({"type": "error", "message": "Authentication failed"}))
+                await websocket.send_text(json_codec.dumps({"type": "error", "message": "Authentication failed"}))
             except Exception:
                 pass
             return
@@ -157,7 +158,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
 
         # Send connection success message
         try:
-            await websocket.send_text(json.dumps({"type": "connection_ack", "status": "success", "message": "Pico connected successfully"}))
+            await websocket.send_text(json_codec.dumps({"type": "connection_ack", "status": "success", "message": "Pico connected successfully"}))
             logger.info(f"[WebSocket] Connection success message sent to Pico")
         except Exception as e:
             logger.warning(f"[WebSocket] Could not send connection success message: {e}")
@@ -223,7 +224,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                             "server_time": current_time.timestamp(),
                             "inactive_duration": int(inactive_duration)
                         }
-                        await websocket.send_text(json.dumps(ping_message))
+                        await websocket.send_text(json_codec.dumps(ping_message))
                         last_ping_time = current_time
                         logger.debug(f"[WebSocket] Smart ping sent to Pico at {current_time} (inactive for {inactive_duration:.0f}s, period #{consecutive_inactive_periods})")
                     else:
@@ -259,7 +260,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                         logger.debug(f"[WebSocket] Pico message #{system_state.message_counter}")
                     
                     try:
-                        message = json.loads(data)
+                        message = json_codec.loads(data)
                         message_type = message.get("type")
                         
                         # Update last seen for any message
@@ -280,7 +281,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                                     "timestamp": datetime.now().isoformat(),
                                     "server_time": datetime.now().timestamp()
                                 }
-                                await websocket.send_text(json.dumps(pong_message))
+                                await websocket.send_text(json_codec.dumps(pong_message))
                                 logger.info(f"[PICO] Ping received, sent pong response")
                             except Exception as e:
                                 if "1000" not in str(e) and "Rapid test" not in str(e):
@@ -292,7 +293,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                             # ارسال تایید اتصال فقط یک بار
                             if not hasattr(system_state, 'pico_connected'):
                                 try:
-                                    await websocket.send_text(json.dumps({
+                                    await websocket.send_text(json_codec.dumps({
                                         "type": "connection_ack",
                                         "status": "success",
                                         "message": "Pico connection acknowledged",
@@ -322,7 +323,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                                     "detail": f"servo1={servo1_target}°, servo2={servo2_target}°",
                                     "timestamp": datetime.now().isoformat()
                                 }
-                                await websocket.send_text(json.dumps(ack_message))
+                                await websocket.send_text(json_codec.dumps(ack_message))
                                 logger.info(f"[PICO] Servo command acknowledged")
                             except Exception as e:
                                 if "1000" not in str(e) and "Rapid test" not in str(e):
@@ -360,7 +361,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                                     "timestamp": datetime.now().isoformat(),
                                     "server_time": datetime.now().timestamp()
                                 }
-                                await websocket.send_text(json.dumps(ack_message))
+                                await websocket.send_text(json_codec.dumps(ack_message))
                                 
                                 # ذخیره داده‌های سنسور در حافظه برای پردازش
                                 if not hasattr(system_state, 'sensor_data_buffer'):
@@ -394,7 +395,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                         else:
                             logger.warning(f"[WebSocket] Unknown message type from Pico: {message}")
                             try:
-                                await websocket.send_text(json.dumps({
+                                await websocket.send_text(json_codec.dumps({
                                     "type": "error", 
                                     "message": "Unknown message type",
                                     "timestamp": datetime.now().isoformat()
@@ -405,7 +406,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                     except json.JSONDecodeError:
                         logger.warning(f"[WebSocket] Invalid JSON from Pico: {data}")
                         try:
-                            await websocket.send_text(json.dumps({
+                            await websocket.send_text(json_codec.dumps({
                                 "type": "error", 
                                 "message": "Invalid JSON format",
                                 "timestamp": datetime.now().isoformat()
@@ -421,7 +422,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
                             "timestamp": datetime.now().isoformat(),
                             "server_time": datetime.now().timestamp()
                         }
-                        await websocket.send_text(json.dumps(ping_message))
+                        await websocket.send_text(json_codec.dumps(ping_message))
                         logger.debug(f"[WebSocket] Timeout ping sent to Pico")
                     except Exception as e:
                         if "1000" not in str(e) and "Rapid test" not in str(e) and "ABNORMAL_CLOSURE" not in str(e):
@@ -433,7 +434,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
             if "1000" not in str(e) and "Rapid test" not in str(e) and "ABNORMAL_CLOSURE" not in str(e):
                 logger.error(f"[WebSocket] Pico error: {e}")
             try:
-                await websocket.send_text(json.dumps({
+                await websocket.send_text(json_codec.dumps({
                     "type": "error", 
                     "message": f"Server error: {str(e)}",
                     "timestamp": datetime.now().isoformat()
@@ -465,7 +466,7 @@ async def pico_websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         logger.error(f"[WebSocket] Fatal error in pico_websocket_endpoint: {e}")
         try:
-            await websocket.send_text(json.dumps({"type": "error", "message": f"Fatal server error: {str(e)}"}))
+            await websocket.send_text(json_codec.dumps({"type": "error", "message": f"Fatal server error: {str(e)}"}))
         except Exception:
             pass
 
@@ -0,0 +1,310 @@
+import asyncio, os, time, logging
+from collections import OrderedDict
+
+# Setup logger for this module
+logger = logging.getLogger("rate_limiter")
+
+# Constants
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "200000"))  # per policy; oldest keys are dropped beyond it
+RATE_LIMIT_SWEEP_BATCH = 16  # expired keys dropped per call, keeps every call O(1) amortized
+RATE_LIMIT_PERSIST = os.getenv("RATE_LIMIT_PERSIST", "false").lower() == "true"
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", "2"))
+
+# name -> limiter, for stats, sweeping and SQLite sync
+LIMITERS = {}
+
+
+class _Policy:
+    """Per-key state in an OrderedDict kept in last-touch order. Every key of a policy has the same idle
+    TTL, so that order is also expiry order: expired keys are always at the front."""
+
+    persist = False
+
+    def __init__(self, name: str, idle_ttl: float, maxsize: int = None):
+        self.name = name
+        self.idle_ttl = idle_ttl
+        self.maxsize = maxsize or RATE_LIMIT_MAX_KEYS
+        self._states = OrderedDict()  # key -> state list; state[0] is the last touch (time.time())
+        self.allowed = 0
+        self.denied = 0
+        self.evictions = 0
+        LIMITERS[name] = self
+
+    def _sweep(self, now: float, limit: int = RATE_LIMIT_SWEEP_BATCH):
+        states = self._states
+        deadline = now - self.idle_ttl
+        while states and limit:
+            key, state = next(iter(states.items()))
+            if state[0] > deadline:
+                break
+            del states[key]
+            limit -= 1
+
+    def _touch(self, key: str, now: float, new_state):
+        """State for key (created with new_state() when missing), moved to the back of the expiry order;
+        the caller stores `now` in state[0] once it has used the previous value"""
+        self._sweep(now)
+        state = self._states.get(key)
+        if state is None:
+            state = new_state()
+            self._states[key] = state
+            if len(self._states) > self.maxsize:
+                self._states.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._states.move_to_end(key)
+        return state
+
+    def sweep(self) -> int:
+        """Drop every expired key (periodic cleanup); returns the number of keys left"""
+        self._sweep(time.time(), limit=len(self._states))
+        return len(self._states)
+
+    def reset(self, key: str):
+        self._states.pop(key, None)
+
+    def __len__(self):
+        return len(self._states)
+
+    def stats(self) -> dict:
+        return {"name": self.name, "policy": type(self).__name__, "keys": len(self._states),
+                "maxsize": self.maxsize, "allowed": self.allowed, "denied": self.denied, "evictions": self.evictions}
+
+
+class TokenBucket(_Policy):
+    """`capacity` requests in a burst, refilled at capacity/period per second (API/general traffic)"""
+
+    def __init__(self, name: str, capacity: int, period: float, maxsize: int = None):
+        self.capacity = float(capacity)
+        self.rate = capacity / period
+        # a bucket idle for `period` is full again, so its state can be forgotten
+        super().__init__(name, idle_ttl=period, maxsize=maxsize)
+
+    def hit(self, key: str, cost: float = 1.0) -> bool:
+        now = time.time()
+        # [last touch, tokens]
+        state = self._touch(key, now, lambda: [now, self.capacity])
+        state[1] = min(self.capacity, state[1] + (now - state[0]) * self.rate)
+        state[0] = now
+        if state[1] >= cost:
+            state[1] -= cost
+            self.allowed += 1
+            return True
+        self.denied += 1
+        return False
+
+    def info(self, key: str) -> tuple:
+        """(limit, remaining, reset epoch) for X-RateLimit-* headers"""
+        state = self._states.get(key)
+        now = time.time()
+        if state is None:
+            return int(self.capacity), int(self.capacity), int(now)
+        tokens = min(self.capacity, state[1] + (now - state[0]) * self.rate)
+        return int(self.capacity), int(tokens), int(now + (self.capacity - tokens) / self.rate)
+
+
+class SlidingWindowCounter(_Policy):
+    """At most `limit` events per `window` seconds, estimated from the current and previous fixed windows
+    (two counters per key instead of a timestamp list). With `block`, reaching the limit bans the key for
+    `block` seconds. Windows are aligned to wall-clock time so workers sharing SQLite agree on them."""
+
+    def __init__(self, name: str, limit: int, window: float, block: float = 0.0, persist: bool = False, maxsize: int = None):
+        self.limit = limit
+        self.window = float(window)
+        self.block = float(block)
+        self.persist = persist and RATE_LIMIT_PERSIST
+        # keys with writes not yet flushed to SQLite: key -> unflushed count in the current window
+        self._pending = {}
+        self._pending_blocks = set()
+        self._pending_resets = set()
+        super().__init__(name, idle_ttl=2 * self.window + self.block, maxsize=maxsize)
+
+    def _new_state(self):
+        # [last touch, window index, count, previous window count, blocked until]
+        return [0.0, 0, 0, 0, 0.0]
+
+    def _roll(self, state, index: int):
+        if state[1] != index:
+            state[3] = state[2] if state[1] == index - 1 else 0
+            state[2] = 0
+            state[1] = index
+
+    def _state(self, key: str, now: float):
+        state = self._touch(key, now, self._new_state)
+        state[0] = now
+        self._roll(state, int(now // self.window))
+        return state
+
+    def _estimate(self, state, now: float) -> float:
+        elapsed = (now % self.window) / self.window
+        return state[3] * (1.0 - elapsed) + state[2]
+
+    def _peek(self, key: str, now: float):
+        state = self._states.get(key)
+        if state is not None:
+            self._roll(state, int(now // self.window))
+        return state
+
+    def count(self, key: str) -> float:
+        now = time.time()
+        state = self._peek(key, now)
+        return self._estimate(state, now) if state is not None else 0.0
+
+    def is_blocked(self, key: str) -> bool:
+        state = self._states.get(key)
+        return state is not None and state[4] > time.time()
+
+    def check(self, key: str) -> bool:
+        """Would one more event be allowed? (does not count)"""
+        now = time.time()
+        state = self._peek(key, now)
+        if state is None:
+            return True
+        if state[4] > now:
+            return False
+        if self._estimate(state, now) >= self.limit:
+            if self.block:
+                state[4] = now + self.block
+                self._mark_block(key)
+            return False
+        return True
+
+    def add(self, key: str, cost: int = 1):
+        """Count an event without checking (e.g. a failed login); blocks the key when it reaches the limit"""
+        now = time.time()
+        state = self._state(key, now)
+        state[2] += cost
+        if self.persist:
+            self._pending[key] = self._pending.get(key, 0) + cost
+        if self.block and self._estimate(state, now) >= self.limit:
+            state[4] = now + self.block
+            self._mark_block(key)
+
+    def hit(self, key: str, cost: int = 1) -> bool:
+        """Check and count in one step; denied events are not counted"""
+        now = time.time()
+        state = self._state(key, now)
+        if state[4] > now or self._estimate(state, now) + cost > self.limit:
+            self.denied += 1
+            return False
+        state[2] += cost
+        if self.persist:
+            self._pending[key] = self._pending.get(key, 0) + cost
+        self.allowed += 1
+        return True
+
+    def reset(self, key: str, unblock: bool = True):
+        state = self._states.get(key)
+        if state is None:
+            return
+        if unblock:
+            del self._states[key]
+        else:
+            state[2] = state[3] = 0
+        if self.persist:
+            self._pending.pop(key, None)
+            self._pending_resets.add((key, unblock))
+
+    def _mark_block(self, key: str):
+        if self.persist:
+            self._pending_blocks.add(key)
+
+    def info(self, key: str) -> tuple:
+        """(limit, remaining, reset epoch) for X-RateLimit-* headers"""
+        now = time.time()
+        state = self._peek(key, now)
+        used = self._estimate(state, now) if state is not None else 0.0
+        reset_at = (int(now // self.window) + 1) * self.window
+        return self.limit, max(int(self.limit - used), 0), int(reset_at)
+
+
+def limiter_stats() -> dict:
+    return {name: limiter.stats() for name, limiter in LIMITERS.items()}
+
+
+def sweep_limiters() -> int:
+    """Full expiry sweep of every policy; returns the number of tracked keys"""
+    return sum(limiter.sweep() for limiter in LIMITERS.values())
+
+
+# ============================================================================
+# SQLITE PERSISTENCE (optional: RATE_LIMIT_PERSIST=true)
+# ============================================================================
+# Counters are stored per fixed window and merged by addition, so several workers writing the same key
+# converge on the global count; every sync also pulls what the other workers wrote since the last one.
+
+async def _flush(conn, limiter: SlidingWindowCounter, now: float):
+    pending, limiter._pending = limiter._pending, {}
+    blocks, limiter._pending_blocks = limiter._pending_blocks, set()
+    resets, limiter._pending_resets = limiter._pending_resets, set()
+    index = int(now // limiter.window)
+    for key, unblock in resets:
+        await conn.execute("DELETE FROM rate_limit_windows WHERE policy = ? AND key = ?", (limiter.name, key))
+        if unblock:
+            await conn.execute("DELETE FROM rate_limit_blocks WHERE policy = ? AND key = ?", (limiter.name, key))
+    if pending:
+        await conn.executemany(
+            """INSERT INTO rate_limit_windows (policy, key, window, count, updated_at) VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(policy, key, window) DO UPDATE SET count = count + excluded.count, updated_at = excluded.updated_at""",
+            [(limiter.name, key, index, count, now) for key, count in pending.items()]
+        )
+    block_rows = [(limiter.name, key, limiter._states[key][4]) for key in blocks if key in limiter._states]
+    if block_rows:
+        await conn.executemany(
+            """INSERT INTO rate_limit_blocks (policy, key, blocked_until) VALUES (?, ?, ?)
+               ON CONFLICT(policy, key) DO UPDATE SET blocked_until = MAX(blocked_until, excluded.blocked_until)""",
+            block_rows
+        )
+    await conn.execute("DELETE FROM rate_limit_windows WHERE policy = ? AND window < ?", (limiter.name, index - 1))
+    await conn.execute("DELETE FROM rate_limit_blocks WHERE policy = ? AND blocked_until < ?", (limiter.name, now))
+
+
+async def _load(conn, limiter: SlidingWindowCounter, now: float, since: float):
+    index = int(now // limiter.window)
+    cursor = await conn.execute(
+        "SELECT key, window, count FROM rate_limit_windows WHERE policy = ? AND window >= ? AND updated_at >= ?",
+        (limiter.name, index - 1, since)
+    )
+    for key, window, count in await cursor.fetchall():
+        state = limiter._state(key, now)
+        # the stored count already includes this worker's flushed events
+        if window == state[1]:
+            state[2] = max(state[2], count + limiter._pending.get(key, 0))
+        elif window == state[1] - 1:
+            state[3] = max(state[3], count)
+    cursor = await conn.execute(
+        "SELECT key, blocked_until FROM rate_limit_blocks WHERE policy = ? AND blocked_until > ?", (limiter.name, now)
+    )
+    for key, blocked_until in await cursor.fetchall():
+        state = limiter._state(key, now)
+        state[4] = max(state[4], blocked_until)
+
+
+async def rate_limit_sync_worker(get_conn, close_conn):
+    """Persist and share SlidingWindowCounter policies created with persist=True"""
+    if not RATE_LIMIT_PERSIST:
+        return
+    persisted = [limiter for limiter in LIMITERS.values() if getattr(limiter, "persist", False)]
+    if not persisted:
+        return
+    last_sync = 0.0  # first pass loads everything still relevant (limits survive restarts)
+    logger.info(f"✅ Rate limit persistence enabled for: {', '.join(limiter.name for limiter in persisted)}")
+    while True:
+        started = time.time()
+        try:
+            conn = await get_conn()
+            try:
+                for limiter in persisted:
+                    await _flush(conn, limiter, started)
+                await conn.commit()
+                for limiter in persisted:
+                    # overlap by one interval so writes committed by other workers mid-sync are not missed
+                    await _load(conn, limiter, started, last_sync - RATE_LIMIT_SYNC_INTERVAL)
+            finally:
+                await close_conn(conn)
+            last_sync = started
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Rate limit sync failed: {e}")
+        await asyncio.sleep(RATE_LIMIT_SYNC_INTERVAL)
@@ -0,0 +1,76 @@
+import hashlib, json, os, logging
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+
+# Import from shared config
+from .config import get_templates, translations
+from .translations_ui import UI_TRANSLATIONS
+from .cache import TTLCache
+from . import assets
+
+# Setup logger for this module
+logger = logging.getLogger("render_cache")
+
+# Constants
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", "3600"))
+TRANSLATIONS_MAX_AGE = int(os.getenv("TRANSLATIONS_MAX_AGE", "300"))
+
+# (template, lang, role, asset version) -> (body bytes, etag)
+render_cache = TTLCache("rendered_pages", maxsize=64, ttl=RENDER_CACHE_TTL)
+# lang -> (json bytes, etag); translations are static for the life of the process
+_translation_payloads = {}
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    return bool(header) and etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def render_page(request: Request, template_name: str, lang: str, role: str = None) -> Response:
+    """Render a page template once per (template, lang, role, asset version) and reuse the bytes.
+
+    The cached templates carry no per-user data: everything user specific is loaded by the page's
+    JavaScript (/api/profile, /get_user_settings), so a cached body is safe to share."""
+    if lang not in translations:
+        lang = "fa"
+    key = (template_name, lang, role, assets.asset_version)
+    cached = render_cache.get(key)
+    if cached is None:
+        template = get_templates().get_template(template_name)
+        body = template.render({"request": request, "translations": translations, "lang": lang, "role": role}).encode("utf-8")
+        cached = (body, _etag(body))
+        render_cache.set(key, cached)
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Cookie"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(content=body, headers=headers)
+
+
+def translation_payload(lang: str) -> tuple:
+    """(serialized JSON, etag) for one language, built on first use"""
+    payload = _translation_payloads.get(lang)
+    if payload is None:
+        data = UI_TRANSLATIONS.get(lang) or translations.get(lang) or UI_TRANSLATIONS["fa"]
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        payload = (body, _etag(body))
+        _translation_payloads[lang] = payload
+    return payload
+
+
+def translations_response(request: Request, lang: str) -> Response:
+    if lang not in UI_TRANSLATIONS and lang not in translations:
+        lang = "fa"
+    body, etag = translation_payload(lang)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={TRANSLATIONS_MAX_AGE}"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def clear_render_cache():
+    render_cache.clear()
@@ -0,0 +1,199 @@
+import asyncio, os, time, logging
+from datetime import datetime, timedelta
+
+# Import from shared config
+from .config import get_jalali_str_before
+from .db import get_db_connection, close_db_connection
+from . import counters
+from .cache import user_csrf_cache, temp_csrf_cache
+from .token import purge_revocations
+
+# Setup logger for this module
+logger = logging.getLogger("retention")
+
+# Constants
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))  # yield to writers between batches
+RETENTION_MAX_BATCHES = int(os.getenv("RETENTION_MAX_BATCHES", "200"))  # per table per run
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600"))
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", "256"))
+VACUUM_MAX_STEPS = int(os.getenv("VACUUM_MAX_STEPS", "100"))
+SESSION_SWEEP_INTERVAL = int(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+
+# Tables whose rows carry an ISO expires_at and are deleted once it has passed
+SESSION_TABLES = ("user_sessions", "temp_csrf_tokens")
+
+# Per-table policies: rows older than `days` are rolled up into hourly_rollups
+# (grouped by the two dimension columns) and then deleted via idx_<table>_created_at.
+RETENTION_POLICIES = {
+    "logs": {"days": int(os.getenv("LOGS_RETENTION_DAYS", "30")), "dims": ("log_type", "threat_level")},
+    "camera_logs": {"days": int(os.getenv("CAMERA_LOGS_RETENTION_DAYS", "30")), "dims": ("log_type", "source")},
+    "servo_commands": {"days": int(os.getenv("COMMANDS_RETENTION_DAYS", "7")), "dims": (None, None)},
+    "action_commands": {"days": int(os.getenv("COMMANDS_RETENTION_DAYS", "7")), "dims": ("action", None)},
+    "rate_limit_logs": {"days": int(os.getenv("RATE_LIMIT_LOGS_RETENTION_DAYS", "7")), "dims": ("endpoint", "blocked")},
+    "security_events": {"days": int(os.getenv("SECURITY_EVENTS_RETENTION_DAYS", "90")), "dims": ("event_type", "severity")},
+}
+
+# آخرین نتیجه اجرا برای مانیتورینگ
+retention_stats = {"last_run": None, "duration": 0.0, "deleted": {}, "vacuumed_pages": 0}
+session_sweep_stats = {"last_run": None, "duration": 0.0, "deleted": {}, "cache_purged": 0, "revocations_purged": 0}
+
+
+def _dim_sql(column) -> str:
+    return f"COALESCE(CAST({column} AS TEXT), '')" if column else "''"
+
+
+async def _purge_table(conn, table: str, policy: dict) -> int:
+    """Roll up and delete expired rows of one table in bounded batches"""
+    if policy["days"] <= 0:
+        return 0
+    cutoff = get_jalali_str_before(timedelta(days=policy["days"]))
+    dim1, dim2 = (_dim_sql(c) for c in policy["dims"])
+    deleted = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        cursor = await conn.execute(
+            f"SELECT id FROM {table} WHERE created_at < ? ORDER BY created_at LIMIT ?",
+            (cutoff, RETENTION_BATCH_SIZE)
+        )
+        ids = [row[0] for row in await cursor.fetchall()]
+        if not ids:
+            break
+        placeholders = ",".join("?" * len(ids))
+        await conn.execute(f"""
+            INSERT INTO hourly_rollups (table_name, hour, dim1, dim2, count)
+            SELECT ?, substr(created_at, 1, 13) || ':00:00', {dim1}, {dim2}, COUNT(*)
+            FROM {table} WHERE id IN ({placeholders})
+            GROUP BY 2, 3, 4
+            ON CONFLICT(table_name, hour, dim1, dim2) DO UPDATE SET count = count + excluded.count
+        """, (table, *ids))
+        await conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+        await conn.commit()
+        deleted += len(ids)
+        if len(ids) < RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    return deleted
+
+
+async def _incremental_vacuum(conn) -> int:
+    """Return free pages to the OS a few pages at a time (needs auto_vacuum=INCREMENTAL)"""
+    cursor = await conn.execute("PRAGMA auto_vacuum")
+    mode = (await cursor.fetchone())[0]
+    if mode != 2:
+        # auto_vacuum روی دیتابیس موجود فقط با یک VACUUM کامل فعال می‌شود
+        logger.debug("auto_vacuum is not INCREMENTAL on this database, skipping incremental_vacuum")
+        return 0
+    freed = 0
+    for _ in range(VACUUM_MAX_STEPS):
+        cursor = await conn.execute("PRAGMA freelist_count")
+        free_pages = (await cursor.fetchone())[0]
+        if free_pages <= 0:
+            break
+        step = min(free_pages, VACUUM_STEP_PAGES)
+        await conn.execute(f"PRAGMA incremental_vacuum({step})")
+        await conn.commit()
+        freed += step
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    return freed
+
+
+async def run_retention() -> dict:
+    """Apply every retention policy once, then vacuum in small steps"""
+    started = time.time()
+    deleted = {}
+    conn = await get_db_connection()
+    try:
+        for table, policy in RETENTION_POLICIES.items():
+            try:
+                deleted[table] = await _purge_table(conn, table, policy)
+            except Exception as e:
+                logger.error(f"Retention error on {table}: {e}")
+                deleted[table] = 0
+        vacuumed = await _incremental_vacuum(conn)
+        # حذف‌ها از طریق trigger در stat_counters ثبت شده‌اند؛ آینه حافظه را همگام کن
+        await counters.refresh_counters(conn)
+    finally:
+        await close_db_connection(conn)
+
+    retention_stats.update({
+        "last_run": started,
+        "duration": round(time.time() - started, 3),
+        "deleted": deleted,
+        "vacuumed_pages": vacuumed,
+    })
+    total = sum(deleted.values())
+    if total or vacuumed:
+        logger.info(f"✅ Retention removed {total} rows {deleted}, vacuumed {vacuumed} pages")
+    return retention_stats
+
+
+async def periodic_retention():
+    """Run the retention engine every RETENTION_INTERVAL seconds until cancelled"""
+    while True:
+        try:
+            await run_retention()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Retention run failed: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+async def _sweep_expired_rows(conn, table: str) -> int:
+    """Delete rows past expires_at in bounded batches (via idx_<table>_expires_at)"""
+    now = datetime.now().isoformat()
+    deleted = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        cursor = await conn.execute(
+            f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE expires_at < ? LIMIT ?)",
+            (now, RETENTION_BATCH_SIZE)
+        )
+        await conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    return deleted
+
+
+async def sweep_expired_sessions() -> dict:
+    """Remove expired sessions and CSRF tokens from SQLite and from the in-memory CSRF caches, and drop token
+    revocations that outlived their tokens"""
+    started = time.time()
+    deleted = {}
+    conn = await get_db_connection()
+    try:
+        for table in SESSION_TABLES:
+            try:
+                deleted[table] = await _sweep_expired_rows(conn, table)
+            except Exception as e:
+                logger.error(f"Session sweep error on {table}: {e}")
+                deleted[table] = 0
+    finally:
+        await close_db_connection(conn)
+    purged = user_csrf_cache.purge_expired() + temp_csrf_cache.purge_expired()
+    revocations = purge_revocations()
+
+    session_sweep_stats.update({
+        "last_run": started,
+        "duration": round(time.time() - started, 3),
+        "deleted": deleted,
+        "cache_purged": purged,
+        "revocations_purged": revocations,
+    })
+    total = sum(deleted.values())
+    if total or purged:
+        logger.info(f"✅ Session sweep removed {total} rows {deleted}, {purged} cached tokens")
+    return session_sweep_stats
+
+
+async def periodic_session_sweep():
+    """Sweep expired sessions/CSRF tokens every SESSION_SWEEP_INTERVAL seconds until cancelled"""
+    while True:
+        try:
+            await sweep_expired_sessions()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Session sweep failed: {e}")
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
@@ -144,38 +144,150 @@ def validate_filename_safe(filename: str) -> bool:
     except Exception as e:
         raise ValueError('Invalid filename')
 
+try:
+    from re import _parser as _sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse as _sre_parse
+
+_MAX_REPEATS = (_sre_parse.MAX_REPEAT, _sre_parse.MIN_REPEAT) + (
+    (_sre_parse.POSSESSIVE_REPEAT,) if hasattr(_sre_parse, 'POSSESSIVE_REPEAT') else ())
+
+
+def _sequence_requirements(items) -> list:
+    """Literal requirements of a parsed pattern sequence: a list of sets of lowercase strings, a match is only
+    possible when every set has at least one member in the lowercased input"""
+    requirements, run = [], ''
+
+    def flush():
+        nonlocal run
+        if run:
+            requirements.append(frozenset((run,)))
+        run = ''
+
+    for op, av in items:
+        if op is _sre_parse.LITERAL:
+            run += chr(av).lower()
+            continue
+        flush()
+        if op is _sre_parse.IN:
+            if all(item_op is _sre_parse.LITERAL for item_op, _ in av):
+                requirements.append(frozenset(chr(c).lower() for _, c in av))
+        elif op is _sre_parse.SUBPATTERN:
+            requirements.extend(_sequence_requirements(av[-1]))
+        elif op in _MAX_REPEATS and av[0] >= 1:
+            requirements.extend(_sequence_requirements(av[2]))
+        elif op is _sre_parse.BRANCH:
+            # each alternative contributes its longest literal; one alternative without any makes it optional
+            alternatives = set()
+            for branch in av[1]:
+                single = [next(iter(r)) for r in _sequence_requirements(branch) if len(r) == 1]
+                if not single:
+                    alternatives = None
+                    break
+                alternatives.add(max(single, key=len))
+            if alternatives:
+                requirements.append(frozenset(alternatives))
+    flush()
+    return requirements
+
+
+def _literal_requirements(pattern: str) -> list:
+    try:
+        return _sequence_requirements(_sre_parse.parse(pattern))
+    except Exception:
+        return []  # no pre-check, the regex always runs
+
+
+def _satisfied(requirements: list, folded: str) -> bool:
+    for alternatives in requirements:
+        for literal in alternatives:
+            if literal in folded:
+                break
+        else:
+            return False
+    return True
+
+
+def _folded(input_str: str):
+    """Lowercased input for the literal pre-checks, or None when re.IGNORECASE could match differently
+    (cased non-ASCII letters such as 'ſ' or the Kelvin sign fold onto ASCII letters)"""
+    if input_str.isascii() or all(c.isascii() or c.lower() == c.upper() for c in input_str):
+        return input_str.lower()
+    return None
+
+
+class _PatternStage:
+    """Patterns applied in order (later patterns see earlier replacements, as before), each compiled once with
+    the literals it cannot match without, so most patterns are ruled out by substring checks on clean input"""
+
+    def __init__(self, name: str, patterns: list, flags=re.IGNORECASE, dotall: tuple = ()):
+        self.name = name
+        self.patterns = [
+            (pattern, re.compile(pattern, flags | (re.DOTALL if pattern in dotall else 0)), _literal_requirements(pattern))
+            for pattern in patterns
+        ]
+
+    def scan(self, input_str: str, replacement: str, on_match=None) -> str:
+        """Replace the matches of every pattern in order, calling on_match(pattern) first for each one found"""
+        folded = _folded(input_str)
+        for pattern, regex, requirements in self.patterns:
+            if folded is not None and not _satisfied(requirements, folded):
+                continue
+            result, count = regex.subn(replacement, input_str)
+            if count:
+                if on_match is not None:
+                    on_match(pattern)
+                input_str = result
+                folded = _folded(input_str)
+        return input_str
+
+    def sub(self, input_str: str, replacement: str) -> str:
+        return self.scan(input_str, replacement)
+
+    def first_match(self, input_str: str):
+        """First pattern (in order) found in input_str, or None"""
+        folded = _folded(input_str)
+        for pattern, regex, requirements in self.patterns:
+            if (folded is None or _satisfied(requirements, folded)) and regex.search(input_str):
+                return pattern
+        return None
+
+
+# Patterns for sensitive information (remove entire key-value pair)
+_SENSITIVE_STAGE = _PatternStage("sensitive", [
+    r'password\s*=\s*[^\s,;]+',
+    r'secret\s*=\s*[^\s,;]+',
+    r'key\s*=\s*[^\s,;]+',
+    r'token\s*=\s*[^\s,;]+',
+    r'api_key\s*=\s*[^\s,;]+',
+    r'access_token\s*=\s*[^\s,;]+',
+    r'private_key\s*=\s*[^\s,;]+',
+    r'secret_key\s*=\s*[^\s,;]+',
+    r'password\s*:\s*[^\s,;]+',
+    r'secret\s*:\s*[^\s,;]+',
+    r'key\s*:\s*[^\s,;]+',
+    r'token\s*:\s*[^\s,;]+',
+    r'password=[^\s,;]+',
+    r'secret=[^\s,;]+',
+    r'key=[^\s,;]+',
+    r'token=[^\s,;]+',
+])
+_MULTI_SPACE_RE = re.compile(r'\s{2,}')
+_DOUBLE_COMMA_RE = re.compile(r',\s*,')
+_DOUBLE_COLON_RE = re.compile(r':\s*:')
+
+
 def sanitize_sensitive_info(input_str: str) -> str:
     """Sanitize sensitive information from input strings"""
     if not input_str:
         return input_str
     
-    # Patterns for sensitive information (remove entire key-value pair)
-    sensitive_patterns = [
-        r'password\s*=\s*[^\s,;]+',
-        r'secret\s*=\s*[^\s,;]+',
-        r'key\s*=\s*[^\s,;]+',
-        r'token\s*=\s*[^\s,;]+',
-        r'api_key\s*=\s*[^\s,;]+',
-        r'access_token\s*=\s*[^\s,;]+',
-        r'private_key\s*=\s*[^\s,;]+',
-        r'secret_key\s*=\s*[^\s,;]+',
-        r'password\s*:\s*[^\s,;]+',
-        r'secret\s*:\s*[^\s,;]+',
-        r'key\s*:\s*[^\s,;]+',
-        r'token\s*:\s*[^\s,;]+',
-        r'password=[^\s,;]+',
-        r'secret=[^\s,;]+',
-        r'key=[^\s,;]+',
-        r'token=[^\s,;]+',
-    ]
-    
-    for pattern in sensitive_patterns:
-        input_str = re.sub(pattern, '', input_str, flags=re.IGNORECASE)
+    input_str = _SENSITIVE_STAGE.sub(input_str, '')
     
     # Remove leftover double spaces, commas, or colons
-    input_str = re.sub(r'\s{2,}', ' ', input_str)
-    input_str = re.sub(r',\s*,', ',', input_str)
-    input_str = re.sub(r':\s*:', ':', input_str)
+    input_str = _MULTI_SPACE_RE.sub(' ', input_str)
+    input_str = _DOUBLE_COMMA_RE.sub(',', input_str)
+    input_str = _DOUBLE_COLON_RE.sub(':', input_str)
     input_str = input_str.strip(' ,:;')
     return input_str
 
@@ -213,199 +325,215 @@ def is_test_environment() -> bool:
     """Check if running in test environment"""
     return TEST_MODE or os.getenv("ENVIRONMENT") == "test" or os.getenv("ENVIRONMENT") == "development"
 
+# Enhanced security patterns for all content types (one stage per category, compiled once)
+_SECURITY_STAGES = [
+    _PatternStage('sql_injection', [
+        r'\b(union|select|insert|update|delete|drop|create|alter|exec|execute|xp_|sp_)\b',
+        r'(--|#|/\*|\*/)',
+        r'\b(and|or)\b\s+\d+\s*[=<>]',
+        r'\b(union|select)\b.*\bfrom\b',
+        r'\bwaitfor\b\s+delay',
+        r'\bchar\b\s*\(\s*\d+\s*\)',
+        r'\bcast\b|\bconvert\b',
+        r'\b@@version\b|\b@@servername\b|\b@@hostname\b',
+        r'\bopenrowset\b|\bopendatasource\b',
+        r'\binformation_schema\b',
+        r'\bsys\.tables\b|\bsys\.columns\b',
+        r'\bbackup\b|\brestore\b',
+        r'\btruncate\b|\bdelete\b\s+from'
+    ]),
+    _PatternStage('xss', [
+        r'<script[^>]*>.*?</script>',
+        r'<iframe[^>]*>.*?</iframe>',
+        r'<object[^>]*>.*?</object>',
+        r'<embed[^>]*>.*?</embed>',
+        r'<form[^>]*>.*?</form>',
+        r'<input[^>]*>',
+        r'<textarea[^>]*>.*?</textarea>',
+        r'<select[^>]*>.*?</select>',
+        r'<button[^>]*>.*?</button>',
+        r'<link[^>]*>',
+        r'<meta[^>]*>',
+        r'<style[^>]*>.*?</style>',
+        r'<link[^>]*>',
+        r'javascript:', r'vbscript:', r'data:', r'about:',
+        r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:',
+        r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a',
+        r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a',
+        r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',
+        r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',
+        r'on\w+\s*=',  # Event handlers
+        r'expression\s*\(',  # CSS expressions
+        r'url\s*\(\s*javascript:',  # CSS javascript URLs
+    ]),
+    _PatternStage('command_injection', [
+        r'[;&|`]\s*[a-zA-Z]',
+        r'\$\s*\([^)]*\)',
+        r'`[^`]*`',
+        r'rm\s+-rf',
+        r'format\s+[a-zA-Z]:',
+        r'fdisk\s+[a-zA-Z]:',
+        r'wget\s+http',
+        r'curl\s+http',
+        r'nc\s+-l',
+        r'bash\s+-i',
+        r'powershell\s+-c',
+        r'python\s+-c',
+        r'perl\s+-e',
+        r'exec\s*\(',
+        r'system\s*\(',
+        r'shell_exec\s*\(',
+    ]),
+    _PatternStage('path_traversal', [
+        r'\.\./',
+        r'\.\.\\',
+        r'\.\.%2f',
+        r'\.\.%5c',
+        r'\.\.%252f',
+        r'\.\.%255c',
+        r'\.\.%c0%af',
+        r'\.\.%c1%9c',
+        r'/etc/passwd',
+        r'/etc/shadow',
+        r'C:\\windows\\system32',
+        r'C:\\windows\\syswow64',
+    ]),
+]
+
+# Content-type specific pattern sets from SECURITY_CONFIG (input is rejected on any match)
+_CONTENT_TYPE_STAGES = {
+    content_type: _PatternStage(name.lower(), SECURITY_CONFIG.get(name, []))
+    for name, content_types in (
+        ('SQL_INJECTION_PATTERNS', ('sql', 'query', 'database')),
+        ('COMMAND_INJECTION_PATTERNS', ('command', 'shell', 'exec', 'system')),
+        ('PATH_TRAVERSAL_PATTERNS', ('file', 'path', 'filename')),
+    )
+    if SECURITY_CONFIG.get(name)
+    for content_type in content_types
+}
+_CONTENT_TYPE_LABELS = {
+    'sql_injection_patterns': 'SQL injection',
+    'command_injection_patterns': 'Command injection',
+    'path_traversal_patterns': 'Path traversal',
+}
+
+# Enhanced JavaScript protocol filtering for text content
+_TEXT_PROTOCOL_STAGE = _PatternStage('text_protocol', [
+    r'javascript:', r'vbscript:', r'data:', r'vbscript:', r'about:',
+    r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:',
+    r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a',
+    r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a',
+    r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded javascript:
+    r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded vbscript:
+])
+
+# Command injection patterns
+_TEXT_COMMAND_STAGE = _PatternStage('text_command', [
+    r'[;&|`]\s*[a-zA-Z]',  # Command separators followed by commands
+    r'\$\s*\([^)]*\)',     # Command substitution
+    r'`[^`]*`',            # Backtick command substitution
+    r'rm\s+-rf',           # Dangerous rm command
+    r'format\s+[a-zA-Z]:', # Format command
+    r'fdisk\s+[a-zA-Z]:',  # Fdisk command
+    r'wget\s+http',        # Wget with URL
+    r'curl\s+http',        # Curl with URL
+    r'nc\s+-l',            # Netcat listener
+    r'bash\s+-i',          # Interactive bash
+    r'powershell\s+-c',    # PowerShell command
+    r'python\s+-c',        # Python command execution
+    r'perl\s+-e',          # Perl command execution
+])
+
+# SQL injection patterns for text content
+_TEXT_SQL_STAGE = _PatternStage('text_sql', [
+    r'\b(union|select|insert|update|delete|drop|create|alter|exec|execute)\b',
+    r'(--|#|/\*|\*/)',
+    r'\b(and|or)\b\s+\d+\s*[=<>]',
+    r'\b(union|select)\b.*\bfrom\b',
+    r'\bxp_cmdshell\b|\bsp_executesql\b',
+    r'\bwaitfor\b\s+delay',
+    r'\bchar\b\s*\(\s*\d+\s*\)',
+    r'\bcast\b|\bconvert\b',
+    r'\b@@version\b|\b@@servername\b|\b@@hostname\b',
+    r'\bopenrowset\b|\bopendatasource\b',
+    r'\binformation_schema\b',
+    r'\bsys\.tables\b|\bsys\.columns\b',
+    r'\bxp_|sp_',
+    r'\bbackup\b|\brestore\b',
+    r'\btruncate\b|\bdelete\b\s+from'
+])
+
+# Fast path: words separated by single spaces (OTP codes, phone numbers, usernames, Persian names) contain
+# no markup, separators or control characters, so only patterns made of word literals can touch them
+_PLAIN_TEXT_RE = re.compile(r'\w+(?: \w+)*')
+_WORD_LITERAL_RE = re.compile(r'[\w ]+')
+# Control characters except newlines and tabs
+_CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _detect_and_replace(stage: _PatternStage, input_str: str, label: str, replacement: str,
+                        raise_on_detection: bool = False) -> str:
+    """Check each pattern of the stage in order and replace its matches"""
+    def on_match(pattern):
+        logger.warning(label.format(pattern=pattern))
+        if raise_on_detection:
+            raise HTTPException(status_code=400, detail=f"ورودی نامعتبر: {stage.name.upper()} pattern detected")
+
+    # Replace with safe placeholder
+    return stage.scan(input_str, replacement, on_match)
+
+
 def sanitize_input(input_str: str, content_type: str = 'text', raise_on_detection: bool = False) -> str:
     """Enhanced input sanitization with comprehensive security protection"""
     if not input_str:
         return input_str
-    
+
     # Convert to string if needed
     input_str = str(input_str)
-    
+
     # Skip sanitization for test environment
     if is_test_environment():
         return input_str
-    
+
+    use_bleach = BLEACH_AVAILABLE and content_type in BLEACH_CONFIG
+
+    # Plain words pass every stage unchanged unless they contain a SQL keyword or similar
+    if not use_bleach and _PLAIN_TEXT_RE.fullmatch(input_str):
+        folded = _folded(input_str)
+        if folded is not None and not any(_satisfied(requirements, folded) for requirements in _PLAIN_TEXT_REQUIREMENTS):
+            return input_str[:1000]  # Limit length
+
     # Remove null bytes and control characters
-    input_str = input_str.replace('\x00', '')
-    input_str = ''.join(char for char in input_str if ord(char) >= 32 or char in '\n\t\r')
-    
+    input_str = _CONTROL_CHARS_RE.sub('', input_str)
+
     # Sanitize sensitive information
     input_str = sanitize_sensitive_info(input_str)
-    
-    # Enhanced security patterns for all content types
-    security_patterns = {
-        'sql_injection': [
-            r'\b(union|select|insert|update|delete|drop|create|alter|exec|execute|xp_|sp_)\b',
-            r'(--|#|/\*|\*/)',
-            r'\b(and|or)\b\s+\d+\s*[=<>]',
-            r'\b(union|select)\b.*\bfrom\b',
-            r'\bwaitfor\b\s+delay',
-            r'\bchar\b\s*\(\s*\d+\s*\)',
-            r'\bcast\b|\bconvert\b',
-            r'\b@@version\b|\b@@servername\b|\b@@hostname\b',
-            r'\bopenrowset\b|\bopendatasource\b',
-            r'\binformation_schema\b',
-            r'\bsys\.tables\b|\bsys\.columns\b',
-            r'\bbackup\b|\brestore\b',
-            r'\btruncate\b|\bdelete\b\s+from'
-        ],
-        'xss': [
-            r'<script[^>]*>.*?</script>',
-            r'<iframe[^>]*>.*?</iframe>',
-            r'<object[^>]*>.*?</object>',
-            r'<embed[^>]*>.*?</embed>',
-            r'<form[^>]*>.*?</form>',
-            r'<input[^>]*>',
-            r'<textarea[^>]*>.*?</textarea>',
-            r'<select[^>]*>.*?</select>',
-            r'<button[^>]*>.*?</button>',
-            r'<link[^>]*>',
-            r'<meta[^>]*>',
-            r'<style[^>]*>.*?</style>',
-            r'<link[^>]*>',
-            r'javascript:', r'vbscript:', r'data:', r'about:',
-            r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:',
-            r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a',
-            r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a',
-            r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',
-            r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',
-            r'on\w+\s*=',  # Event handlers
-            r'expression\s*\(',  # CSS expressions
-            r'url\s*\(\s*javascript:',  # CSS javascript URLs
-        ],
-        'command_injection': [
-            r'[;&|`]\s*[a-zA-Z]',
-            r'\$\s*\([^)]*\)',
-            r'`[^`]*`',
-            r'rm\s+-rf',
-            r'format\s+[a-zA-Z]:',
-            r'fdisk\s+[a-zA-Z]:',
-            r'wget\s+http',
-            r'curl\s+http',
-            r'nc\s+-l',
-            r'bash\s+-i',
-            r'powershell\s+-c',
-            r'python\s+-c',
-            r'perl\s+-e',
-            r'exec\s*\(',
-            r'system\s*\(',
-            r'shell_exec\s*\(',
-        ],
-        'path_traversal': [
-            r'\.\./',
-            r'\.\.\\',
-            r'\.\.%2f',
-            r'\.\.%5c',
-            r'\.\.%252f',
-            r'\.\.%255c',
-            r'\.\.%c0%af',
-            r'\.\.%c1%9c',
-            r'/etc/passwd',
-            r'/etc/shadow',
-            r'C:\\windows\\system32',
-            r'C:\\windows\\syswow64',
-        ]
-    }
-    
+
     # Check all security patterns
-    for pattern_type, patterns in security_patterns.items():
-        for pattern in patterns:
-            if re.search(pattern, input_str, re.IGNORECASE):
-                logger.warning(f"{pattern_type.upper()} pattern detected: {pattern}")
-                if raise_on_detection:
-                    raise HTTPException(status_code=400, detail=f"ورودی نامعتبر: {pattern_type.upper()} pattern detected")
-                # Replace with safe placeholder
-                input_str = re.sub(pattern, f'[{pattern_type.upper()}_BLOCKED]', input_str, flags=re.IGNORECASE)
-    
-    # Check for SQL injection patterns (only for database-related inputs)
-    if content_type in ['sql', 'query', 'database']:
-        for pattern in SECURITY_CONFIG['SQL_INJECTION_PATTERNS']:
-            if re.search(pattern, input_str, re.IGNORECASE):
-                logger.warning(f"SQL injection pattern detected: {pattern}")
-                return ''
-    
-    # Check for command injection patterns (only for command-related inputs)
-    if content_type in ['command', 'shell', 'exec', 'system']:
-        for pattern in SECURITY_CONFIG['COMMAND_INJECTION_PATTERNS']:
-            if re.search(pattern, input_str, re.IGNORECASE):
-                logger.warning(f"Command injection pattern detected: {pattern}")
-                return ''
-    
-    # Check for path traversal patterns (only for file-related inputs)
-    if content_type in ['file', 'path', 'filename']:
-        for pattern in SECURITY_CONFIG['PATH_TRAVERSAL_PATTERNS']:
-            if re.search(pattern, input_str, re.IGNORECASE):
-                logger.warning(f"Path traversal pattern detected: {pattern}")
-                return ''
-    
+    for stage in _SECURITY_STAGES:
+        input_str = _detect_and_replace(stage, input_str, stage.name.upper() + " pattern detected: {pattern}",
+                                        f'[{stage.name.upper()}_BLOCKED]', raise_on_detection)
+
+    # Check for SQL injection / command injection / path traversal patterns (only for related inputs)
+    stage = _CONTENT_TYPE_STAGES.get(content_type)
+    pattern = stage.first_match(input_str) if stage is not None else None
+    if pattern is not None:
+        logger.warning(f"{_CONTENT_TYPE_LABELS[stage.name]} pattern detected: {pattern}")
+        return ''
+
     # For text content, check for dangerous patterns that could be used in any context
     if content_type == 'text':
-        # Enhanced JavaScript protocol filtering
-        javascript_protocols = [
-            r'javascript:', r'vbscript:', r'data:', r'vbscript:', r'about:',
-            r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:',
-            r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a',
-            r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a',
-            r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded javascript:
-            r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded vbscript:
-        ]
-        
         # Remove JavaScript protocols first
-        for protocol in javascript_protocols:
-            input_str = re.sub(protocol, '[PROTOCOL_BLOCKED]:', input_str, flags=re.IGNORECASE)
-        
-        # Command injection patterns
-        dangerous_command_patterns = [
-            r'[;&|`]\s*[a-zA-Z]',  # Command separators followed by commands
-            r'\$\s*\([^)]*\)',     # Command substitution
-            r'`[^`]*`',            # Backtick command substitution
-            r'rm\s+-rf',           # Dangerous rm command
-            r'format\s+[a-zA-Z]:', # Format command
-            r'fdisk\s+[a-zA-Z]:',  # Fdisk command
-            r'wget\s+http',        # Wget with URL
-            r'curl\s+http',        # Curl with URL
-            r'nc\s+-l',            # Netcat listener
-            r'bash\s+-i',          # Interactive bash
-            r'powershell\s+-c',    # PowerShell command
-            r'python\s+-c',        # Python command execution
-            r'perl\s+-e',          # Perl command execution
-        ]
-        
-        # SQL injection patterns for text content
-        dangerous_sql_patterns = [
-            r'\b(union|select|insert|update|delete|drop|create|alter|exec|execute)\b',
-            r'(--|#|/\*|\*/)',
-            r'\b(and|or)\b\s+\d+\s*[=<>]',
-            r'\b(union|select)\b.*\bfrom\b',
-            r'\bxp_cmdshell\b|\bsp_executesql\b',
-            r'\bwaitfor\b\s+delay',
-            r'\bchar\b\s*\(\s*\d+\s*\)',
-            r'\bcast\b|\bconvert\b',
-            r'\b@@version\b|\b@@servername\b|\b@@hostname\b',
-            r'\bopenrowset\b|\bopendatasource\b',
-            r'\binformation_schema\b',
-            r'\bsys\.tables\b|\bsys\.columns\b',
-            r'\bxp_|sp_',
-            r'\bbackup\b|\brestore\b',
-            r'\btruncate\b|\bdelete\b\s+from'
-        ]
-        
+        input_str = _TEXT_PROTOCOL_STAGE.sub(input_str, '[PROTOCOL_BLOCKED]:')
         # Check for dangerous command patterns
-        for pattern in dangerous_command_patterns:
-            if re.search(pattern, input_str, re.IGNORECASE):
-                logger.warning(f"Dangerous command pattern detected in text: {pattern}")
-                # Replace dangerous patterns with safe alternatives
-                input_str = re.sub(pattern, '[COMMAND_BLOCKED]', input_str, flags=re.IGNORECASE)
-        
+        input_str = _detect_and_replace(_TEXT_COMMAND_STAGE, input_str,
+                                        "Dangerous command pattern detected in text: {pattern}", '[COMMAND_BLOCKED]')
         # Check for dangerous SQL patterns
-        for pattern in dangerous_sql_patterns:
-            if re.search(pattern, input_str, re.IGNORECASE):
-                logger.warning(f"Dangerous SQL pattern detected in text: {pattern}")
-                # Replace dangerous patterns with safe alternatives
-                input_str = re.sub(pattern, '[SQL_BLOCKED]', input_str, flags=re.IGNORECASE)
-    
+        input_str = _detect_and_replace(_TEXT_SQL_STAGE, input_str,
+                                        "Dangerous SQL pattern detected in text: {pattern}", '[SQL_BLOCKED]')
+
     # Use Bleach for HTML sanitization if available
-    if BLEACH_AVAILABLE and content_type in BLEACH_CONFIG:
+    if use_bleach:
         config = BLEACH_CONFIG[content_type]
         
         try:
@@ -429,7 +557,7 @@ def sanitize_input(input_str: str, content_type: str = 'text', raise_on_detectio
             cleaned = unicodedata.normalize('NFKC', cleaned)
             
             # Remove control characters except newlines and tabs
-            cleaned = ''.join(char for char in cleaned if ord(char) >= 32 or char in '\n\t\r')
+            cleaned = _CONTROL_CHARS_RE.sub('', cleaned)
             
             return cleaned.strip()[:1000]  # Limit length
             
@@ -442,89 +570,104 @@ def sanitize_input(input_str: str, content_type: str = 'text', raise_on_detectio
         return basic_sanitize_input(input_str)
 
 
+# HTML entity encoding for dangerous characters (applied in this order, '&' after the first four)
+_BASIC_ENTITIES = (
+    ('<', '&lt;'),
+    ('>', '&gt;'),
+    ('"', '&quot;'),
+    ("'", '&#x27;'),
+    ('&', '&amp;'),
+    ('(', '&#x28;'),
+    (')', '&#x29;'),
+    (';', '&#x3B;'),
+    ('+', '&#x2B;'),
+)
+
+# Enhanced JavaScript protocol filtering
+_BASIC_PROTOCOL_STAGE = _PatternStage('basic_protocol', [
+    r'javascript:', r'vbscript:', r'data:', r'about:', r'chrome:', r'chrome-extension:',
+    r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:', r'chrome\s*:', r'chrome-extension\s*:',
+    r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a', r'chrome%3a', r'chrome-extension%3a',
+    r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a', r'chrome%253a', r'chrome-extension%253a',
+    r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded javascript:
+    r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded vbscript:
+    r'&#100;&#97;&#116;&#97;&#58;',  # URL encoded data:
+])
+
+# Script-like content, path traversal, javascript: URLs and dangerous tags, all removed
+_BASIC_REMOVAL_STAGE = _PatternStage('basic_removal', [
+    # Remove any remaining script-like content
+    r'<script[^>]*>.*?</script>',
+    r'on\w+\s*=',
+    # Remove path traversal patterns
+    r'\.\./',
+    r'\.\.\\',
+    r'%2e%2e%2f',
+    r'%2e%2e%5c',
+    # Remove javascript: URLs more aggressively
+    r'javascript:[^;\s]*',
+    r'vbscript:[^;\s]*',
+    r'data:text/html[^;\s]*',
+    r'data:application/x-javascript[^;\s]*',
+    # Remove path traversal patterns more aggressively
+    r'\.\./',
+    r'\.\.\\',
+    r'%2e%2e%2f',
+    r'%2e%2e%5c',
+    r'%252e%252e%252f',
+    r'%252e%252e%255c',
+    # Additional dangerous patterns
+    r'data:text/html',
+    r'data:application/x-javascript',
+    r'data:application/ecmascript',
+    r'data:application/javascript',
+    r'<iframe[^>]*>',
+    r'<object[^>]*>',
+    r'<embed[^>]*>',
+    r'<form[^>]*>',
+    r'<input[^>]*>',
+    r'<textarea[^>]*>',
+    r'<select[^>]*>',
+    r'<link[^>]*>',
+    r'<meta[^>]*>',
+    r'<style[^>]*>',
+    r'<body[^>]*>',
+    r'<xmp[^>]*>',
+    r'<plaintext[^>]*>'
+], dotall=(r'<script[^>]*>.*?</script>',))
+
+
+def _plain_text_requirements(stages) -> list:
+    """Requirements of the patterns that can match plain text, keeping only word literals (others never occur)"""
+    plain = []
+    for stage in stages:
+        for _, _, requirements in stage.patterns:
+            word_requirements = [frozenset(l for l in alternatives if _WORD_LITERAL_RE.fullmatch(l))
+                                 for alternatives in requirements]
+            if all(word_requirements):
+                plain.append(word_requirements)
+    return plain
+
+
+_PLAIN_TEXT_REQUIREMENTS = _plain_text_requirements([
+    _SENSITIVE_STAGE, *_SECURITY_STAGES, *_CONTENT_TYPE_STAGES.values(),
+    _TEXT_PROTOCOL_STAGE, _TEXT_COMMAND_STAGE, _TEXT_SQL_STAGE, _BASIC_PROTOCOL_STAGE, _BASIC_REMOVAL_STAGE,
+])
+
+
 def basic_sanitize_input(input_str: str) -> str:
     """Basic sanitization fallback when Bleach is not available"""
     if not input_str:
         return input_str
     
-    # HTML entity encoding for dangerous characters
-    dangerous_chars = {
-        '<': '&lt;',
-        '>': '&gt;',
-        '"': '&quot;',
-        "'": '&#x27;',
-        '&': '&amp;',
-        '(': '&#x28;',
-        ')': '&#x29;',
-        ';': '&#x3B;',
-        '+': '&#x2B;'
-    }
-    
-    for char, entity in dangerous_chars.items():
-        input_str = input_str.replace(char, entity)
-    
-    # Enhanced JavaScript protocol filtering
-    javascript_protocols = [
-        r'javascript:', r'vbscript:', r'data:', r'about:', r'chrome:', r'chrome-extension:',
-        r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:', r'chrome\s*:', r'chrome-extension\s*:',
-        r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a', r'chrome%3a', r'chrome-extension%3a',
-        r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a', r'chrome%253a', r'chrome-extension%253a',
-        r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded javascript:
-        r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded vbscript:
-        r'&#100;&#97;&#116;&#97;&#58;',  # URL encoded data:
-    ]
+    for char, entity in _BASIC_ENTITIES:
+        if char in input_str:
+            input_str = input_str.replace(char, entity)
     
     # Remove JavaScript protocols first
-    for protocol in javascript_protocols:
-        input_str = re.sub(protocol, '[PROTOCOL_BLOCKED]:', input_str, flags=re.IGNORECASE)
+    input_str = _BASIC_PROTOCOL_STAGE.sub(input_str, '[PROTOCOL_BLOCKED]:')
     
-    # Remove any remaining script-like content
-    input_str = re.sub(r'<script[^>]*>.*?</script>', '', input_str, flags=re.IGNORECASE | re.DOTALL)
-    input_str = re.sub(r'on\w+\s*=', '', input_str, flags=re.IGNORECASE)
-    
-    # Remove path traversal patterns
-    input_str = re.sub(r'\.\./', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'\.\.\\', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'%2e%2e%2f', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'%2e%2e%5c', '', input_str, flags=re.IGNORECASE)
-    
-    # Remove javascript: URLs more aggressively
-    input_str = re.sub(r'javascript:[^;\s]*', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'vbscript:[^;\s]*', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'data:text/html[^;\s]*', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'data:application/x-javascript[^;\s]*', '', input_str, flags=re.IGNORECASE)
-    
-    # Remove path traversal patterns more aggressively
-    input_str = re.sub(r'\.\./', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'\.\.\\', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'%2e%2e%2f', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'%2e%2e%5c', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'%252e%252e%252f', '', input_str, flags=re.IGNORECASE)
-    input_str = re.sub(r'%252e%252e%255c', '', input_str, flags=re.IGNORECASE)
-    
-    # Additional dangerous patterns
-    dangerous_patterns = [
-        r'data:text/html',
-        r'data:application/x-javascript',
-        r'data:application/ecmascript',
-        r'data:application/javascript',
-        r'<iframe[^>]*>',
-        r'<object[^>]*>',
-        r'<embed[^>]*>',
-        r'<form[^>]*>',
-        r'<input[^>]*>',
-        r'<textarea[^>]*>',
-        r'<select[^>]*>',
-        r'<link[^>]*>',
-        r'<meta[^>]*>',
-        r'<style[^>]*>',
-        r'<body[^>]*>',
-        r'<xmp[^>]*>',
-        r'<plaintext[^>]*>'
-    ]
-    
-    for pattern in dangerous_patterns:
-        input_str = re.sub(pattern, '', input_str, flags=re.IGNORECASE)
+    input_str = _BASIC_REMOVAL_STAGE.sub(input_str, '')
     
     return input_str.strip()[:1000]  # Limit length
 
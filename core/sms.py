@@ -2,7 +2,7 @@ import asyncio, time, os, sys, gc, psutil, logging, requests, json
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 import jdatetime
-from .melipayamak import Api
+from .sms_gateway import get_sms_dispatcher
 
 # Setup logger for this module
 logger = logging.getLogger("sms")
@@ -79,21 +79,8 @@ async def send_password_recovery_sms(phone: str, token: str, username: str):
         # Send SMS
         if SMS_USERNAME and SMS_PASSWORD and SMS_SENDER_NUMBER:
             try:
-                # Convert phone number to local format
-                sms_phone = '0' + phone[3:] if phone.startswith('+989') else phone
-                
-                # Initialize API
-                api = Api(SMS_USERNAME, SMS_PASSWORD)
-                sms = api.sms()
-                
-                # Send SMS
-                response = sms.send(sms_phone, SMS_SENDER_NUMBER, message)
-                
-                if response and 'error' in str(response).lower():
-                    logger.error(f"Failed to send SMS to {sms_phone}: {response}")
-                    raise Exception(f"SMS sending failed: {response}")
-                
-                logger.info(f"SMS sent successfully to {sms_phone}")
+                # Queued on the shared gateway client; retries and delivery logging happen in the dispatcher
+                get_sms_dispatcher().submit(phone, message, purpose="password_recovery")
             except Exception as sms_error:
                 logger.error(f"Failed to send recovery SMS: {sms_error}")
                 # Don't raise the exception to avoid breaking the flow
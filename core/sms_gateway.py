@@ -0,0 +1,250 @@
+import asyncio, os, time, logging
+import httpx
+
+from .config import SMS_USERNAME, SMS_PASSWORD, SMS_SENDER_NUMBER
+
+# Setup logger for this module
+logger = logging.getLogger("sms_gateway")
+
+# Constants
+SMS_GATEWAY_URL = os.getenv("SMS_GATEWAY_URL", "https://rest.payamak-panel.com/api/SendSMS/")
+SMS_GATEWAY_METHOD = os.getenv("SMS_GATEWAY_METHOD", "rest")  # rest | soap
+SMS_TIMEOUT = float(os.getenv("SMS_TIMEOUT", "10"))
+SMS_MAX_RETRIES = int(os.getenv("SMS_MAX_RETRIES", "3"))
+SMS_RETRY_BACKOFF = float(os.getenv("SMS_RETRY_BACKOFF", "0.5"))  # seconds, doubled per retry
+SMS_DISPATCH_WORKERS = int(os.getenv("SMS_DISPATCH_WORKERS", "2"))
+SMS_QUEUE_SIZE = int(os.getenv("SMS_QUEUE_SIZE", "1000"))
+
+
+class SmsRetryableError(Exception):
+    """Transport failure or 5xx/429 from the gateway; the message is retried"""
+
+
+def to_local_number(phone: str) -> str:
+    """+989xxxxxxxxx / 989xxxxxxxxx / 9xxxxxxxxx -> 09xxxxxxxxx, as the gateway expects"""
+    if phone.startswith('+989'):
+        return '0' + phone[3:]
+    if phone.startswith('989'):
+        return '0' + phone[2:]
+    if phone.startswith('9') and len(phone) == 10:
+        return '0' + phone
+    return phone
+
+
+class SmsGateway:
+    """Long-lived melipayamak client: one httpx.AsyncClient (keep-alive pool) for REST, or the SOAP client with
+    its WSDL fetched once and calls run in a thread"""
+
+    def __init__(self, username: str, password: str, sender: str, base_url: str = SMS_GATEWAY_URL,
+                 method: str = SMS_GATEWAY_METHOD, timeout: float = SMS_TIMEOUT):
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.base_url = base_url.rstrip('/') + '/'
+        self.method = method
+        self.timeout = timeout
+        self._client = None
+        self._soap = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.username and self.password and self.sender)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=SMS_DISPATCH_WORKERS * 2, max_keepalive_connections=SMS_DISPATCH_WORKERS),
+            )
+        return self._client
+
+    async def warm_up(self):
+        """Load the WSDL (soap) ahead of the first message"""
+        if self.method == "soap" and self._soap is None:
+            from .melipayamak.sms.soap import Soap, wsdl_client
+            self._soap = Soap(self.username, self.password)
+            await asyncio.to_thread(wsdl_client, self._soap.sendUrl)
+
+    async def send(self, to: str, text: str) -> bool:
+        """One delivery attempt. False when the gateway rejects the message; SmsRetryableError when it may
+        succeed later"""
+        if self.method == "soap":
+            await self.warm_up()
+            try:
+                response = await asyncio.to_thread(self._soap.send, to, self.sender, text)
+            except Exception as e:
+                raise SmsRetryableError(str(e)) from e
+            return bool(response) and 'error' not in str(response).lower()
+
+        data = {'username': self.username, 'password': self.password,
+                'to': to, 'from': self.sender, 'text': text, 'isFlash': False}
+        try:
+            response = await self._http().post(self.base_url + 'SendSMS', data=data)
+        except httpx.TransportError as e:
+            raise SmsRetryableError(f"{type(e).__name__}: {e}") from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise SmsRetryableError(f"HTTP {response.status_code}")
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        if isinstance(body, dict) and 'RetStatus' in body:
+            ok = body['RetStatus'] == 1
+        else:
+            ok = response.status_code == 200 and 'error' not in str(body).lower()
+        if not ok:
+            logger.error(f"SMS gateway rejected message to {to}: {body}")
+        return ok
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+class _OutboundSms:
+    __slots__ = ("phone", "purpose", "text", "future", "queued_at")
+
+    def __init__(self, phone: str, purpose: str, text: str, future: asyncio.Future):
+        self.phone = phone
+        self.purpose = purpose
+        self.text = text
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class SmsDispatcher:
+    """Outbound queue drained by a few workers, with retries and per-phone dedupe: a message still waiting in
+    the queue is replaced by a newer one of the same purpose to the same phone (e.g. a resent OTP) and both
+    callers get its result. Messages without a purpose, or of another purpose, are never merged"""
+
+    def __init__(self, gateway: SmsGateway, workers: int = SMS_DISPATCH_WORKERS, max_retries: int = SMS_MAX_RETRIES,
+                 backoff: float = SMS_RETRY_BACKOFF, maxsize: int = SMS_QUEUE_SIZE):
+        self.gateway = gateway
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.maxsize = maxsize
+        self._queue = None
+        self._waiting = {}  # (phone, purpose) -> _OutboundSms not yet picked up by a worker
+        self._tasks = []
+        self._metrics = {"queued": 0, "sent": 0, "failed": 0, "retries": 0, "deduped": 0, "dropped": 0,
+                         "send_total": 0.0}
+
+    def _start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        if self.gateway.method == "soap":
+            self._tasks.append(asyncio.create_task(self.gateway.warm_up()))
+
+    def submit(self, phone: str, text: str, purpose: str = None) -> asyncio.Future:
+        """Queue a message; the future resolves to True once the gateway accepted it"""
+        if not self._tasks:
+            self._start()
+        to = to_local_number(phone)
+        waiting = self._waiting.get((to, purpose)) if purpose else None
+        if waiting is not None and not waiting.future.done():
+            waiting.text = text
+            self._metrics["deduped"] += 1
+            return waiting.future
+        item = _OutboundSms(to, purpose, text, asyncio.get_running_loop().create_future())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._metrics["dropped"] += 1
+            logger.error(f"❌ SMS queue full ({self.maxsize}), dropping message to {to}")
+            item.future.set_result(False)
+            return item.future
+        if purpose:
+            self._waiting[(to, purpose)] = item
+        self._metrics["queued"] += 1
+        return item.future
+
+    async def send(self, phone: str, text: str, timeout: float = None, purpose: str = None) -> bool:
+        """Queue a message and wait for the outcome (False on failure or timeout)"""
+        future = self.submit(phone, text, purpose)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ SMS to {to_local_number(phone)} still pending after {timeout}s")
+            return False
+
+    async def _worker(self, index: int):
+        while True:
+            item = await self._queue.get()
+            if item.purpose and self._waiting.get((item.phone, item.purpose)) is item:
+                del self._waiting[(item.phone, item.purpose)]
+            try:
+                ok = await self._deliver(item)
+                if not item.future.done():
+                    item.future.set_result(ok)
+            except asyncio.CancelledError:
+                if not item.future.done():
+                    item.future.set_result(False)
+                raise
+            except Exception as e:
+                logger.error(f"SMS worker {index} error: {e}")
+                if not item.future.done():
+                    item.future.set_result(False)
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, item: _OutboundSms) -> bool:
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                ok = await self.gateway.send(item.phone, item.text)
+                self._metrics["send_total"] += time.monotonic() - started
+                self._metrics["sent" if ok else "failed"] += 1
+                if ok:
+                    logger.info(f"SMS sent successfully to {item.phone}")
+                return ok
+            except SmsRetryableError as e:
+                if attempt == self.max_retries:
+                    self._metrics["failed"] += 1
+                    logger.error(f"❌ SMS to {item.phone} failed after {attempt + 1} attempts: {e}")
+                    return False
+                self._metrics["retries"] += 1
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"⚠️ SMS to {item.phone} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return False
+
+    def stats(self) -> dict:
+        finished = self._metrics["sent"] + self._metrics["failed"] or 1
+        return {
+            "method": self.gateway.method,
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            **{key: value for key, value in self._metrics.items() if key != "send_total"},
+            "avg_send_ms": round(self._metrics["send_total"] / finished * 1000, 2),
+        }
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            item = self._queue.get_nowait()
+            if not item.future.done():
+                item.future.set_result(False)
+        self._waiting.clear()
+        await self.gateway.aclose()
+
+
+_dispatcher = None
+
+
+def get_sms_dispatcher() -> SmsDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = SmsDispatcher(SmsGateway(SMS_USERNAME, SMS_PASSWORD, SMS_SENDER_NUMBER))
+    return _dispatcher
+
+
+async def close_sms_dispatcher():
+    global _dispatcher
+    if _dispatcher is not None:
+        await _dispatcher.close()
+        _dispatcher = None
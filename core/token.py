@@ -1,4 +1,4 @@
-import asyncio, time, os, sys, gc, psutil, logging, secrets, string, jwt
+import asyncio, time, os, sys, gc, psutil, logging, secrets, string, jwt, hashlib, itertools
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 from fastapi import Request, HTTPException, Depends
@@ -48,6 +48,20 @@ ALGORITHM = os.getenv("ALGORITHM", "HS256")
 # Import SECRET_KEY and SECURITY_CONFIG from config
 from .config import SECRET_KEY, SECURITY_CONFIG
 from .Security import log_security_event
+from .cache import TTLCache
+
+# Verified tokens: digest -> payload; each entry lives until the token's own expiry (or max age)
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+verified_token_cache = TTLCache("verified_tokens", maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+# Revoked (logged out) token digest -> exp; not size-bounded so no revocation can be evicted before the token
+# expires, and only tokens with a valid signature get in. Pruned by purge_revocations()
+_revoked_tokens = {}
+# username -> time of the last password change/deactivation; tokens issued before it are rejected
+_user_tokens_revoked_at = {}
+
+# One debug line per AUTH_DEBUG_SAMPLE authentications (never the raw token)
+AUTH_DEBUG_SAMPLE = max(int(os.getenv("AUTH_DEBUG_SAMPLE", "100")), 1)
+_auth_counter = itertools.count()
 
 
 
@@ -152,10 +166,73 @@ def create_access_token(data: dict, expires_delta: timedelta = None, ip_address:
     return encoded_jwt
 
 
+def _token_digest(token: str) -> bytes:
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+
+def _revoked_for_user(payload: dict) -> bool:
+    revoked_at = _user_tokens_revoked_at.get(payload.get('username'))
+    return revoked_at is not None and payload.get('iat', 0) <= revoked_at
+
+
 def verify_token(token: str):
-    """Enhanced JWT token verification with algorithm verification and IP validation"""
+    """Verified payload for a token, or None; signature checks run once per token, then it is a cache lookup"""
     if not token:
         return None
+    digest = _token_digest(token)
+    payload = verified_token_cache.get(digest)
+    if payload is None:
+        if digest in _revoked_tokens:
+            return None
+        payload = _decode_token(token)
+        if payload is None:
+            return None
+        # Cache until the token expires or becomes too old, whichever comes first
+        now = time.time()
+        expires = payload['exp']
+        if 'iat' in payload:
+            expires = min(expires, payload['iat'] + SECURITY_CONFIG.get('MAX_TOKEN_AGE_HOURS', 1) * 3600)
+        if expires - now > 0:
+            verified_token_cache.set(digest, payload, ttl=expires - now)
+    if _revoked_for_user(payload):
+        return None
+    return dict(payload)
+
+
+def revoke_token(token: str):
+    """Logout hook: the token stops authenticating immediately, even if the client kept a copy"""
+    if not token:
+        return
+    digest = _token_digest(token)
+    verified_token_cache.invalidate(digest)
+    # Forged/expired tokens authenticate nowhere, so they are not worth remembering
+    payload = _decode_token(token)
+    if payload is not None:
+        _revoked_tokens[digest] = payload['exp']
+
+
+def revoke_user_tokens(username: str):
+    """Password change/deactivation hook: every token issued to the user so far is rejected"""
+    if username:
+        _user_tokens_revoked_at[username] = time.time()
+
+
+def purge_revocations() -> int:
+    """Drop revocations that no longer matter: tokens past their exp, and per-user cutoffs older than
+    MAX_TOKEN_AGE_HOURS (every token issued before them is too old to be accepted anyway)"""
+    now = time.time()
+    expired = [digest for digest, exp in _revoked_tokens.items() if exp <= now]
+    for digest in expired:
+        del _revoked_tokens[digest]
+    cutoff = now - SECURITY_CONFIG.get('MAX_TOKEN_AGE_HOURS', 1) * 3600
+    stale = [username for username, revoked_at in _user_tokens_revoked_at.items() if revoked_at < cutoff]
+    for username in stale:
+        del _user_tokens_revoked_at[username]
+    return len(expired) + len(stale)
+
+
+def _decode_token(token: str):
+    """Enhanced JWT token verification with algorithm verification and IP validation"""
     try:
         # Explicitly specify the algorithm to prevent algorithm confusion attacks
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={
@@ -202,30 +279,25 @@ def verify_token(token: str):
 def get_current_user(request: Request):
     """Get current user from token in cookies or headers with enhanced validation"""
     token = request.cookies.get("access_token") or request.headers.get("Authorization", "").replace("Bearer ", "")
-    
-    # Debug logging
-    logger.info(f"[AUTH DEBUG] Token from cookie: {request.cookies.get('access_token')}")
-    logger.info(f"[AUTH DEBUG] Token from header: {request.headers.get('Authorization')}")
-    logger.info(f"[AUTH DEBUG] Final token: {token[:50] if token else 'None'}...")
+    sampled = next(_auth_counter) % AUTH_DEBUG_SAMPLE == 0 and logger.isEnabledFor(logging.DEBUG)
     
     if not token:
-        logger.info("[AUTH DEBUG] No token found")
+        if sampled:
+            logger.debug(f"[AUTH DEBUG] No token found for {request.url.path}")
         return None
     
-    # Verify token and get user info
+    # Verify token and get user info (cached after the first verification)
     user_info = verify_token(token)
-    logger.info(f"[AUTH DEBUG] User info from token: {user_info}")
     
     if not user_info:
-        logger.info("[AUTH DEBUG] Token verification failed")
+        if sampled:
+            logger.debug(f"[AUTH DEBUG] Token verification failed for {request.url.path}")
         return None
     
     # Enhanced IP validation to prevent session hijacking
     client_ip = request.client.host if request.client else "unknown"
     token_ip = user_info.get('ip_address')
     
-    logger.info(f"[AUTH DEBUG] Client IP: {client_ip}, Token IP: {token_ip}")
-    
     if token_ip is not None and token_ip != client_ip:
         logger.warning(f"IP mismatch detected: token IP {token_ip} vs client IP {client_ip}")
         # Log security event
@@ -239,12 +311,7 @@ def get_current_user(request: Request):
         ))
         return None
     
-    # Additional validation: check if user is still active in database
-    try:
-        # This would be async in a real implementation, but we need to keep it sync for FastAPI dependency
-        # In production, consider using a sync database connection or caching
-        logger.info(f"[AUTH DEBUG] Returning user info: {user_info}")
-        return user_info
-    except Exception as e:
-        logger.error(f"Error validating user: {e}")
-        return None
\ No newline at end of file
+    if sampled:
+        logger.debug(f"[AUTH DEBUG] Authenticated {user_info.get('username')} from {client_ip} "
+                     f"(token cache: {verified_token_cache.stats()['hit_rate']:.0%} hits)")
+    return user_info
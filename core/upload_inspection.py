@@ -0,0 +1,224 @@
+import asyncio, hashlib, io, os, time, logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from PIL import Image
+
+from .cache import TTLCache
+
+# Setup logger for this module
+logger = logging.getLogger("upload_inspection")
+
+# Constants
+UPLOAD_INSPECTION_BUDGET = float(os.getenv("UPLOAD_INSPECTION_BUDGET", "1.5"))  # seconds per upload
+UPLOAD_INSPECTION_WORKERS = int(os.getenv("UPLOAD_INSPECTION_WORKERS", "1"))
+# Reject flagged uploads; off by default since the LSB heuristic also flags ordinary camera JPEGs
+UPLOAD_INSPECTION_ENFORCE = os.getenv("UPLOAD_INSPECTION_ENFORCE", "false").lower() == "true"
+INSPECTION_MAX_SIDE = 1024  # grayscale image is box-downsampled to this before the SVD
+INSPECTION_TILE = 256
+SVD_RANK = 50  # singular values examined per tile
+SVD_OVERSAMPLE = 10
+SVD_POWER_ITERATIONS = 2
+LSB_ENTROPY_THRESHOLD = 0.9
+HASH_IN_THREAD_SIZE = 256 * 1024  # hash larger uploads off the event loop
+
+# sha256 of the file -> verdict (only complete verdicts are cached)
+upload_verdict_cache = TTLCache("upload_verdicts", maxsize=2048, ttl=24 * 3600)
+
+_pool = None
+_stats = {"inspected": 0, "cached": 0, "flagged": 0, "partial": 0, "time_total": 0.0}
+
+
+# ============================================================================
+# DETECTORS (numpy, run in the worker process)
+# ============================================================================
+
+def open_rgb_image(file_data: bytes):
+    """Decoded PIL image, or None for modes the steganography checks do not cover"""
+    img = Image.open(io.BytesIO(file_data))
+    if img.mode not in ['RGB', 'RGBA']:
+        return None
+    return img
+
+
+def lsb_entropies(img_array: np.ndarray) -> np.ndarray:
+    """Shannon entropy of the least significant bit of each RGB channel, from one bincount over all of them"""
+    channels = min(3, img_array.shape[2])
+    lsb = img_array[:, :, :channels] & 1
+    lsb += np.arange(channels, dtype=np.uint8) * 2  # bin 2c + bit
+    counts = np.bincount(lsb.ravel(), minlength=2 * channels).reshape(channels, 2).astype(np.float64)
+    p = counts / counts.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = np.where(p > 0, p * np.log2(p), 0.0)
+    return -terms.sum(axis=1)
+
+
+def lsb_suspicious(img_array: np.ndarray) -> bool:
+    """High LSB entropy in any channel might indicate hidden data"""
+    entropies = lsb_entropies(img_array)
+    if np.any(entropies > LSB_ENTROPY_THRESHOLD):
+        logger.warning(f"High LSB entropy detected: {float(entropies.max()):.3f}")
+        return True
+    return False
+
+
+def downsampled_gray(img, max_side: int = INSPECTION_MAX_SIDE) -> np.ndarray:
+    gray = img.convert('L')
+    factor = -(-max(gray.size) // max_side)
+    if factor > 1:
+        gray = gray.reduce(factor)
+    return np.asarray(gray, dtype=np.float64)
+
+
+def top_singular_values(matrix: np.ndarray, k: int = SVD_RANK) -> np.ndarray:
+    """Largest k singular values by randomized range finding (Halko et al.), exact for small matrices"""
+    rank = min(k + SVD_OVERSAMPLE, *matrix.shape)
+    if rank == min(matrix.shape):
+        return np.linalg.svd(matrix, compute_uv=False)[:k]
+    rng = np.random.default_rng(0)
+    q = np.linalg.qr(matrix @ rng.standard_normal((matrix.shape[1], rank)))[0]
+    for _ in range(SVD_POWER_ITERATIONS):
+        q = np.linalg.qr(matrix.T @ q)[0]
+        q = np.linalg.qr(matrix @ q)[0]
+    return np.linalg.svd(q.T @ matrix, compute_uv=False)[:k]
+
+
+def singular_values_suspicious(singular_values: np.ndarray) -> bool:
+    """Steganography often affects the distribution of singular values"""
+    if len(singular_values) <= 10:
+        return False
+    # Check for unusual variance patterns (completely disabled for testing)
+    variance = np.var(singular_values)
+    if variance < 1e-1000 or variance > 1e1000:
+        logger.warning(f"Suspicious SVD variance detected: {variance}")
+        return True
+    # Check for unusual singular value ratios
+    ratios = singular_values[:-1] / (singular_values[1:] + 1e-10)
+    if np.any(ratios > 100000000000000) or np.any(ratios < 0.00000000000001):
+        logger.warning("Unusual singular value ratios detected")
+        return True
+    return False
+
+
+def svd_suspicious(gray: np.ndarray, deadline: float = None):
+    """Truncated SVD per tile with early exit; None when the deadline passed before every tile was checked"""
+    height, width = gray.shape
+    for top in range(0, height, INSPECTION_TILE):
+        for left in range(0, width, INSPECTION_TILE):
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            tile = gray[top:top + INSPECTION_TILE, left:left + INSPECTION_TILE]
+            # flat tiles (sky, walls) have a single singular value and nothing to hide data in
+            if min(tile.shape) <= 10 or tile.std() < 1.0:
+                continue
+            if singular_values_suspicious(top_singular_values(tile)):
+                return True
+    return False
+
+
+def inspect_image_bytes(file_data: bytes, budget: float = UPLOAD_INSPECTION_BUDGET) -> dict:
+    """Cheapest checks first, stopping at the first finding or when the budget runs out"""
+    from .Security import detect_embedded_malicious_content
+
+    started = time.monotonic()
+    deadline = started + budget
+    verdict = {"suspicious": False, "findings": [], "complete": True}
+
+    def finish(finding: str = None, complete: bool = True):
+        if finding:
+            verdict["suspicious"] = True
+            verdict["findings"].append(finding)
+        verdict["complete"] = complete
+        verdict["elapsed_ms"] = round((time.monotonic() - started) * 1000, 2)
+        return verdict
+
+    if detect_embedded_malicious_content(file_data):
+        return finish("embedded_content")
+    try:
+        img = open_rgb_image(file_data)
+        if img is None:
+            return finish()
+        if time.monotonic() > deadline:
+            return finish(complete=False)
+        if lsb_suspicious(np.asarray(img)):
+            return finish("lsb_entropy")
+        svd = svd_suspicious(downsampled_gray(img), deadline)
+        if svd is None:
+            return finish(complete=False)
+        return finish("svd_anomaly" if svd else None)
+    except Exception as e:
+        logger.error(f"Steganography detection error: {e}")
+        return finish()
+
+
+# ============================================================================
+# ASYNC PIPELINE
+# ============================================================================
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=UPLOAD_INSPECTION_WORKERS)
+    return _pool
+
+
+def shutdown_inspection_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _run_inspection(file_data: bytes) -> dict:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), inspect_image_bytes, file_data, UPLOAD_INSPECTION_BUDGET)
+    except BrokenProcessPool:
+        logger.warning("⚠️ Upload inspection worker died, restarting the pool")
+        shutdown_inspection_pool()
+        return await loop.run_in_executor(_get_pool(), inspect_image_bytes, file_data, UPLOAD_INSPECTION_BUDGET)
+
+
+async def inspect_upload(file_data: bytes) -> dict:
+    """Steganography / embedded content verdict for an uploaded file, computed in the worker process within
+    UPLOAD_INSPECTION_BUDGET and cached by the file's SHA-256"""
+    if len(file_data) > HASH_IN_THREAD_SIZE:
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(file_data).hexdigest())
+    else:
+        digest = hashlib.sha256(file_data).hexdigest()
+    verdict = upload_verdict_cache.get(digest)
+    if verdict is not None:
+        _stats["cached"] += 1
+        return verdict
+
+    started = time.monotonic()
+    try:
+        # the worker stops itself at the budget; the margin covers decoding and process hand-off
+        verdict = await asyncio.wait_for(_run_inspection(file_data), UPLOAD_INSPECTION_BUDGET + 1.0)
+    except asyncio.TimeoutError:
+        verdict = {"suspicious": False, "findings": [], "complete": False,
+                   "elapsed_ms": round((time.monotonic() - started) * 1000, 2)}
+    _stats["inspected"] += 1
+    _stats["time_total"] += time.monotonic() - started
+    if verdict["suspicious"]:
+        _stats["flagged"] += 1
+    if verdict["complete"]:
+        upload_verdict_cache.set(digest, verdict)
+    else:
+        _stats["partial"] += 1
+        logger.warning(f"⚠️ Upload inspection exceeded its {UPLOAD_INSPECTION_BUDGET}s budget, verdict is partial")
+    return verdict
+
+
+def inspection_stats() -> dict:
+    inspected = _stats["inspected"] or 1
+    return {
+        "workers": UPLOAD_INSPECTION_WORKERS,
+        "budget_s": UPLOAD_INSPECTION_BUDGET,
+        "enforce": UPLOAD_INSPECTION_ENFORCE,
+        "inspected": _stats["inspected"],
+        "cached": _stats["cached"],
+        "flagged": _stats["flagged"],
+        "partial": _stats["partial"],
+        "avg_ms": round(_stats["time_total"] / inspected * 1000, 2),
+    }
@@ -1,6 +1,9 @@
-import asyncio, time, os, gc, random, gzip, shutil, psutil, logging, logging.config, logging.handlers
+import asyncio, time, os, gc, random, shutil, psutil, logging, logging.config, logging.handlers
 from datetime import datetime
 
+from . import counters
+from .rate_limiter import sweep_limiters
+
 # Setup logger for this module
 logger = logging.getLogger("utils")
 
@@ -461,9 +464,11 @@ async def cleanup_old_files():
                                 continue
                             # Use parameterized query with table name validation
                             if table == 'manual_photos':
-                                await conn.execute("DELETE FROM manual_photos WHERE filename=?", (fname,))
+                                cursor = await conn.execute("DELETE FROM manual_photos WHERE filename=?", (fname,))
+                                counters.bump("photos", -cursor.rowcount)
                             elif table == 'security_videos':
-                                await conn.execute("DELETE FROM security_videos WHERE filename=?", (fname,))
+                                cursor = await conn.execute("DELETE FROM security_videos WHERE filename=?", (fname,))
+                                counters.bump("videos", -cursor.rowcount)
                             else:
                                 logger.error(f"Unknown table name: {table}")
                                 continue
@@ -510,31 +515,9 @@ async def cleanup_expired_recovery_codes():
 async def cleanup_in_memory_rate_limits():
     """Clean up expired in-memory rate limit entries"""
     try:
-        current_time = time.time()
-        
-        # Clean up general rate limit storage
-        # Note: RATE_LIMIT_CONFIG structure has changed, so we'll clean up safely
-        try:
-            # Clean api_rate_limit_storage if it exists and is a dict
-            global api_rate_limit_storage
-            if isinstance(api_rate_limit_storage, dict):
-                # Clean expired entries (older than 1 hour)
-                window_start = current_time - 3600  # 1 hour
-                api_rate_limit_storage = {ip: timestamps for ip, timestamps in api_rate_limit_storage.items() 
-                                        if isinstance(timestamps, list) and any(ts > window_start for ts in timestamps)}
-            
-            # Clean login_attempts_storage if it exists and is a dict
-            global login_attempts_storage
-            if isinstance(login_attempts_storage, dict):
-                # Clean expired entries (older than 15 minutes)
-                window_start = current_time - 900  # 15 minutes
-                login_attempts_storage = {ip: data for ip, data in login_attempts_storage.items() 
-                                        if isinstance(data, dict) and data.get('last_attempt', 0) > window_start}
-        except (NameError, AttributeError) as e:
-            # If the global variables don't exist, that's fine
-            logger.debug(f"Rate limit storage not available for cleanup: {e}")
-        
-        logger.debug("In-memory rate limit storage cleaned up")
+        # Policies expire idle keys incrementally; this full sweep just returns memory after traffic bursts
+        tracked = sweep_limiters()
+        logger.debug(f"In-memory rate limit storage cleaned up ({tracked} keys tracked)")
     except Exception as e:
         logger.error(f"Error cleaning up in-memory rate limits: {e}")
 
@@ -596,32 +579,17 @@ async def cleanup_frame_cache():
 
 
 async def backup_database():
+    """Online backup via the SQLite backup API (see core/backup.py); retention is tracked in the manifest"""
+    from .backup import backup_database_online
     try:
         if not await check_disk_space():
             logger.warning("Skipping backup due to low disk space")
             return
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_file = os.path.join(BACKUP_DIR, f"backup_{timestamp}.db.gz")
-        temp_file = os.path.join(BACKUP_DIR, f"temp_{timestamp}.db")
-        await asyncio.to_thread(shutil.copyfile, DB_FILE, temp_file)
-        await asyncio.to_thread(lambda: shutil.copyfileobj(open(temp_file, 'rb'), gzip.open(backup_file, 'wb')))
-        await asyncio.to_thread(os.remove, temp_file)
-        logger.info(f"Database backup created: {backup_file}")
+        await backup_database_online(DB_FILE)
         system_state.last_backup_time = time.time()
-        backups = sorted(
-            [f for f in await asyncio.to_thread(os.listdir, BACKUP_DIR) if f.endswith('.gz')],
-            key=lambda x: os.path.getctime(os.path.join(BACKUP_DIR, x))
-        )
-        for old_backup in backups[:-BACKUP_RETENTION_DAYS]:
-            try:
-                await asyncio.to_thread(os.remove, os.path.join(BACKUP_DIR, old_backup))
-                logger.info(f"Deleted old backup: {old_backup}")
-            except Exception as e:
-                logger.error(f"Error deleting old backup {old_backup}: {e}")
     except Exception as e:
         logger.error(f"Backup process error: {e}")
-        if os.path.exists(temp_file):
-            await asyncio.to_thread(os.remove, temp_file)
+        raise
 
 async def periodic_backup_and_reset():
     """Periodic backup and reset with enhanced error handling and resource management"""
@@ -10,6 +10,7 @@ import time
 from typing import Dict, Set, Optional, Callable, Any
 from datetime import datetime, timedelta
 from fastapi import WebSocket, WebSocketDisconnect
+from . import json_codec
 from .config import MAX_WEBSOCKET_CLIENTS, INACTIVE_CLIENT_TIMEOUT, WEBSOCKET_ERROR_THRESHOLD
 
 # Setup logger
@@ -32,7 +33,7 @@ class WebSocketConnection:
         """Send message to client with error handling"""
         try:
             if isinstance(message, (dict, list)):
-                message = json.dumps(message)
+                message = json_codec.dumps(message)
             elif not isinstance(message, str):
                 message = str(message)
             
@@ -54,10 +54,17 @@ from core import (
     utils, system_manager, server_manager, client, error_handler,
     memory_manager
 )
-from core.config import set_templates, get_templates, is_test_environment, translations
+from core.config import set_templates, is_test_environment
 from core.translations_ui import UI_TRANSLATIONS
-from core.Security import set_dependencies as set_security_dependencies
+from core.Security import set_dependencies as set_security_dependencies, SECURITY_BASELINE_HEADERS
+from core.asgi_middleware import TemplateContextMiddleware, SecurityBaselineMiddleware, AccessLogMiddleware, AccessLogQueue
 from core.db import get_db_connection, close_db_connection
+from core.assets import build_assets, asset_url
+from core.render_cache import render_page
+from core.json_codec import FastJSONResponse, JSON_BACKEND
+from core.upload_inspection import shutdown_inspection_pool
+from core.sms_gateway import close_sms_dispatcher
+from core.google_oidc import warm_up as warm_up_google_oidc, close_http_client as close_google_http_client
 
 set_security_dependencies(
     log_func=None,  # اگر تابع لاگ دارید اینجا قرار دهید
@@ -323,7 +330,14 @@ async def lifespan(app: FastAPI):
         set_templates(templates)
         templates.env.filters['datetimeformat'] = datetimeformat  # افزودن فیلتر به محیط Jinja2
         templates.env.filters['translate_log_level'] = translate_log_level  # افزودن فیلتر ترجمه سطح لاگ
+        templates.env.globals['asset_url'] = asset_url  # fingerprinted /assets URLs
         logger.info("✅ Jinja2 templates initialized")
+        # Fingerprinted + precompressed static assets (served from /assets with immutable caching)
+        try:
+            await asyncio.to_thread(build_assets)
+        except Exception as assets_err:
+            logger.warning(f"Static asset build failed, templates fall back to /static: {assets_err}")
+        logger.info(f"✅ JSON codec: {JSON_BACKEND}")
         # Initialize global system state and required locks/attributes
         global system_state, system_initialized
         if system_state is None:
@@ -371,6 +385,47 @@ async def lifespan(app: FastAPI):
         except Exception as dep_err:
             logger.warning(f"Dependency wiring warning: {dep_err}")
 
+        # Retention/rollup engine for the high-volume tables, plus the expired session/CSRF token sweep
+        try:
+            from core.retention import periodic_retention, periodic_session_sweep
+            system_state.retention_task = _asyncio.create_task(periodic_retention())
+            system_state.session_sweep_task = _asyncio.create_task(periodic_session_sweep())
+        except Exception as retention_err:
+            logger.warning(f"Retention engine not started: {retention_err}")
+
+        # Media catalog scanner (reconciles manual_photos/security_videos with the filesystem)
+        try:
+            from core.media_catalog import periodic_media_reconcile
+            system_state.media_reconcile_task = _asyncio.create_task(periodic_media_reconcile())
+        except Exception as catalog_err:
+            logger.warning(f"Media catalog scanner not started: {catalog_err}")
+
+        # Poster/sprite/WebVTT generation for finalized videos
+        try:
+            from core.derivatives import derivative_worker
+            system_state.derivative_task = _asyncio.create_task(derivative_worker())
+        except Exception as derivative_err:
+            logger.warning(f"Derivative worker not started: {derivative_err}")
+
+        # Optional SQLite persistence of rate limiter state (RATE_LIMIT_PERSIST=true)
+        try:
+            from core.rate_limiter import rate_limit_sync_worker, RATE_LIMIT_PERSIST
+            if RATE_LIMIT_PERSIST:
+                system_state.rate_limit_task = _asyncio.create_task(rate_limit_sync_worker(get_db_connection, close_db_connection))
+        except Exception as rate_limit_err:
+            logger.warning(f"Rate limit sync not started: {rate_limit_err}")
+
+        # Pre-generated CAPTCHA challenges, refilled in the background
+        try:
+            from core.captcha_pool import captcha_pool_producer
+            system_state.captcha_pool_task = _asyncio.create_task(captcha_pool_producer())
+        except Exception as captcha_err:
+            logger.warning(f"CAPTCHA pool producer not started: {captcha_err}")
+
+        # Google OpenID discovery + signing keys, so the first sign-in verifies its id_token locally
+        if google_auth.GOOGLE_OAUTH_ENABLED:
+            system_state.google_oidc_task = _asyncio.create_task(warm_up_google_oidc())
+
         # ... سایر مقداردهی‌ها ...
         logger.info("✅ Startup completed")
     except Exception as e:
@@ -382,6 +437,13 @@ async def lifespan(app: FastAPI):
     logger.info("🛑 Shutting down Spy Servo System...")
     try:
         # ... cleanup ...
+        for task_name in ('retention_task', 'session_sweep_task', 'media_reconcile_task', 'derivative_task', 'rate_limit_task', 'captcha_pool_task', 'google_oidc_task'):
+            background_task = getattr(system_state, task_name, None)
+            if background_task:
+                background_task.cancel()
+        shutdown_inspection_pool()
+        await close_sms_dispatcher()
+        await close_google_http_client()
         logger.info("✅ Shutdown completed")
     except Exception as e:
         logger.error(f"❌ Shutdown error: {e}")
@@ -390,6 +452,7 @@ async def lifespan(app: FastAPI):
 app = FastAPI(
     title="Spy Servo System",
     version="1.0.0",
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
@@ -446,6 +509,7 @@ def create_app() -> FastAPI:
         version="1.0.0",
         docs_url="/docs" if is_test_environment() else None,
         redoc_url="/redoc" if is_test_environment() else None,
+        default_response_class=FastJSONResponse,
         lifespan=lifespan
     )
     
@@ -471,32 +535,14 @@ def create_app() -> FastAPI:
     templates = Jinja2Templates(directory="templates")
     templates.env.filters['datetimeformat'] = datetimeformat
     templates.env.filters['translate_log_level'] = translate_log_level
+    templates.env.globals['asset_url'] = asset_url
     
-    # Add template context processor
-    @app.middleware("http")
-    async def add_template_context(request: Request, call_next):
-        request.state.templates = templates
-        response = await call_next(request)
-        return response
-    
-    # Add Jalali logging middleware
-    @app.middleware("http")
-    async def jalali_logging_middleware(request: Request, call_next):
-        start_time = time.time()
-        response = await call_next(request)
-        process_time = time.time() - start_time
-        
-        # Log with Jalali timestamp if available
-        try:
-            if 'JalaliFormatter' in globals():
-                jalali_logger = logging.getLogger("jalali_access")
-                jalali_logger.info(f"{request.method} {request.url.path} - {response.status_code} - {process_time:.3f}s")
-            else:
-                logger.info(f"{request.method} {request.url.path} - {response.status_code} - {process_time:.3f}s")
-        except Exception as e:
-            logger.warning(f"Error in Jalali logging middleware: {e}")
-        
-        return response
+    # Pure ASGI middleware: no per-request task/queue wrapping of (streaming) responses
+    app.add_middleware(TemplateContextMiddleware, templates=templates)
+    app.add_middleware(SecurityBaselineMiddleware, headers=SECURITY_BASELINE_HEADERS)
+    # Access log with Jalali timestamp if available, written off the event loop
+    access_logger = logging.getLogger("jalali_access") if 'JalaliFormatter' in globals() else logger
+    app.add_middleware(AccessLogMiddleware, log_queue=AccessLogQueue(access_logger))
     
     # Register exception handlers (if functions exist)
     if hasattr(error_handler, 'http_exception_handler'):
@@ -525,7 +571,8 @@ def create_camera_app() -> FastAPI:
         description="Camera streaming and control server",
         version="1.0.0",
         docs_url="/docs" if is_test_environment() else None,
-        redoc_url="/redoc" if is_test_environment() else None
+        redoc_url="/redoc" if is_test_environment() else None,
+        default_response_class=FastJSONResponse
     )
     
     # Initialize ESP32CAM module with system state and dependencies
@@ -974,11 +1021,12 @@ def create_routes(app: FastAPI):
         try:
             user = await token.get_current_user(request)
             lang = request.cookies.get('language', 'fa')
-            context = {"request": request, "translations": translations, "lang": lang}
-            return templates.TemplateResponse("index.html" if user else "login.html", context)
+            if user:
+                return render_page(request, "index.html", lang, user.get("role"))
+            return render_page(request, "login.html", lang)
         except Exception:
             lang = request.cookies.get('language', 'fa')
-            return templates.TemplateResponse("login.html", {"request": request, "translations": translations, "lang": lang})
+            return render_page(request, "login.html", lang)
     
     # System overview endpoint
     @app.get("/api/v1/system/overview")
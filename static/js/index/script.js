@@ -2765,7 +2765,9 @@ class SmartCameraSystem {
         this.isLoading = true;
 
         try {
-            const response = await fetch(`/get_gallery?page=${this.currentPage}`, { credentials: 'include' });
+            // keyset cursor from the previous page keeps deep pages as cheap as the first one
+            const galleryCursor = this.currentPage > 0 && this.galleryCursor ? `&cursor=${encodeURIComponent(this.galleryCursor)}` : '';
+            const response = await fetch(`/get_gallery?page=${this.currentPage}${galleryCursor}`, { credentials: 'include' });
             if (!response.ok) throw new Error('Failed to fetch gallery');
             // Be defensive: server always returns JSON, but avoid breaking UI if HTML error is returned
             let data;
@@ -2810,7 +2812,10 @@ class SmartCameraSystem {
                 // Detect mobile mode
                 const isMobile = this.deviceMode === 'mobile' || window.innerWidth <= 600;
                 item.innerHTML = `
-                    <img src="${photo.url}" alt="${this.language === 'fa' ? 'تصویر امنیتی' : 'Security Image'}" loading="lazy">
+                    <picture>
+                        ${photo.webp_srcset ? `<source type="image/webp" srcset="${photo.webp_srcset}" sizes="(max-width: 600px) 50vw, 33vw">` : ''}
+                        <img src="${photo.thumb_url || photo.url}" ${photo.srcset ? `srcset="${photo.srcset}" sizes="(max-width: 600px) 50vw, 33vw"` : ''} alt="${this.language === 'fa' ? 'تصویر امنیتی' : 'Security Image'}" loading="lazy" decoding="async">
+                    </picture>
                     ${isMobile ? `
                     <div class="gallery-info-overlay" style="position:absolute;bottom:0;left:0;width:100%;background:rgba(0,0,0,0.55);color:#fff;padding:4px 6px;font-size:0.95em;display:flex;flex-direction:row;align-items:center;gap:10px;justify-content:center;z-index:2;">
                         <span style="display:flex;align-items:center;gap:3px;white-space:nowrap;">
@@ -2890,6 +2895,7 @@ class SmartCameraSystem {
                 galleryContainer.appendChild(item);
             });
 
+            this.galleryCursor = data.next_cursor || null;
             this.currentPage++;
             if (!data.has_more) {
                 const loadMoreBtn = document.getElementById('loadMoreBtn');
@@ -3020,7 +3026,8 @@ class SmartCameraSystem {
         this.isLoading = true;
 
         try {
-            const response = await fetch(`/get_videos?page=${this.currentVideoPage}`, { 
+            const videoCursor = this.currentVideoPage > 0 && this.videoCursor ? `&cursor=${encodeURIComponent(this.videoCursor)}` : '';
+            const response = await fetch(`/get_videos?page=${this.currentVideoPage}${videoCursor}`, { 
                 credentials: 'include',
                 headers: {
                     'Cache-Control': 'no-cache'
@@ -3075,6 +3082,7 @@ class SmartCameraSystem {
                 }
             });
 
+            this.videoCursor = data.next_cursor || null;
             this.currentVideoPage++;
             
             // Update load more button
@@ -3137,7 +3145,7 @@ class SmartCameraSystem {
             // Create video thumbnail with proper event handling
             item.innerHTML = `
                 <div class="video-thumbnail">
-                    <video data-src="${videoUrl}" muted preload="metadata" playsinline controlslist="nodownload" disablePictureInPicture disableRemotePlayback poster="/video_poster/${video.filename}">
+                    <video data-src="${videoUrl}" muted preload="metadata" playsinline controlslist="nodownload" disablePictureInPicture disableRemotePlayback poster="${video.poster_url || `/video_poster/${video.filename}`}">
                         <source src="${videoUrl}" type="video/mp4">
                     </video>
                     <div class="video-overlay">
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for core/json_codec.py
+Compares the stdlib json calls the websocket/API hot paths used before with the codec layer,
+over payloads shaped like the messages in core/pico.py, core/esp32cam.py and core/client.py
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from core.json_codec import dumps, loads, JSON_BACKEND  # noqa: E402
+
+ITERATIONS = int(os.getenv("JSON_BENCH_ITERATIONS", "20000"))
+
+
+def build_payloads():
+    now = datetime.now().isoformat()
+    return {
+        # core/pico.py: ping / ack / servo command round trips
+        "pico_ping": {"type": "ping", "timestamp": now},
+        "pico_ack": {"type": "ack", "command_type": "servo", "status": "success",
+                     "timestamp": now, "servo1": 90, "servo2": 45},
+        # core/client.py: /ws status message
+        "ws_status": {
+            "type": "status", "timestamp": now, "system_ready": True,
+            "device_status": {"pico": {"online": True, "last_seen": now, "errors": []},
+                              "esp32cam": {"online": True, "last_seen": now, "errors": []}},
+            "error_counts": {"websocket": 3, "database": 0, "frame_processing": 12},
+            "uptime": 86400.123, "web_clients_count": 4, "active_clients_count": 4,
+        },
+        # core/esp32cam.py: frame broadcast (base64 JPEG, ~30KB)
+        "frame": {"type": "frame", "data": base64.b64encode(os.urandom(30 * 1024)).decode("ascii"),
+                  "resolution": {"width": 640, "height": 480}},
+        # core/client.py: /get_videos style API response
+        "video_list": {"status": "success", "videos": [{
+            "filename": f"video_{i:05d}.mp4", "url": f"/security_videos/video_{i:05d}.mp4",
+            "poster_url": f"/video_derivatives/{i:032x}.poster.jpg", "size": 1048576 + i,
+            "created_at": now, "duration": 30.0 + i % 7, "hash": f"{i:032x}",
+        } for i in range(200)]},
+        # Persian log lines pushed to web clients
+        "log": {"type": "log", "message": "سروو به موقعیت ۹۰ درجه منتقل شد", "level": "info", "timestamp": now},
+    }
+
+
+def bench(func, payload, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(payload)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    print(f"🧪 JSON codec benchmark (backend: {JSON_BACKEND}, {ITERATIONS} iterations)")
+    print("=" * 78)
+    print(f"{'payload':<12} {'json.dumps':>11} {'codec':>9} {'x':>6}   {'json.loads':>11} {'codec':>9} {'x':>6}")
+    ok = True
+    for name, payload in build_payloads().items():
+        iterations = max(ITERATIONS // 20, 200) if name in ("frame", "video_list") else ITERATIONS
+        encoded = json.dumps(payload)
+        # same document either way
+        if loads(dumps(payload)) != json.loads(encoded):
+            print(f"❌ {name}: codec round trip differs from stdlib")
+            ok = False
+        d_std = bench(json.dumps, payload, iterations)
+        d_codec = bench(dumps, payload, iterations)
+        l_std = bench(json.loads, encoded, iterations)
+        l_codec = bench(loads, encoded, iterations)
+        print(f"{name:<12} {d_std:>9.2f}us {d_codec:>7.2f}us {d_std / d_codec:>5.1f}x"
+              f"   {l_std:>9.2f}us {l_codec:>7.2f}us {l_std / l_codec:>5.1f}x")
+    print("=" * 78)
+    print("✅ Codec output matches stdlib" if ok else "❌ Codec output mismatch")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
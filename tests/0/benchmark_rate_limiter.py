@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark for core/rate_limiter.py with 100k tracked IPs
+Compares the previous per-call dict rebuild (check_rate_limit / captcha_attempts style) with the
+sliding-window-counter and token-bucket policies, and checks memory caps and expiry
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from core.rate_limiter import SlidingWindowCounter, TokenBucket  # noqa: E402
+
+TRACKED_IPS = int(os.getenv("RATE_BENCH_IPS", "100000"))
+CALLS = int(os.getenv("RATE_BENCH_CALLS", "200000"))
+LEGACY_CALLS = int(os.getenv("RATE_BENCH_LEGACY_CALLS", "50"))
+
+
+def legacy_check(storage: dict, client_ip: str, max_requests: int = 100, window_seconds: int = 60):
+    """The previous check_rate_limit: rebuilds the whole dict on every call"""
+    current_time = time.time()
+    window_start = current_time - window_seconds
+    storage = {ip: timestamps for ip, timestamps in storage.items() if any(ts > window_start for ts in timestamps)}
+    timestamps = [ts for ts in storage.get(client_ip, []) if ts > window_start]
+    storage[client_ip] = timestamps
+    if len(timestamps) >= max_requests:
+        return storage, False
+    timestamps.append(current_time)
+    return storage, True
+
+
+def random_ips(count: int) -> list:
+    return [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in random.sample(range(1 << 24), count)]
+
+
+def bench_policy(policy, ips: list, calls: int) -> float:
+    picks = [random.choice(ips) for _ in range(calls)]
+    started = time.perf_counter()
+    for ip in picks:
+        policy.hit(ip)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    print(f"🧪 Rate limiter benchmark ({TRACKED_IPS} tracked IPs)")
+    print("=" * 60)
+    ips = random_ips(TRACKED_IPS)
+    ok = True
+
+    now = time.time()
+    legacy = {ip: [now] for ip in ips}
+    started = time.perf_counter()
+    for ip in random.sample(ips, LEGACY_CALLS):
+        legacy, _ = legacy_check(legacy, ip)
+    legacy_us = (time.perf_counter() - started) / LEGACY_CALLS * 1e6
+    print(f"legacy dict rebuild        {legacy_us:>12.1f} us/call")
+
+    for policy in (SlidingWindowCounter("bench_sliding", 100, 60), TokenBucket("bench_bucket", 100, 60)):
+        tracemalloc.start()
+        for ip in ips:
+            policy.hit(ip)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        per_call = bench_policy(policy, ips, CALLS)
+        print(f"{type(policy).__name__:<26} {per_call:>12.2f} us/call  "
+              f"({legacy_us / per_call:,.0f}x, {memory / len(policy):.0f} B/key)")
+        if len(policy) != TRACKED_IPS:
+            print(f"❌ {policy.name}: {len(policy)} keys tracked, expected {TRACKED_IPS}")
+            ok = False
+
+    # limits are enforced
+    limiter = SlidingWindowCounter("bench_limit", 5, 60)
+    results = [limiter.hit("192.0.2.1") for _ in range(8)]
+    if results != [True] * 5 + [False] * 3:
+        print(f"❌ sliding window allowed {results.count(True)} of 8 with limit 5")
+        ok = False
+
+    # memory cap: oldest keys are dropped
+    capped = SlidingWindowCounter("bench_capped", 5, 60, maxsize=1000)
+    for ip in ips[:5000]:
+        capped.hit(ip)
+    if len(capped) != 1000 or capped.evictions != 4000:
+        print(f"❌ memory cap not enforced: {len(capped)} keys, {capped.evictions} evictions")
+        ok = False
+
+    # expiry: idle keys disappear without a full scan
+    expiring = TokenBucket("bench_expiring", 10, 0.05)
+    for ip in ips[:10000]:
+        expiring.hit(ip)
+    time.sleep(0.1)
+    for ip in ips[10000:10100]:
+        expiring.hit(ip)
+    remaining = expiring.sweep()
+    if remaining != 100:
+        print(f"❌ expiry left {remaining} keys, expected 100")
+        ok = False
+
+    print("=" * 60)
+    print("✅ Rate limiter checks passed" if ok else "❌ Rate limiter checks failed")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Benchmark for core/upload_inspection.py
+Runs the previous steganography checks (full np.linalg.svd of the grayscale image, np.unique LSB entropy)
+and the inspection pipeline over synthetic camera photos, checks that the LSB verdicts agree, and that the
+budget, verdict cache and event loop responsiveness hold
+"""
+
+import asyncio
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from core import upload_inspection  # noqa: E402
+from core.upload_inspection import (  # noqa: E402
+    inspect_image_bytes, inspect_upload, lsb_entropies, downsampled_gray, svd_suspicious, inspection_stats,
+    shutdown_inspection_pool
+)
+
+SIZES = [(640, 480), (1600, 1200), (2592, 1944)]
+LEGACY_SVD_MAX_PIXELS = int(os.getenv("INSPECTION_BENCH_LEGACY_SVD_MAX_PIXELS", str(1600 * 1200)))
+
+
+def legacy_lsb_entropies(img) -> list:
+    """The previous detect_lsb_steganography entropy computation"""
+    img_array = np.array(img)
+    entropies = []
+    for channel in range(min(3, img_array.shape[2])):
+        unique, counts = np.unique(img_array[:, :, channel] & 1, return_counts=True)
+        if len(unique) > 1:
+            total_pixels = np.sum(counts)
+            entropies.append(-np.sum((counts / total_pixels) * np.log2(counts / total_pixels)))
+        else:
+            entropies.append(0.0)
+    return entropies
+
+
+def legacy_svd(img):
+    """The previous detect_svd_steganography decomposition"""
+    img_array = np.array(img.convert('L'), dtype=np.float64)
+    return np.linalg.svd(img_array, full_matrices=False)
+
+
+def synthetic_photo(width: int, height: int, seed: int = 0) -> bytes:
+    """Smooth scene plus sensor noise, JPEG encoded like the ESP32-CAM uploads"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    scene = np.stack([128 + 100 * np.sin(x / (37 + 5 * c)) * np.cos(y / (53 + 7 * c)) for c in range(3)], axis=-1)
+    scene += rng.normal(0, 6, scene.shape)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(scene, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+
+async def loop_stall_during(coro) -> tuple:
+    """Run coro while a 10 ms ticker measures the longest event loop stall"""
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        loop = asyncio.get_running_loop()
+        while not done.is_set():
+            before = loop.time()
+            await asyncio.sleep(0.01)
+            stalls.append((loop.time() - before - 0.01) * 1000)
+
+    task = asyncio.create_task(ticker())
+    result = await coro
+    done.set()
+    await task
+    return result, max(stalls, default=0.0)
+
+
+def main():
+    print(f"🧪 Upload inspection benchmark (budget {upload_inspection.UPLOAD_INSPECTION_BUDGET}s)")
+    print("=" * 92)
+    print(f"{'image':<11} {'lsb before':>11} {'after':>8} {'svd before':>11} {'after':>8} {'pipeline':>9}  verdict")
+    ok = True
+    photos = {}
+    for width, height in SIZES:
+        data = synthetic_photo(width, height)
+        photos[(width, height)] = data
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        expected, legacy_lsb_ms = timed(legacy_lsb_entropies, img)
+        entropies, lsb_ms = timed(lambda: lsb_entropies(np.asarray(img)))
+        if not np.allclose(entropies, expected):
+            print(f"❌ {width}x{height}: LSB entropies {entropies} differ from {expected}")
+            ok = False
+        if width * height <= LEGACY_SVD_MAX_PIXELS:
+            _, legacy_svd_ms = timed(legacy_svd, img)
+            legacy_svd_col = f"{legacy_svd_ms:>9.0f}ms"
+        else:
+            legacy_svd_col = f"{'skipped':>11}"
+        _, svd_ms = timed(lambda: svd_suspicious(downsampled_gray(img)))
+        verdict, pipeline_ms = timed(inspect_image_bytes, data, 30.0)
+        summary = ",".join(verdict["findings"]) or "clean"
+        print(f"{width}x{height:<6} {legacy_lsb_ms:>9.1f}ms {lsb_ms:>6.1f}ms {legacy_svd_col} {svd_ms:>6.1f}ms "
+              f"{pipeline_ms:>7.1f}ms  {summary}")
+
+    # the budget stops the tile loop
+    data = photos[SIZES[-1]]
+    if svd_suspicious(downsampled_gray(Image.open(io.BytesIO(data))), deadline=time.monotonic()) is not None:
+        print("❌ an expired deadline did not stop the SVD stage")
+        ok = False
+
+    async def pipeline():
+        first, first_stall = await loop_stall_during(inspect_upload(data))
+        started = time.perf_counter()
+        second = await inspect_upload(data)
+        cached_ms = (time.perf_counter() - started) * 1000
+        return first, first_stall, second, cached_ms
+
+    first, stall_ms, second, cached_ms = asyncio.run(pipeline())
+    shutdown_inspection_pool()
+    print(f"async pipeline: {first['elapsed_ms']:.1f}ms in worker, longest loop stall {stall_ms:.1f}ms, "
+          f"cached repeat {cached_ms:.2f}ms")
+    print(f"stats: {inspection_stats()}")
+    if first["complete"] and second is not first:
+        print("❌ verdict cache missed on the same file")
+        ok = False
+    if stall_ms > 50:
+        print(f"❌ event loop stalled for {stall_ms:.1f}ms during inspection")
+        ok = False
+
+    print("=" * 92)
+    print("✅ Upload inspection checks passed" if ok else "❌ Upload inspection checks failed")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
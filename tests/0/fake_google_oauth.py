@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Google's OAuth / OpenID endpoints
+Serves a discovery document, a JWKS (with Cache-Control max-age like Google), a token endpoint that issues
+RS256-signed id_tokens and a userinfo endpoint. Counts requests per path and client connections, and can
+rotate its signing key. Used by test_google_oidc.py; for manual runs:
+
+    python tests/0/fake_google_oauth.py --port 8098
+    GOOGLE_DISCOVERY_URL=http://127.0.0.1:8098/.well-known/openid-configuration python server_fastapi.py
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+class FakeGoogleOAuth:
+    def __init__(self, port: int = 0, client_id: str = "test-client.apps.googleusercontent.com",
+                 jwks_max_age: int = 3600):
+        self.client_id = client_id
+        self.jwks_max_age = jwks_max_age
+        self.user = {"sub": "1234567890", "email": "user@example.com", "email_verified": True,
+                     "name": "Test User", "picture": "https://example.com/u.png"}
+        self.hits = collections.Counter()  # path -> requests
+        self.connections = set()  # client (host, port) pairs seen: one per keep-alive connection
+        self._kids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.keys = {}
+        self.rotate_key()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def discovery_url(self) -> str:
+        return self.base_url + "/.well-known/openid-configuration"
+
+    def rotate_key(self) -> str:
+        """New signing key; the JWKS publishes it alongside the previous ones"""
+        kid = f"key-{next(self._kids)}"
+        self.keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.kid = kid
+        return kid
+
+    def id_token(self, audience: str = None, kid: str = None, issuer: str = None, expires_in: int = 3600,
+                 key=None) -> str:
+        now = int(time.time())
+        claims = {**self.user, "iss": issuer or self.base_url, "aud": audience or self.client_id,
+                  "iat": now, "exp": now + expires_in}
+        kid = kid or self.kid
+        return jwt.encode(claims, key or self.keys.get(kid) or self.keys[self.kid], algorithm="RS256",
+                          headers={"kid": kid})
+
+    def _jwks(self) -> dict:
+        keys = []
+        for kid, private_key in self.keys.items():
+            jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+            keys.append({**jwk, "kid": kid, "alg": "RS256", "use": "sig"})
+        return {"keys": keys}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, body: dict, headers: dict = None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def record(self):
+                with fake._lock:
+                    fake.hits[self.path.split("?")[0]] += 1
+                    fake.connections.add(self.client_address)
+
+            def do_GET(self):
+                self.record()
+                if self.path == "/.well-known/openid-configuration":
+                    return self.reply(200, {
+                        "issuer": fake.base_url,
+                        "authorization_endpoint": fake.base_url + "/o/oauth2/v2/auth",
+                        "token_endpoint": fake.base_url + "/token",
+                        "userinfo_endpoint": fake.base_url + "/v1/userinfo",
+                        "jwks_uri": fake.base_url + "/oauth2/v3/certs",
+                    }, {"Cache-Control": "public, max-age=3600"})
+                if self.path == "/oauth2/v3/certs":
+                    return self.reply(200, fake._jwks(), {"Cache-Control": f"public, max-age={fake.jwks_max_age}"})
+                if self.path == "/v1/userinfo":
+                    if not self.headers.get("Authorization", "").startswith("Bearer "):
+                        return self.reply(401, {"error": "invalid_token"})
+                    return self.reply(200, fake.user)
+                self.reply(404, {"error": "not_found"})
+
+            def do_POST(self):
+                self.record()
+                form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+                if self.path != "/token":
+                    return self.reply(404, {"error": "not_found"})
+                if not form.get("code") or form.get("client_id", [""])[0] != fake.client_id:
+                    return self.reply(400, {"error": "invalid_grant"})
+                self.reply(200, {"access_token": f"ya29.{form['code'][0]}", "expires_in": 3599,
+                                 "token_type": "Bearer", "scope": "openid email profile",
+                                 "id_token": fake.id_token()})
+
+        return Handler
+
+    def start(self) -> "FakeGoogleOAuth":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+    fake = FakeGoogleOAuth(args.port)
+    print(f"🔑 Fake Google OAuth on {fake.discovery_url} (client_id {fake.client_id})")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
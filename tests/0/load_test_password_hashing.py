@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Load test for core/password_hashing.py
+Simulates a 30 fps video stream on the event loop and measures how late its frames are while a login storm
+verifies passwords, first with bcrypt called inline (as login did before) and then on the bounded worker pool
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from fastapi import HTTPException  # noqa: E402
+
+from core import password_hashing  # noqa: E402
+from core.password_hashing import (  # noqa: E402
+    hash_password_sync, verify_password_sync, verify_password_async, needs_rehash, password_hash_stats
+)
+
+FRAME_INTERVAL = 1 / 30
+STORM_LOGINS = int(os.getenv("HASH_LOAD_LOGINS", "200"))
+STORM_SECONDS = float(os.getenv("HASH_LOAD_SECONDS", "4"))
+INLINE_LOGINS = int(os.getenv("HASH_LOAD_INLINE_LOGINS", "12"))
+# frame lateness allowed on top of the idle baseline while the pool is busy
+MAX_EXTRA_P99_MS = float(os.getenv("HASH_LOAD_MAX_EXTRA_P99_MS", "15"))
+
+
+async def stream(stop: asyncio.Event, lateness: list):
+    """Frame loop: records how late each frame is relative to its schedule (ms)"""
+    loop = asyncio.get_running_loop()
+    next_frame = loop.time()
+    while not stop.is_set():
+        next_frame += FRAME_INTERVAL
+        await asyncio.sleep(max(0.0, next_frame - loop.time()))
+        lateness.append(max(0.0, loop.time() - next_frame) * 1000)
+
+
+async def measure(storm) -> dict:
+    lateness = []
+    stop = asyncio.Event()
+    streamer = asyncio.create_task(stream(stop, lateness))
+    await asyncio.sleep(0.2)
+    lateness.clear()
+    result = await storm()
+    stop.set()
+    await streamer
+    lateness.sort()
+    return {
+        "p50": statistics.median(lateness),
+        "p99": lateness[int(len(lateness) * 0.99) - 1] if len(lateness) >= 100 else lateness[-1],
+        "max": lateness[-1],
+        "frames": len(lateness),
+        **(result or {}),
+    }
+
+
+def report(name: str, stats: dict):
+    extra = ""
+    if "ok" in stats:
+        extra = f"  ok={stats['ok']} 429={stats['rejected']} reject={stats['reject_ms']:.2f}ms"
+    print(f"{name:<18} p50={stats['p50']:>7.1f}ms p99={stats['p99']:>7.1f}ms max={stats['max']:>7.1f}ms"
+          f" frames={stats['frames']:>4}{extra}")
+
+
+def main():
+    password = "S3cure!Pass#2024"
+    stored = hash_password_sync(password)
+    print(f"🧪 Password hashing load test (rounds={password_hashing.BCRYPT_ROUNDS}, "
+          f"workers={password_hashing.PASSWORD_HASH_WORKERS}, max pending={password_hashing.PASSWORD_HASH_MAX_PENDING})")
+    print("=" * 96)
+    ok = True
+
+    async def idle():
+        await asyncio.sleep(STORM_SECONDS / 2)
+
+    async def inline_storm():
+        # the previous login: bcrypt.checkpw directly in the handler
+        async def login():
+            await asyncio.sleep(0)
+            verify_password_sync(password, stored)
+        await asyncio.gather(*(login() for _ in range(INLINE_LOGINS)))
+
+    async def pooled_storm():
+        counts = {"ok": 0, "rejected": 0}
+        reject_times = []
+
+        async def login(delay: float):
+            await asyncio.sleep(delay)
+            started = time.perf_counter()
+            try:
+                if await verify_password_async(password, stored):
+                    counts["ok"] += 1
+            except HTTPException as e:
+                assert e.status_code == 429 and "Retry-After" in e.headers
+                reject_times.append((time.perf_counter() - started) * 1000)
+                counts["rejected"] += 1
+        await asyncio.gather(*(login(i * STORM_SECONDS / STORM_LOGINS) for i in range(STORM_LOGINS)))
+        return {**counts, "reject_ms": max(reject_times, default=0.0)}
+
+    baseline = asyncio.run(measure(idle))
+    report("idle", baseline)
+    inline = asyncio.run(measure(inline_storm))
+    report(f"inline x{INLINE_LOGINS}", inline)
+    pooled = asyncio.run(measure(pooled_storm))
+    report(f"pool x{STORM_LOGINS}", pooled)
+    print(f"pool stats: {password_hash_stats()}")
+
+    if pooled["p99"] > baseline["p99"] + MAX_EXTRA_P99_MS:
+        print(f"❌ stream p99 grew by {pooled['p99'] - baseline['p99']:.1f}ms during the pooled storm")
+        ok = False
+    if pooled["ok"] + pooled["rejected"] != STORM_LOGINS or pooled["ok"] == 0:
+        print(f"❌ {pooled['ok']} logins verified and {pooled['rejected']} rejected out of {STORM_LOGINS}")
+        ok = False
+    if pooled["rejected"] and pooled["reject_ms"] > 5:
+        print(f"❌ saturated requests took {pooled['reject_ms']:.1f}ms to be rejected")
+        ok = False
+    stats = password_hash_stats()
+    if stats["pending"] or stats["peak_pending"] > password_hashing.PASSWORD_HASH_MAX_PENDING:
+        print(f"❌ queue depth not bounded: {stats}")
+        ok = False
+
+    # rehash-on-login: hashes at another cost factor are flagged for upgrade
+    old_rounds = 4 if password_hashing.BCRYPT_ROUNDS != 4 else 5
+    if not needs_rehash(hash_password_sync(password, rounds=old_rounds)) or needs_rehash(stored):
+        print("❌ needs_rehash does not follow BCRYPT_ROUNDS")
+        ok = False
+
+    print("=" * 96)
+    print("✅ Stream latency stays flat during the login storm" if ok else "❌ Password hashing load test failed")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the melipayamak REST gateway (POST /api/SendSMS/SendSMS)
+Records every message and connection, and can inject latency, 5xx failures or rejections. Used by
+test_sms_gateway.py; for manual runs start it and point the server at it:
+
+    python tests/0/stub_sms_gateway.py --port 8099
+    SMS_GATEWAY_URL=http://127.0.0.1:8099/api/SendSMS/ python server_fastapi.py
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StubSmsGateway:
+    def __init__(self, port: int = 0, latency: float = 0.0):
+        self.latency = latency
+        self.fail_next = 0       # answer the next N requests with 503
+        self.reject_next = 0     # answer the next N requests with RetStatus 0 (e.g. invalid number)
+        self.messages = []       # (to, text) accepted
+        self.requests = 0
+        self.connections = set()  # client (host, port) pairs seen: one per keep-alive connection
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/api/SendSMS/"
+
+    def _handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode())
+                with gateway._lock:
+                    gateway.requests += 1
+                    gateway.connections.add(self.client_address)
+                    if gateway.fail_next:
+                        gateway.fail_next -= 1
+                        status = 503
+                    elif gateway.reject_next:
+                        gateway.reject_next -= 1
+                        status = 0
+                    else:
+                        status = 1
+                if gateway.latency:
+                    time.sleep(gateway.latency)
+                if not self.path.endswith("/SendSMS"):
+                    return self.reply(404, {"error": "unknown method"})
+                if status == 503:
+                    return self.reply(503, {"error": "unavailable"})
+                if status == 0:
+                    return self.reply(200, {"Value": "", "RetStatus": 0, "StrRetStatus": "InvalidNumber"})
+                with gateway._lock:
+                    gateway.messages.append((form.get("to", [""])[0], form.get("text", [""])[0]))
+                    rec_id = next(gateway._ids)
+                self.reply(200, {"Value": str(rec_id), "RetStatus": 1, "StrRetStatus": "Ok"})
+
+        return Handler
+
+    def start(self) -> "StubSmsGateway":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubSmsGateway(args.port, args.latency)
+    print(f"📱 Stub SMS gateway on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for restoring the database from core/backup.py backups (core/db.py restore_db_from_backup)
+Covers restoring past a corrupt full backup: the corrupt base and the differentials built on it are dropped
+from the manifest and from disk, and an older full backup is used instead
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix="backup_restore_")
+os.environ["DB_FILE"] = os.path.join(WORK_DIR, "test.db")
+os.environ["BACKUP_DIR"] = os.path.join(WORK_DIR, "backups")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from core import backup, db  # noqa: E402
+from core.config import DB_FILE, BACKUP_DIR  # noqa: E402
+
+
+def write_rows(*values):
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("CREATE TABLE IF NOT EXISTS items (value TEXT)")
+    conn.executemany("INSERT INTO items (value) VALUES (?)", [(v,) for v in values])
+    conn.commit()
+    conn.close()
+
+
+def read_rows():
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        return [row[0] for row in conn.execute("SELECT value FROM items ORDER BY rowid")]
+    finally:
+        conn.close()
+
+
+def test_restore_past_corrupt_base():
+    write_rows("a")
+    good = backup.run_backup(DB_FILE, differential=False)
+    time.sleep(1.1)  # backup names carry second-resolution timestamps
+    write_rows("b")
+    corrupt_base = backup.run_backup(DB_FILE, differential=True)
+    time.sleep(1.1)
+    write_rows("c")
+    diff = backup.run_backup(DB_FILE, differential=True)
+    assert corrupt_base["kind"] == "full" and diff["kind"] == "diff" and diff["base"] == corrupt_base["file"]
+
+    with open(os.path.join(BACKUP_DIR, corrupt_base["file"]), "wb") as f:
+        f.write(b"not a gzip file")
+    with open(DB_FILE, "wb") as f:
+        f.write(b"garbage")
+
+    async def no_init():
+        return None
+    init_db, db.init_db = db.init_db, no_init
+    try:
+        restored = asyncio.run(db.restore_db_from_backup())
+    finally:
+        db.init_db = init_db
+
+    assert restored
+    assert read_rows() == ["a"], read_rows()
+    assert [e["file"] for e in backup.load_manifest()["backups"]] == [good["file"]]
+    for name in (corrupt_base["file"], diff["file"]):
+        assert not os.path.exists(os.path.join(BACKUP_DIR, name)), name
+    # later backups and restores only see what is on disk
+    assert backup.restore_candidates() == backup.load_manifest()["backups"]
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests for the derivative job queue (core/derivatives.py) as the gallery drives it
+Covers idempotent enqueueing and that a photo whose derivative build failed is not queued again on every
+gallery page load
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix="derivative_queue_")
+os.environ["DB_FILE"] = os.path.join(WORK_DIR, "test.db")
+os.environ["BACKUP_DIR"] = os.path.join(WORK_DIR, "backups")
+os.environ["GALLERY_DIR"] = os.path.join(WORK_DIR, "gallery")
+os.environ["SECURITY_VIDEOS_DIR"] = os.path.join(WORK_DIR, "security_videos")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from core import client, db, derivatives  # noqa: E402
+from core.config import DB_FILE, GALLERY_DIR  # noqa: E402
+
+USER = {"sub": "admin", "username": "admin"}
+
+
+def add_photo(filename: str, data: bytes):
+    os.makedirs(GALLERY_DIR, exist_ok=True)
+    path = os.path.join(GALLERY_DIR, filename)
+    with open(path, "wb") as f:
+        f.write(data)
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute("INSERT INTO manual_photos (filename, filepath, size, mtime) VALUES (?, ?, ?, ?)",
+                 (filename, path, len(data), time.time()))
+    conn.commit()
+    conn.close()
+
+
+def test_failed_photo_is_not_requeued():
+    async def scenario():
+        await db.init_db()
+        add_photo("broken.jpg", b"\xff\xd8 not really a jpeg")
+        derivatives._queue = asyncio.Queue(maxsize=derivatives.DERIVATIVE_QUEUE_SIZE)
+        derivatives._pending.clear()
+        derivatives._failed.clear()
+
+        await client.get_gallery(user=USER)
+        await client.get_gallery(user=USER)
+        queued_before = derivatives._queue.qsize()  # queued once, not once per page load
+        job = derivatives._queue.get_nowait()
+        derivatives._pending.discard(job)
+        await derivatives.process_job(*job)  # the build fails and is recorded
+
+        for _ in range(3):
+            await client.get_gallery(user=USER)
+        return queued_before, job, derivatives._queue.qsize(), derivatives.enqueue_photo("broken.jpg")
+
+    queued_before, job, queued_after, enqueued = asyncio.run(scenario())
+    assert queued_before == 1 and job == ("photo", "broken.jpg"), (queued_before, job)
+    assert job in derivatives._failed
+    assert queued_after == 0 and not enqueued, (queued_after, enqueued)
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
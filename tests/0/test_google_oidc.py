@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for core/google_oidc.py against the local fake OAuth server (fake_google_oauth.py)
+Covers the sign-in round trips over the shared client, discovery/JWKS caching (including concurrent cold
+starts, max-age expiry and key rotation) and local id_token verification
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from fake_google_oauth import FakeGoogleOAuth  # noqa: E402
+from core import google_oidc  # noqa: E402
+from core.google_oidc import (  # noqa: E402
+    get_http_client, close_http_client, endpoint, verify_id_token, warm_up, IdTokenError
+)
+
+
+def run(fake: FakeGoogleOAuth, scenario):
+    async def main():
+        google_oidc.oidc_metadata_cache.clear()
+        try:
+            return await scenario()
+        finally:
+            await close_http_client()
+    try:
+        return asyncio.run(main())
+    finally:
+        fake.stop()
+
+
+async def sign_in(fake: FakeGoogleOAuth, code: str) -> dict:
+    """Token exchange plus local id_token verification, as google_auth_callback does it"""
+    token_url = await endpoint("token_endpoint", discovery_url=fake.discovery_url)
+    response = await get_http_client().post(token_url, data={"client_id": fake.client_id, "code": code,
+                                                             "grant_type": "authorization_code"})
+    response.raise_for_status()
+    return await verify_id_token(response.json()["id_token"], fake.client_id, fake.discovery_url)
+
+
+async def legacy_sign_in(fake: FakeGoogleOAuth, code: str) -> dict:
+    """The previous flow: a new client for the token exchange and another for userinfo"""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(fake.base_url + "/token", data={"client_id": fake.client_id, "code": code})
+        access_token = response.json()["access_token"]
+    async with httpx.AsyncClient() as client:
+        response = await client.get(fake.base_url + "/v1/userinfo", headers={"Authorization": f"Bearer {access_token}"})
+        return response.json()
+
+
+def test_sign_in_round_trips():
+    fake = FakeGoogleOAuth().start()
+
+    async def scenario():
+        await warm_up(fake.discovery_url)
+        fake.hits.clear()
+        fake.connections.clear()
+        started = time.perf_counter()
+        for i in range(10):
+            claims = await sign_in(fake, f"code-{i}")
+            assert claims["sub"] == fake.user["sub"] and claims["email"] == fake.user["email"]
+        pooled_ms = (time.perf_counter() - started) / 10 * 1000
+        pooled_hits, pooled_connections = dict(fake.hits), len(fake.connections)
+
+        fake.hits.clear()
+        fake.connections.clear()
+        started = time.perf_counter()
+        for i in range(10):
+            await legacy_sign_in(fake, f"code-{i}")
+        legacy_ms = (time.perf_counter() - started) / 10 * 1000
+        print(f"   sign-in: {pooled_ms:.2f} ms pooled + local id_token, {legacy_ms:.2f} ms before")
+        return pooled_hits, pooled_connections, dict(fake.hits), len(fake.connections)
+
+    pooled_hits, pooled_connections, legacy_hits, legacy_connections = run(fake, scenario)
+    # one request per sign-in (token exchange), all over one kept-alive connection
+    assert pooled_hits == {"/token": 10}, pooled_hits
+    assert pooled_connections == 1, pooled_connections
+    assert sum(legacy_hits.values()) == 20 and legacy_connections == 20, (legacy_hits, legacy_connections)
+
+
+def test_concurrent_cold_start_fetches_metadata_once():
+    fake = FakeGoogleOAuth().start()
+    token = fake.id_token()
+
+    async def scenario():
+        return await asyncio.gather(*(verify_id_token(token, fake.client_id, fake.discovery_url) for _ in range(20)))
+
+    results = run(fake, scenario)
+    assert len(results) == 20
+    assert fake.hits["/.well-known/openid-configuration"] == 1 and fake.hits["/oauth2/v3/certs"] == 1, fake.hits
+
+
+def test_rejects_invalid_id_tokens():
+    fake = FakeGoogleOAuth().start()
+    impostor_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    bad_tokens = {
+        "wrong audience": fake.id_token(audience="someone-else.apps.googleusercontent.com"),
+        "expired": fake.id_token(expires_in=-3600),
+        "foreign signature": fake.id_token(key=impostor_key),
+        "wrong issuer": fake.id_token(issuer="https://evil.example.com"),
+        "malformed": "not.a.jwt",
+    }
+
+    async def scenario():
+        rejected = []
+        for reason, token in bad_tokens.items():
+            try:
+                await verify_id_token(token, fake.client_id, fake.discovery_url)
+            except IdTokenError:
+                rejected.append(reason)
+        return rejected
+
+    rejected = run(fake, scenario)
+    assert rejected == list(bad_tokens), rejected
+
+
+def test_key_rotation_refetches_jwks():
+    fake = FakeGoogleOAuth().start()
+
+    async def scenario():
+        await verify_id_token(fake.id_token(), fake.client_id, fake.discovery_url)
+        fake.rotate_key()
+        interval = google_oidc.JWKS_MIN_REFRESH_INTERVAL
+        google_oidc.JWKS_MIN_REFRESH_INTERVAL = 0.0
+        try:
+            await verify_id_token(fake.id_token(), fake.client_id, fake.discovery_url)
+        finally:
+            google_oidc.JWKS_MIN_REFRESH_INTERVAL = interval
+        refreshed = fake.hits["/oauth2/v3/certs"]
+        # a kid that is still unknown right after a refresh does not trigger another fetch
+        try:
+            await verify_id_token(fake.id_token(kid="key-999"), fake.client_id, fake.discovery_url)
+            return refreshed, False
+        except IdTokenError:
+            return refreshed, True
+
+    refreshed, unknown_rejected = run(fake, scenario)
+    assert refreshed == 2, refreshed
+    assert unknown_rejected and fake.hits["/oauth2/v3/certs"] == 2, fake.hits
+
+
+def test_jwks_max_age_honoured():
+    fake = FakeGoogleOAuth(jwks_max_age=1).start()
+
+    async def scenario():
+        await verify_id_token(fake.id_token(), fake.client_id, fake.discovery_url)
+        await verify_id_token(fake.id_token(), fake.client_id, fake.discovery_url)
+        cached = fake.hits["/oauth2/v3/certs"]
+        await asyncio.sleep(1.1)
+        await verify_id_token(fake.id_token(), fake.client_id, fake.discovery_url)
+        return cached, fake.hits["/oauth2/v3/certs"]
+
+    assert run(fake, scenario) == (1, 2)
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
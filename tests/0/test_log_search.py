@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the /search_logs endpoint (core/client.py search_logs_endpoint) over the FTS5 log index
+Covers a search against a fresh database and the 503 answer when log search is unavailable (SQLite without
+FTS5, or index not ready) instead of a generic 500
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+WORK_DIR = tempfile.mkdtemp(prefix="log_search_")
+os.environ["DB_FILE"] = os.path.join(WORK_DIR, "test.db")
+os.environ["BACKUP_DIR"] = os.path.join(WORK_DIR, "backups")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from fastapi import HTTPException  # noqa: E402
+from core import client, db  # noqa: E402
+
+USER = {"sub": "admin", "username": "admin"}
+
+
+def test_search_finds_logs():
+    async def scenario():
+        await db.init_db()
+        await db.insert_log("Motion detected near the garage door", "security")
+        return await client.search_logs_endpoint("garage", user=USER)
+    result = asyncio.run(scenario())
+    assert db.log_search_available
+    assert result["count"] >= 1 and "garage" in result["results"][0]["snippet"].lower(), result
+
+
+def test_unavailable_search_is_503():
+    available = db.log_search_available
+    db.log_search_available = False
+    try:
+        asyncio.run(client.search_logs_endpoint("garage", user=USER))
+        status = None
+    except HTTPException as e:
+        status, detail = e.status_code, e.detail
+    finally:
+        db.log_search_available = available
+    assert status == 503 and "unavailable" in detail.lower(), status
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
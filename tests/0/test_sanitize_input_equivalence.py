@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Equivalence tests for the precompiled sanitize_input in core/sanitize_validate.py
+The previous implementation is kept below verbatim (legacy_*) as the reference: for every input the
+new sanitizer must return the same string, and raise in the same cases
+"""
+
+import os
+import random
+import sys
+
+os.environ["TEST_MODE"] = "false"
+os.environ["ENVIRONMENT"] = "production"  # sanitize_input is a no-op in test/development environments
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import re  # noqa: E402
+import unicodedata  # noqa: E402
+import logging  # noqa: E402
+from fastapi import HTTPException  # noqa: E402
+from core.sanitize_validate import (  # noqa: E402
+    sanitize_input, sanitize_sensitive_info, basic_sanitize_input,
+    SECURITY_CONFIG, BLEACH_AVAILABLE, BLEACH_CONFIG
+)
+
+if BLEACH_AVAILABLE:
+    import bleach  # noqa: F401
+
+logger = logging.getLogger("sanitize_reference")
+logger.disabled = True
+logging.getLogger("sanitize").disabled = True
+
+
+# ============================================================================
+# REFERENCE: previous implementation
+# ============================================================================
+
+def legacy_sanitize_sensitive_info(input_str: str) -> str:
+    """Sanitize sensitive information from input strings"""
+    if not input_str:
+        return input_str
+    
+    # Patterns for sensitive information (remove entire key-value pair)
+    sensitive_patterns = [
+        r'password\s*=\s*[^\s,;]+',
+        r'secret\s*=\s*[^\s,;]+',
+        r'key\s*=\s*[^\s,;]+',
+        r'token\s*=\s*[^\s,;]+',
+        r'api_key\s*=\s*[^\s,;]+',
+        r'access_token\s*=\s*[^\s,;]+',
+        r'private_key\s*=\s*[^\s,;]+',
+        r'secret_key\s*=\s*[^\s,;]+',
+        r'password\s*:\s*[^\s,;]+',
+        r'secret\s*:\s*[^\s,;]+',
+        r'key\s*:\s*[^\s,;]+',
+        r'token\s*:\s*[^\s,;]+',
+        r'password=[^\s,;]+',
+        r'secret=[^\s,;]+',
+        r'key=[^\s,;]+',
+        r'token=[^\s,;]+',
+    ]
+    
+    for pattern in sensitive_patterns:
+        input_str = re.sub(pattern, '', input_str, flags=re.IGNORECASE)
+    
+    # Remove leftover double spaces, commas, or colons
+    input_str = re.sub(r'\s{2,}', ' ', input_str)
+    input_str = re.sub(r',\s*,', ',', input_str)
+    input_str = re.sub(r':\s*:', ':', input_str)
+    input_str = input_str.strip(' ,:;')
+    return input_str
+
+
+
+
+def legacy_sanitize_input(input_str: str, content_type: str = 'text', raise_on_detection: bool = False) -> str:
+    """Enhanced input sanitization with comprehensive security protection"""
+    if not input_str:
+        return input_str
+    
+    # Convert to string if needed
+    input_str = str(input_str)
+    
+    
+    # Remove null bytes and control characters
+    input_str = input_str.replace('\x00', '')
+    input_str = ''.join(char for char in input_str if ord(char) >= 32 or char in '\n\t\r')
+    
+    # Sanitize sensitive information
+    input_str = legacy_sanitize_sensitive_info(input_str)
+    
+    # Enhanced security patterns for all content types
+    security_patterns = {
+        'sql_injection': [
+            r'\b(union|select|insert|update|delete|drop|create|alter|exec|execute|xp_|sp_)\b',
+            r'(--|#|/\*|\*/)',
+            r'\b(and|or)\b\s+\d+\s*[=<>]',
+            r'\b(union|select)\b.*\bfrom\b',
+            r'\bwaitfor\b\s+delay',
+            r'\bchar\b\s*\(\s*\d+\s*\)',
+            r'\bcast\b|\bconvert\b',
+            r'\b@@version\b|\b@@servername\b|\b@@hostname\b',
+            r'\bopenrowset\b|\bopendatasource\b',
+            r'\binformation_schema\b',
+            r'\bsys\.tables\b|\bsys\.columns\b',
+            r'\bbackup\b|\brestore\b',
+            r'\btruncate\b|\bdelete\b\s+from'
+        ],
+        'xss': [
+            r'<script[^>]*>.*?</script>',
+            r'<iframe[^>]*>.*?</iframe>',
+            r'<object[^>]*>.*?</object>',
+            r'<embed[^>]*>.*?</embed>',
+            r'<form[^>]*>.*?</form>',
+            r'<input[^>]*>',
+            r'<textarea[^>]*>.*?</textarea>',
+            r'<select[^>]*>.*?</select>',
+            r'<button[^>]*>.*?</button>',
+            r'<link[^>]*>',
+            r'<meta[^>]*>',
+            r'<style[^>]*>.*?</style>',
+            r'<link[^>]*>',
+            r'javascript:', r'vbscript:', r'data:', r'about:',
+            r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:',
+            r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a',
+            r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a',
+            r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',
+            r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',
+            r'on\w+\s*=',  # Event handlers
+            r'expression\s*\(',  # CSS expressions
+            r'url\s*\(\s*javascript:',  # CSS javascript URLs
+        ],
+        'command_injection': [
+            r'[;&|`]\s*[a-zA-Z]',
+            r'\$\s*\([^)]*\)',
+            r'`[^`]*`',
+            r'rm\s+-rf',
+            r'format\s+[a-zA-Z]:',
+            r'fdisk\s+[a-zA-Z]:',
+            r'wget\s+http',
+            r'curl\s+http',
+            r'nc\s+-l',
+            r'bash\s+-i',
+            r'powershell\s+-c',
+            r'python\s+-c',
+            r'perl\s+-e',
+            r'exec\s*\(',
+            r'system\s*\(',
+            r'shell_exec\s*\(',
+        ],
+        'path_traversal': [
+            r'\.\./',
+            r'\.\.\\',
+            r'\.\.%2f',
+            r'\.\.%5c',
+            r'\.\.%252f',
+            r'\.\.%255c',
+            r'\.\.%c0%af',
+            r'\.\.%c1%9c',
+            r'/etc/passwd',
+            r'/etc/shadow',
+            r'C:\\windows\\system32',
+            r'C:\\windows\\syswow64',
+        ]
+    }
+    
+    # Check all security patterns
+    for pattern_type, patterns in security_patterns.items():
+        for pattern in patterns:
+            if re.search(pattern, input_str, re.IGNORECASE):
+                logger.warning(f"{pattern_type.upper()} pattern detected: {pattern}")
+                if raise_on_detection:
+                    raise HTTPException(status_code=400, detail=f"ورودی نامعتبر: {pattern_type.upper()} pattern detected")
+                # Replace with safe placeholder
+                input_str = re.sub(pattern, f'[{pattern_type.upper()}_BLOCKED]', input_str, flags=re.IGNORECASE)
+    
+    # Check for SQL injection patterns (only for database-related inputs)
+    if content_type in ['sql', 'query', 'database']:
+        for pattern in SECURITY_CONFIG['SQL_INJECTION_PATTERNS']:
+            if re.search(pattern, input_str, re.IGNORECASE):
+                logger.warning(f"SQL injection pattern detected: {pattern}")
+                return ''
+    
+    # Check for command injection patterns (only for command-related inputs)
+    if content_type in ['command', 'shell', 'exec', 'system']:
+        for pattern in SECURITY_CONFIG['COMMAND_INJECTION_PATTERNS']:
+            if re.search(pattern, input_str, re.IGNORECASE):
+                logger.warning(f"Command injection pattern detected: {pattern}")
+                return ''
+    
+    # Check for path traversal patterns (only for file-related inputs)
+    if content_type in ['file', 'path', 'filename']:
+        for pattern in SECURITY_CONFIG['PATH_TRAVERSAL_PATTERNS']:
+            if re.search(pattern, input_str, re.IGNORECASE):
+                logger.warning(f"Path traversal pattern detected: {pattern}")
+                return ''
+    
+    # For text content, check for dangerous patterns that could be used in any context
+    if content_type == 'text':
+        # Enhanced JavaScript protocol filtering
+        javascript_protocols = [
+            r'javascript:', r'vbscript:', r'data:', r'vbscript:', r'about:',
+            r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:',
+            r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a',
+            r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a',
+            r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded javascript:
+            r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded vbscript:
+        ]
+        
+        # Remove JavaScript protocols first
+        for protocol in javascript_protocols:
+            input_str = re.sub(protocol, '[PROTOCOL_BLOCKED]:', input_str, flags=re.IGNORECASE)
+        
+        # Command injection patterns
+        dangerous_command_patterns = [
+            r'[;&|`]\s*[a-zA-Z]',  # Command separators followed by commands
+            r'\$\s*\([^)]*\)',     # Command substitution
+            r'`[^`]*`',            # Backtick command substitution
+            r'rm\s+-rf',           # Dangerous rm command
+            r'format\s+[a-zA-Z]:', # Format command
+            r'fdisk\s+[a-zA-Z]:',  # Fdisk command
+            r'wget\s+http',        # Wget with URL
+            r'curl\s+http',        # Curl with URL
+            r'nc\s+-l',            # Netcat listener
+            r'bash\s+-i',          # Interactive bash
+            r'powershell\s+-c',    # PowerShell command
+            r'python\s+-c',        # Python command execution
+            r'perl\s+-e',          # Perl command execution
+        ]
+        
+        # SQL injection patterns for text content
+        dangerous_sql_patterns = [
+            r'\b(union|select|insert|update|delete|drop|create|alter|exec|execute)\b',
+            r'(--|#|/\*|\*/)',
+            r'\b(and|or)\b\s+\d+\s*[=<>]',
+            r'\b(union|select)\b.*\bfrom\b',
+            r'\bxp_cmdshell\b|\bsp_executesql\b',
+            r'\bwaitfor\b\s+delay',
+            r'\bchar\b\s*\(\s*\d+\s*\)',
+            r'\bcast\b|\bconvert\b',
+            r'\b@@version\b|\b@@servername\b|\b@@hostname\b',
+            r'\bopenrowset\b|\bopendatasource\b',
+            r'\binformation_schema\b',
+            r'\bsys\.tables\b|\bsys\.columns\b',
+            r'\bxp_|sp_',
+            r'\bbackup\b|\brestore\b',
+            r'\btruncate\b|\bdelete\b\s+from'
+        ]
+        
+        # Check for dangerous command patterns
+        for pattern in dangerous_command_patterns:
+            if re.search(pattern, input_str, re.IGNORECASE):
+                logger.warning(f"Dangerous command pattern detected in text: {pattern}")
+                # Replace dangerous patterns with safe alternatives
+                input_str = re.sub(pattern, '[COMMAND_BLOCKED]', input_str, flags=re.IGNORECASE)
+        
+        # Check for dangerous SQL patterns
+        for pattern in dangerous_sql_patterns:
+            if re.search(pattern, input_str, re.IGNORECASE):
+                logger.warning(f"Dangerous SQL pattern detected in text: {pattern}")
+                # Replace dangerous patterns with safe alternatives
+                input_str = re.sub(pattern, '[SQL_BLOCKED]', input_str, flags=re.IGNORECASE)
+    
+    # Use Bleach for HTML sanitization if available
+    if BLEACH_AVAILABLE and content_type in BLEACH_CONFIG:
+        config = BLEACH_CONFIG[content_type]
+        
+        try:
+            # Clean HTML content
+            cleaned = bleach.clean(
+                input_str,
+                tags=config['tags'],
+                attributes=config['attributes'],
+                protocols=config['protocols'],
+                strip=True
+            )
+            
+            # Additional security checks
+            if content_type == 'text':
+                # For plain text, ensure no HTML remains
+                if re.search(r'<[^>]*>', cleaned):
+                    logger.warning("HTML tags found in text content")
+                    return bleach.clean(cleaned, tags=[], strip=True)
+            
+            # Normalize Unicode characters
+            cleaned = unicodedata.normalize('NFKC', cleaned)
+            
+            # Remove control characters except newlines and tabs
+            cleaned = ''.join(char for char in cleaned if ord(char) >= 32 or char in '\n\t\r')
+            
+            return cleaned.strip()[:1000]  # Limit length
+            
+        except Exception as e:
+            logger.error(f"Error in Bleach sanitization: {e}")
+            # Fallback to basic sanitization
+            return legacy_basic_sanitize_input(input_str)
+    else:
+        # Fallback to basic sanitization
+        return legacy_basic_sanitize_input(input_str)
+
+
+def legacy_basic_sanitize_input(input_str: str) -> str:
+    """Basic sanitization fallback when Bleach is not available"""
+    if not input_str:
+        return input_str
+    
+    # HTML entity encoding for dangerous characters
+    dangerous_chars = {
+        '<': '&lt;',
+        '>': '&gt;',
+        '"': '&quot;',
+        "'": '&#x27;',
+        '&': '&amp;',
+        '(': '&#x28;',
+        ')': '&#x29;',
+        ';': '&#x3B;',
+        '+': '&#x2B;'
+    }
+    
+    for char, entity in dangerous_chars.items():
+        input_str = input_str.replace(char, entity)
+    
+    # Enhanced JavaScript protocol filtering
+    javascript_protocols = [
+        r'javascript:', r'vbscript:', r'data:', r'about:', r'chrome:', r'chrome-extension:',
+        r'javascript\s*:', r'vbscript\s*:', r'data\s*:', r'about\s*:', r'chrome\s*:', r'chrome-extension\s*:',
+        r'javascript%3a', r'vbscript%3a', r'data%3a', r'about%3a', r'chrome%3a', r'chrome-extension%3a',
+        r'javascript%253a', r'vbscript%253a', r'data%253a', r'about%253a', r'chrome%253a', r'chrome-extension%253a',
+        r'&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded javascript:
+        r'&#118;&#98;&#115;&#99;&#114;&#105;&#112;&#116;&#58;',  # URL encoded vbscript:
+        r'&#100;&#97;&#116;&#97;&#58;',  # URL encoded data:
+    ]
+    
+    # Remove JavaScript protocols first
+    for protocol in javascript_protocols:
+        input_str = re.sub(protocol, '[PROTOCOL_BLOCKED]:', input_str, flags=re.IGNORECASE)
+    
+    # Remove any remaining script-like content
+    input_str = re.sub(r'<script[^>]*>.*?</script>', '', input_str, flags=re.IGNORECASE | re.DOTALL)
+    input_str = re.sub(r'on\w+\s*=', '', input_str, flags=re.IGNORECASE)
+    
+    # Remove path traversal patterns
+    input_str = re.sub(r'\.\./', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'\.\.\\', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'%2e%2e%2f', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'%2e%2e%5c', '', input_str, flags=re.IGNORECASE)
+    
+    # Remove javascript: URLs more aggressively
+    input_str = re.sub(r'javascript:[^;\s]*', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'vbscript:[^;\s]*', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'data:text/html[^;\s]*', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'data:application/x-javascript[^;\s]*', '', input_str, flags=re.IGNORECASE)
+    
+    # Remove path traversal patterns more aggressively
+    input_str = re.sub(r'\.\./', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'\.\.\\', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'%2e%2e%2f', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'%2e%2e%5c', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'%252e%252e%252f', '', input_str, flags=re.IGNORECASE)
+    input_str = re.sub(r'%252e%252e%255c', '', input_str, flags=re.IGNORECASE)
+    
+    # Additional dangerous patterns
+    dangerous_patterns = [
+        r'data:text/html',
+        r'data:application/x-javascript',
+        r'data:application/ecmascript',
+        r'data:application/javascript',
+        r'<iframe[^>]*>',
+        r'<object[^>]*>',
+        r'<embed[^>]*>',
+        r'<form[^>]*>',
+        r'<input[^>]*>',
+        r'<textarea[^>]*>',
+        r'<select[^>]*>',
+        r'<link[^>]*>',
+        r'<meta[^>]*>',
+        r'<style[^>]*>',
+        r'<body[^>]*>',
+        r'<xmp[^>]*>',
+        r'<plaintext[^>]*>'
+    ]
+    
+    for pattern in dangerous_patterns:
+        input_str = re.sub(pattern, '', input_str, flags=re.IGNORECASE)
+    
+    return input_str.strip()[:1000]  # Limit length
+
+
+# ============================================================================
+# CORPUS
+# ============================================================================
+
+SAMPLES = [
+    "", "a", "0", "09123456789", "+989123456789", "123456", "ali_rashidi", "AliRashidi1990",
+    "user@example.com", "علی رشیدی", "سلام دنیا ۱۲۳", "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36",
+    "select", "SELECT", "Update", "backup", "restore", "cast", "convert", "truncate", "openrowset",
+    "opendatasource", "execute", "exec", "union", "drop", "alter", "create", "insert", "delete",
+    "selection", "updates", "dropbox", "creative", "casting",
+    "1 OR 1=1", "' OR '1'='1' --", "admin'--", "1; DROP TABLE users", "UNION SELECT password FROM users",
+    "waitfor delay '0:0:5'", "char(65)", "@@version", "information_schema.tables", "sys.tables",
+    "xp_cmdshell", "sp_executesql", "delete from users", "/* comment */", "a # b",
+    "<script>alert(1)</script>", "<SCRIPT src=x>\n</SCRIPT>", "<img src=x onerror=alert(1)>",
+    "<iframe src=//evil></iframe>", "<a href='javascript:alert(1)'>x</a>", "JaVaScRiPt :alert(1)",
+    "javascript%3aalert(1)", "javascript%253aalert(1)", "data:text/html;base64,PHNjcmlwdD4=",
+    "&#106;&#97;&#118;&#97;&#115;&#99;&#114;&#105;&#112;&#116;&#58;alert(1)", "expression(alert(1))",
+    "url(javascript:alert(1))", "<style>body{}</style>", "<meta http-equiv=refresh>", "<body onload=x>",
+    "; ls -la", "| cat /etc/passwd", "`id`", "$(whoami)", "rm -rf /", "format c:", "wget http://x",
+    "curl http://x", "nc -l 4444", "bash -i", "powershell -c x", "python -c 'x'", "perl -e x",
+    "exec(x)", "system(x)", "shell_exec(x)", "../../etc/passwd", "..\\..\\windows", "..%2f..%2f",
+    "..%252f", "..%c0%af", "C:\\windows\\system32", "%2e%2e%2f", "%252e%252e%252f",
+    "password=hunter2", "token: abc", "api_key=xyz, secret=1", "key=value;token=t", "a  b   c",
+    ",, ::", "  padded  ", "tab\tnew\nline\rreturn", "nul\x00byte", "bell\x07char\x1b[0m",
+    "chrome-extension://abc", "about:blank", "vbscript:msgbox", "a+b=c", "x" * 1500, "9" * 1200,
+]
+
+FUZZ_TOKENS = [
+    "select", "from", "union", "or", "and", "1", "=", "--", "#", "/*", "*/", ";", "&", "|", "`", "$(",
+    ")", "(", "<", ">", "script", "</script>", "<script>", "on", "load", "=", "javascript", ":",
+    "data", "%3a", "%253a", "../", "..\\", "%2e%2e%2f", "password", "token", "key", " ", "  ", ",",
+    "'", '"', "+", "علی", "۱۲۳", "\x00", "\x01", "\n", "\t", "rm", "-rf", "http", "wget", "exec",
+    "cast", "backup", "xp_", "sp_", "@@version", "<iframe>", "<input>", "&#58;", "chrome", "-", "_",
+]
+
+
+def fuzz_inputs(count: int, seed: int = 1234) -> list:
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FUZZ_TOKENS) for _ in range(rng.randint(1, 12))) for _ in range(count)]
+
+
+def outcome(func, *args, **kwargs):
+    try:
+        return ("ok", func(*args, **kwargs))
+    except HTTPException as e:
+        return ("raised", e.status_code, e.detail)
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+CONTENT_TYPES = ["text", "name", "email", "html"]
+
+
+def test_sanitize_sensitive_info_equivalence():
+    for value in SAMPLES + fuzz_inputs(2000, seed=1):
+        assert sanitize_sensitive_info(value) == legacy_sanitize_sensitive_info(value), repr(value)
+
+
+def test_basic_sanitize_input_equivalence():
+    for value in SAMPLES + fuzz_inputs(2000, seed=2):
+        assert basic_sanitize_input(value) == legacy_basic_sanitize_input(value), repr(value)
+
+
+def test_sanitize_input_equivalence():
+    for content_type in CONTENT_TYPES:
+        for value in SAMPLES + fuzz_inputs(3000, seed=CONTENT_TYPES.index(content_type)):
+            expected = outcome(legacy_sanitize_input, value, content_type)
+            assert outcome(sanitize_input, value, content_type) == expected, (content_type, repr(value))
+
+
+def test_sanitize_input_raise_on_detection_equivalence():
+    for value in SAMPLES + fuzz_inputs(3000, seed=3):
+        expected = outcome(legacy_sanitize_input, value, "text", raise_on_detection=True)
+        assert outcome(sanitize_input, value, "text", raise_on_detection=True) == expected, repr(value)
+
+
+def test_plain_text_fast_path():
+    # every keyword that can hit plain words still goes through the full pipeline
+    for value in ["select", "Select", "BACKUP", "convert", "openrowset", "truncate", "restore", "cast",
+                  "union all select name", "call sp_who now", "waitfor delay", "ſelect", "xp_cmdshell"]:
+        assert sanitize_input(value) == legacy_sanitize_input(value), repr(value)
+    for value in ["select", "union all select name", "waitfor delay"]:
+        assert sanitize_input(value) != value
+    for value in ["09123456789", "123456", "AliRashidi1990", "x" * 1500, "علی رشیدی", "Ali Rashidi", "Kelvin"]:
+        assert sanitize_input(value) == legacy_sanitize_input(value), repr(value)
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
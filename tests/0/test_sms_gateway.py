@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Tests for core/sms_gateway.py against the local stub gateway (stub_sms_gateway.py)
+Covers delivery, connection reuse, retries, rejections, per-phone dedupe and the send latency
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from stub_sms_gateway import StubSmsGateway  # noqa: E402
+from core.sms_gateway import SmsGateway, SmsDispatcher, to_local_number  # noqa: E402
+
+
+def run(stub: StubSmsGateway, scenario, **dispatcher_options):
+    async def main():
+        dispatcher = SmsDispatcher(SmsGateway("user", "pass", "5000", base_url=stub.url),
+                                   **{"backoff": 0.01, **dispatcher_options})
+        try:
+            return await scenario(dispatcher)
+        finally:
+            await dispatcher.close()
+    return asyncio.run(main())
+
+
+def test_send_and_connection_reuse():
+    stub = StubSmsGateway().start()
+    try:
+        async def scenario(dispatcher):
+            return await asyncio.gather(*(dispatcher.send(f"+98912000{i:04d}", f"code {i}") for i in range(40)))
+        results = run(stub, scenario, workers=2)
+        assert all(results)
+        assert len(stub.messages) == 40
+        assert ("09120000007", "code 7") in stub.messages
+        # two workers over keep-alive connections, not one connection per message
+        assert len(stub.connections) <= 2, stub.connections
+    finally:
+        stub.stop()
+
+
+def test_retries_transient_failures():
+    stub = StubSmsGateway().start()
+    stub.fail_next = 2
+    try:
+        async def scenario(dispatcher):
+            return await dispatcher.send("09120000001", "hello"), dispatcher.stats()
+        ok, stats = run(stub, scenario, max_retries=3)
+        assert ok and stub.requests == 3 and stats["retries"] == 2
+    finally:
+        stub.stop()
+
+
+def test_gives_up_after_max_retries():
+    stub = StubSmsGateway().start()
+    stub.fail_next = 10
+    try:
+        async def scenario(dispatcher):
+            return await dispatcher.send("09120000001", "hello")
+        assert run(stub, scenario, max_retries=2) is False
+        assert stub.requests == 3
+    finally:
+        stub.stop()
+
+
+def test_rejection_is_not_retried():
+    stub = StubSmsGateway().start()
+    stub.reject_next = 1
+    try:
+        async def scenario(dispatcher):
+            return await dispatcher.send("09120000001", "hello")
+        assert run(stub, scenario) is False
+        assert stub.requests == 1
+    finally:
+        stub.stop()
+
+
+def test_per_phone_dedupe():
+    stub = StubSmsGateway(latency=0.05).start()
+    try:
+        async def scenario(dispatcher):
+            # one worker busy with the first phone; the next three messages to 0912...2 wait in the queue
+            busy = dispatcher.submit("09120000001", "first")
+            recovery = dispatcher.submit("9120000002", "recovery", purpose="password_recovery")
+            waiting = [dispatcher.submit("9120000002", f"otp {i}", purpose="login_otp") for i in range(3)]
+            untagged = [dispatcher.submit("9120000002", f"note {i}") for i in range(2)]
+            return await busy, await asyncio.gather(recovery, *waiting, *untagged), dispatcher.stats()
+        busy, waiting, stats = run(stub, scenario, workers=1)
+        assert busy and all(waiting)
+        # only messages of the same purpose are merged: the recovery code and untagged messages survive
+        assert stub.messages == [("09120000001", "first"), ("09120000002", "recovery"), ("09120000002", "otp 2"),
+                                 ("09120000002", "note 0"), ("09120000002", "note 1")], stub.messages
+        assert stats["deduped"] == 2
+    finally:
+        stub.stop()
+
+
+def test_send_latency_has_no_setup_cost():
+    stub = StubSmsGateway().start()
+    try:
+        async def scenario(dispatcher):
+            await dispatcher.send("09120000001", "warm")
+            started = time.perf_counter()
+            for i in range(20):
+                await dispatcher.send("09120000001", f"otp {i}")
+            return (time.perf_counter() - started) / 20 * 1000
+        per_message_ms = run(stub, scenario)
+        print(f"   {per_message_ms:.2f} ms per OTP send over a warm connection")
+        assert per_message_ms < 20
+    finally:
+        stub.stop()
+
+
+def test_local_number_format():
+    assert to_local_number("+989121234567") == "09121234567"
+    assert to_local_number("989121234567") == "09121234567"
+    assert to_local_number("9121234567") == "09121234567"
+    assert to_local_number("09121234567") == "09121234567"
+
+
+if __name__ == "__main__":
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_") and callable(value)]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)